@@ -17,15 +17,9 @@ import os
 import logging
 from datetime import datetime
 
-try:
-    from PyQt5 import QtWidgets
-except ImportError as err:
-    print("PyQT isn't installed.")
-    sys.exit(1)
-
 # ## own libraries
 import mod_configuration_file
-import mod_gui
+import mod_cli
 
 # determine if application is a script file or frozen exe
 if getattr(sys, "frozen", False):
@@ -67,8 +61,21 @@ class AppGlobals:
             # Kill the app if the config file has errors
             sys.exit(1)
 
+    def cli(self, argv) -> int:
+        """Run a command line action."""
+        log.info(f"command line: {argv}")
+        return mod_cli.CommandLine(self.conf).run(argv)
+
     def main(self) -> None:
         """Run the main program."""
+        # the GUI is only imported here, the command line and daemon run without PyQt
+        try:
+            from PyQt5 import QtWidgets
+            import mod_gui
+        except ImportError:
+            print("PyQT isn't installed.")
+            sys.exit(1)
+
         start = datetime.now().strftime("%d/%m/%Y %H:%M")
         log.info(f"start of program: {start}")
 
@@ -84,6 +91,8 @@ class AppGlobals:
 if __name__ == "__main__":
 
     app = AppGlobals(CONFIG_FILE)
+    if len(sys.argv) > 1:
+        sys.exit(app.cli(sys.argv[1:]))
     app.main()
 
     sys.exit()
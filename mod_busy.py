@@ -0,0 +1,174 @@
+"""This module finds the processes that keep mount points busy."""
+
+import os
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import mod_process
+
+
+log = logging.getLogger(__name__)
+
+
+class Holder:
+    """This class describes a process that uses a path below a mount point."""
+
+    def __init__(self, pid, name, how, path) -> None:
+        """Initialize the class."""
+        self.pid = pid
+        self.name = name
+        self.how = how  # cwd, root, exe, fd or maps
+        self.path = path
+
+    def __repr__(self) -> str:
+        """Return a readable representation."""
+        return f"{self.name}[{self.pid}] ({self.how})"
+
+
+def resolve(mount_point) -> str:
+    """Return the real path of a mount point without a stat of the mount itself.
+
+    Only the parent folder is resolved, a dead sshfs mount would hang a stat.
+    """
+    parent, name = os.path.split(os.path.abspath(mount_point))
+    return os.path.join(os.path.realpath(parent), name)
+
+
+class BusyMountAnalyzer:
+    """This class builds an index from each mount point to the processes holding it.
+
+    All the processes are scanned once, whatever the number of mount points.
+    """
+
+    def __init__(self, proc_root="/proc", timeout=10.0) -> None:
+        """Initialize the class."""
+        self.proc_root = proc_root
+        self.runner = mod_process.ProcessRunner(timeout)
+
+    def scan(self, mount_points: List[str]) -> Dict[str, List[Holder]]:
+        """Return the holders for each of the mount points."""
+        log.debug(f"--scan-- {mount_points}")
+        self.index = {resolve(m): [] for m in mount_points}
+        # the longest mount point first, so nested mount points match correctly
+        self.ordered = sorted(self.index, key=len, reverse=True)
+
+        if os.path.isdir(os.path.join(self.proc_root, "self")):
+            self.scan_proc()
+        else:
+            self.scan_lsof()
+
+        found = {m: holders for m, holders in self.index.items() if holders}
+        log.info(f"Busy mount points: {found}")
+        return {m: self.index[resolve(m)] for m in mount_points}
+
+    def match(self, path):
+        """Return the mount point that contains the path or None."""
+        for mount_point in self.ordered:
+            if path == mount_point or path.startswith(mount_point + "/"):
+                return mount_point
+        return None
+
+    def add(self, pid, name, how, path) -> None:
+        """Add the process to the index when the path is below a mount point."""
+        mount_point = self.match(path)
+        if mount_point is None:
+            return
+        holders = self.index[mount_point]
+        if not any(h.pid == pid and h.how == how for h in holders):
+            holders.append(Holder(pid, name, how, path))
+
+    def scan_proc(self) -> None:
+        """Scan the cwd, root, exe, fds and memory maps of every process in /proc."""
+        for entry in os.scandir(self.proc_root):
+            if not entry.name.isdigit():
+                continue
+            pid = int(entry.name)
+            try:
+                with open(os.path.join(entry.path, "comm")) as comm:
+                    name = comm.read().strip()
+            except OSError:
+                continue  # the process is gone
+
+            for how in ("cwd", "root", "exe"):
+                try:
+                    self.add(pid, name, how, os.readlink(os.path.join(entry.path, how)))
+                except OSError:
+                    pass
+
+            try:
+                with os.scandir(os.path.join(entry.path, "fd")) as fds:
+                    for fd in fds:
+                        try:
+                            self.add(pid, name, "fd", os.readlink(fd.path))
+                        except OSError:
+                            pass
+            except OSError:
+                pass  # no permission for the fds of other users
+
+            try:
+                with open(os.path.join(entry.path, "maps")) as maps:
+                    for line in maps:
+                        fields = line.split(None, 5)
+                        if len(fields) == 6 and fields[5].startswith("/"):
+                            self.add(pid, name, "maps", fields[5].rstrip("\n"))
+            except OSError:
+                pass
+
+    def scan_lsof(self) -> None:
+        """Scan all open files with one lsof run, for systems without /proc."""
+        try:
+            output = self.runner.run(["lsof", "-n", "-w", "-F", "pcfn"]).stdout
+        except subprocess.CalledProcessError as err:
+            output = err.stdout or b""  # lsof returns 1 when some files could not be read
+        except (OSError, mod_process.ModProcessExceptions) as err:
+            log.error(f"Could not scan the open files: {err}")
+            return
+
+        pid, name, how = None, "", "fd"
+        for line in output.decode(errors="replace").splitlines():
+            if not line:
+                continue
+            field, value = line[0], line[1:]
+            if field == "p":
+                pid = int(value)
+            elif field == "c":
+                name = value
+            elif field == "f":
+                how = value if value in ("cwd", "rtd", "txt") else "fd"
+            elif field == "n" and pid is not None:
+                self.add(pid, name, how, value)
+
+
+def umount_all(mountobjects, lazy=False, timeout=None) -> Dict:
+    """Unmount all the mount points in parallel, report the holders of the busy ones.
+
+    With lazy the busy mount points are detached anyway.
+    Returns a dict with the mount item as key and a tuple (unmounted, holders).
+    """
+    log.debug("--umount_all--")
+    items = list(mountobjects)
+    if not items:
+        return {}
+
+    def umount(i):
+        return mountobjects[i].umount(lazy=False, diagnose=False, timeout=timeout)
+
+    with ThreadPoolExecutor(max_workers=min(8, len(items))) as pool:
+        results = dict(zip(items, pool.map(umount, items)))
+
+    failed = [i for i in items if not results[i]]
+    report = {i: (True, []) for i in items}
+    if not failed:
+        return report
+
+    holders = BusyMountAnalyzer().scan([mountobjects[i].destination_full_path for i in failed])
+    for i in failed:
+        mountpoint = mountobjects[i]
+        held_by = holders[mountpoint.destination_full_path]
+        unmounted = lazy and mountpoint.force_umount()
+        if unmounted:
+            log.info(f"Lazy unmounted {mountpoint.label}, held by {held_by}")
+        report[i] = (unmounted, held_by)
+    return report
@@ -0,0 +1,143 @@
+"""This module measures the capacity of the mounted remote filesystems with statvfs."""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, Optional
+
+
+log = logging.getLogger(__name__)
+
+
+def human_size(size) -> str:
+    """Return a size in bytes as a short readable text."""
+    for unit in ("B", "K", "M", "G", "T"):
+        if abs(size) < 1024 or unit == "T":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}T"
+
+
+def describe(capacity) -> str:
+    """Return the short text of a capacity, for the mount list."""
+    if not capacity:
+        return ""
+    text = f"{capacity['used_pct']:.0f}% {human_size(capacity['avail'])} free"
+    return f"{text} (stale)" if capacity.get("stale") else text
+
+
+class CapacityMonitor:
+    """This class collects the statvfs numbers of the mounted destinations.
+
+    Every statvfs runs in its own thread with a deadline, a hung mount only keeps its own
+    thread and its last numbers are marked stale. Mount points that showed the same
+    remote filesystem last time (same server, size, inode count and block size) are
+    measured once and share the result. The results are kept for 'interval' seconds.
+    """
+
+    def __init__(self, interval=60.0, timeout=2.0, warn_pct=90.0, inode_warn_pct=90.0) -> None:
+        """Initialize the class."""
+        self.interval = interval
+        self.timeout = timeout
+        self.warn_pct = warn_pct
+        self.inode_warn_pct = inode_warn_pct
+        self.cache = {}  # item: capacity dict
+        self.pending = {}  # path: the thread of a statvfs that did not return yet
+        self.alerting = set()  # the (item, kind) alerts that are raised
+
+    def statvfs(self, path) -> Optional[os.statvfs_result]:
+        """Run statvfs with a deadline, return None on an error or a hang."""
+        worker = self.pending.get(path)
+        if worker and worker.is_alive():
+            return None  # still hanging since the last round, don't pile up threads
+        outcome = []
+
+        def probe():
+            try:
+                outcome.append(os.statvfs(path))
+            except OSError as err:
+                log.warning(f"statvfs of {path} failed: {err}")
+
+        worker = threading.Thread(target=probe, name="statvfs", daemon=True)
+        worker.start()
+        worker.join(self.timeout)
+        if worker.is_alive():
+            log.warning(f"statvfs of {path} hangs")
+            self.pending[path] = worker
+            return None
+        self.pending.pop(path, None)
+        return outcome[0] if outcome else None
+
+    @staticmethod
+    def make(server, st) -> Dict:
+        """Return the capacity numbers of a statvfs result."""
+        size = st.f_blocks * st.f_frsize
+        used = (st.f_blocks - st.f_bfree) * st.f_frsize
+        files_used = st.f_files - st.f_ffree
+        return {
+            "key": [server, st.f_blocks, st.f_files, st.f_bsize],
+            "size": size,
+            "used": used,
+            "avail": st.f_bavail * st.f_frsize,
+            "used_pct": 100.0 * used / size if size else 0.0,
+            "files": st.f_files,
+            "files_free": st.f_ffree,
+            "inodes_pct": 100.0 * files_used / st.f_files if st.f_files else 0.0,
+            "time": time.time(),
+            "stale": False,
+        }
+
+    def collect(self, mounted) -> Dict:
+        """Measure the due mount points, 'mounted' maps the items to (destination, server).
+
+        Returns the capacity of each of the mounted items, the unmounted ones are forgotten.
+        """
+        for i in list(self.cache):
+            if i not in mounted:
+                del self.cache[i]
+
+        due = [
+            i
+            for i in mounted
+            if i not in self.cache or time.time() - self.cache[i]["time"] >= self.interval
+        ]
+        groups = {}  # the filesystem seen last time: the items that showed it
+        for i in due:
+            key = tuple(self.cache[i]["key"]) if i in self.cache else (i,)
+            groups.setdefault(key, []).append(i)
+
+        for key, items in groups.items():
+            first, rest = items[0], items[1:]
+            self.measure(first, *mounted[first])
+            capacity = self.cache.get(first)
+            for i in rest:
+                if capacity and not capacity["stale"] and tuple(capacity["key"]) == key:
+                    self.cache[i] = dict(capacity)  # the same filesystem, no need to ask again
+                else:
+                    self.measure(i, *mounted[i])
+        return {i: self.cache.get(i) for i in mounted}
+
+    def measure(self, i, path, server) -> None:
+        """Run statvfs on one destination and cache the result."""
+        st = self.statvfs(path)
+        if st is not None:
+            self.cache[i] = self.make(server, st)
+        elif i in self.cache:
+            self.cache[i]["stale"] = True
+            self.cache[i]["time"] = time.time()  # try again after the interval
+
+    def alerts(self, i, capacity):
+        """Return the messages of the thresholds the capacity just crossed."""
+        messages = []
+        checks = (
+            ("space", capacity["used_pct"], self.warn_pct),
+            ("inodes", capacity["inodes_pct"], self.inode_warn_pct),
+        )
+        for kind, value, limit in checks:
+            if value >= limit and (i, kind) not in self.alerting:
+                self.alerting.add((i, kind))
+                messages.append(f"{value:.0f}% of the {kind} is used")
+            elif value < limit:
+                self.alerting.discard((i, kind))
+        return messages
@@ -0,0 +1,490 @@
+"""This module provides the command line interface, a client of the daemon."""
+
+import os
+import sys
+import time
+import argparse
+import logging
+import threading
+
+import mod_soak
+import mod_daemon
+import mod_fuse
+import mod_history
+import mod_metrics
+import mod_offload
+import mod_procacct
+import mod_writeback
+import mod_capacity
+import mod_transfer
+
+
+log = logging.getLogger(__name__)
+
+
+class CommandLine:
+    """This class runs the AutoMounter actions from the command line."""
+
+    def __init__(self, conf) -> None:
+        """Initialize the class."""
+        self.conf = conf
+        self.parser = self.make_parser()
+        self.client = mod_daemon.DaemonClient(conf.get_socket_path())
+
+    @staticmethod
+    def make_parser() -> argparse.ArgumentParser:
+        """Make the argument parser."""
+        parser = argparse.ArgumentParser(prog="automounter", description="AutoMounter for sshfs.")
+        sub = parser.add_subparsers(dest="command")
+
+        sub.add_parser("daemon", help="run the daemon that owns the mount points")
+        sub.add_parser("stop", help="stop the daemon, the mounts stay as they are")
+        sub.add_parser("reload", help="let the daemon read the config file again")
+        sub.add_parser("status", help="show the state of all mount points")
+        for name in ("mount", "umount"):
+            cmd = sub.add_parser(name, help=f"{name} mount points, Ctrl-C cancels")
+            cmd.add_argument("sections", nargs="*", help="config section numbers, default all")
+            cmd.add_argument("--timeout", type=float, help="deadline in seconds per mount point")
+            if name == "mount":
+                cmd.add_argument(
+                    "--accept-new", action="store_true", help="accept unknown host keys"
+                )
+            else:
+                cmd.add_argument(
+                    "--lazy", action="store_true", help="detach busy mount points anyway"
+                )
+        cmd = sub.add_parser("warmup", help="check the host keys and ssh logins of all hosts")
+        cmd.add_argument("sections", nargs="*", help="config section numbers, default all")
+        cmd.add_argument("--accept-new", action="store_true", help="accept unknown host keys")
+        sub.add_parser("memory", help="show the daemon's memory report, the first one starts it")
+        cmd = sub.add_parser("soak", help="cycle (un)mount and reload on a fake backend")
+        cmd.add_argument("--cycles", type=int, default=1000, help="number of cycles")
+        cmd.add_argument("--mounts", type=int, default=4, help="number of fake mount points")
+        cmd.add_argument("--tolerance", type=float, default=5.0, help="allowed RSS growth in MB")
+        sub.add_parser("metrics", help="show the metrics in the Prometheus text format")
+        sub.add_parser("busy", help="show the processes that keep the mount points busy")
+        cmd = sub.add_parser("autotune", help="find the fastest sshfs options, Ctrl-C cancels")
+        cmd.add_argument("section", help="config section number")
+        cmd = sub.add_parser("fusetune", help="show or set the kernel FUSE connection settings")
+        cmd.add_argument("section", help="config section number")
+        action = cmd.add_mutually_exclusive_group()
+        action.add_argument("--apply", action="store_true", help="apply the values, no remount")
+        action.add_argument("--revert", action="store_true", help="restore the earlier values")
+        action.add_argument("--bench", action="store_true", help="time parallel reads, A/B")
+        cmd.add_argument("--max-background", type=int, help="default fuse_max_background")
+        cmd.add_argument("--congestion-threshold", type=int, help="default the section's key")
+        cmd.add_argument("--threads", type=int, default=16, help="parallel readers of --bench")
+        cmd = sub.add_parser("history", help="show the uptime, mount times and failures")
+        cmd.add_argument("section", nargs="?", help="config section number, default all")
+        cmd.add_argument("--days", type=float, default=30.0, help="the period, default 30 days")
+        cmd = sub.add_parser("reconcile", help="remove orphaned folders from the mount folder")
+        cmd.add_argument("--dry-run", action="store_true", help="only show what would be done")
+        cmd = sub.add_parser("transfer", help="copy out of a mount point with parallel streams")
+        cmd.add_argument("section", help="config section number")
+        cmd.add_argument("sources", nargs="+", help="paths in the mount point or the location")
+        cmd.add_argument("--to", required=True, help="the local target folder")
+        cmd.add_argument("--streams", type=int, help="parallel streams, default transfer_streams")
+        cmd = sub.add_parser("offload", help="run checksum, du, rm, cp or mv on the server")
+        cmd.add_argument("section", help="config section number")
+        cmd.add_argument("op", choices=mod_offload.OPERATIONS, help="the operation")
+        cmd.add_argument("paths", nargs="+", help="paths in the mount point or the location")
+        cmd.add_argument("--to", help="the target of cp and mv, in the same location")
+        cmd.add_argument("--algorithm", choices=mod_offload.ALGORITHMS, help="of the checksums")
+        cmd.add_argument("--yes", action="store_true", help="delete without asking")
+        cmd = sub.add_parser("index", help="build or refresh the search index of a mount point")
+        cmd.add_argument("section", help="config section number")
+        cmd.add_argument("--full", action="store_true", help="build it again from scratch")
+        cmd = sub.add_parser("search", help="search the file names in the indexes")
+        cmd.add_argument("text", help="part of the path, case insensitive")
+        cmd.add_argument("--section", help="only this config section")
+        cmd.add_argument("--limit", type=int, default=200, help="maximum number of results")
+        cmd = sub.add_parser("flush", help="flush the write-back spool of a mount point now")
+        cmd.add_argument("section", help="config section number")
+        cmd = sub.add_parser("refresh", help="refresh the mirror of a 'sync' mount point now")
+        cmd.add_argument("section", help="config section number")
+        return parser
+
+    def run(self, argv) -> int:
+        """Run the command and return the exit code."""
+        args = self.parser.parse_args(argv)
+        if not args.command:
+            self.parser.print_help()
+            return 2
+        if args.command == "daemon":
+            return self.daemon()
+        if args.command == "soak":
+            return self.soak(args)
+
+        try:
+            if args.command == "stop":
+                self.client.call("shutdown")
+                return 0
+            self.client.ensure_daemon()
+            return getattr(self, args.command)(args)
+        except mod_daemon.ModDaemonExceptions as err:
+            print(f"Error: {err}", file=sys.stderr)
+            return 1
+
+    def daemon(self) -> int:
+        """Run the daemon in the foreground."""
+        try:
+            mod_daemon.MountDaemon(self.conf).serve()
+        except mod_daemon.DaemonRunningError as err:
+            print(err, file=sys.stderr)
+            return 1
+        return 0
+
+    def labels(self) -> dict:
+        """Return the label of each mount point."""
+        return {state["item"]: state["label"] for state in self.client.call("status")["items"]}
+
+    def reload(self, args) -> int:
+        """Let the daemon read the config file again."""
+        self.client.call("reload")
+        return 0
+
+    def status(self, args) -> int:
+        """Print the state of each mount point."""
+        status = self.client.call("status")
+        if status["config_error"]:
+            print(f"Configuration error: {status['config_error']}", file=sys.stderr)
+        for state in status["items"]:
+            if state["operation"]:
+                text = f"{state['operation']}..."
+            elif state["mounted"]:
+                text = f"mounted from {state['server']}"
+            else:
+                text = "not mounted"
+            if state["capacity"]:
+                text += f", {mod_capacity.describe(state['capacity'])}"
+            if state.get("processes"):
+                text += f", sshfs {mod_procacct.describe(state['processes'])}"
+            if state.get("spool"):
+                text += f", {mod_writeback.describe(state['spool'])}"
+            if state["last_error"]:
+                text += f" ({state['last_error']})"
+            print(f"[{state['item']}] {state['label']}: {text}")
+        return 0
+
+    def soak(self, args) -> int:
+        """Run the soak test in this process, it fails when the RSS grows."""
+        try:
+            report = mod_soak.soak(args.cycles, args.mounts, args.tolerance)
+        except mod_soak.ModSoakExceptions as err:
+            print(f"Error: {err}", file=sys.stderr)
+            return 1
+        print(
+            f"{report['cycles']} cycles of {report['mounts']} mount points in "
+            f"{report['seconds']:.1f}s, RSS {report['start_rss'] / 1048576:.1f} MB -> "
+            f"{report['end_rss'] / 1048576:.1f} MB ({report['growth_mb']:+.1f} MB)"
+        )
+        print("RSS stayed flat" if report["flat"] else "RSS grew more than the tolerance")
+        return 0 if report["flat"] else 1
+
+    def memory(self, args) -> int:
+        """Print the daemon's memory report."""
+        for line in self.client.call("memory", timeout=60.0):
+            print(line)
+        return 0
+
+    def metrics(self, args) -> int:
+        """Print the daemon's metrics."""
+        for line in mod_metrics.format_text(self.client.call("metrics")):
+            print(line)
+        return 0
+
+    def busy(self, args) -> int:
+        """Print the processes holding each mount point, with one scan."""
+        labels = self.labels()
+        for i, holders in self.client.call("busy").items():
+            print(f"[{i}] {labels.get(i, '')}: {', '.join(holders) or 'not busy'}")
+        return 0
+
+    def autotune(self, args) -> int:
+        """Measure the candidate sshfs option sets and print the report."""
+        print(f"[{args.section}] auto-tuning, this mounts the section once per candidate...")
+        params = {"item": args.section, "wait": True}
+        outcome = self.run_cancellable(args.section, "autotune", params)
+        if not outcome["result"]:
+            print(f"[{args.section}] failed: {outcome['error']}", file=sys.stderr)
+            return 1
+        print(outcome["data"]["text"])
+        return 0
+
+    def fusetune(self, args) -> int:
+        """Show, apply, revert or benchmark the FUSE connection settings of a mount point."""
+        values = {
+            "max_background": args.max_background,
+            "congestion_threshold": args.congestion_threshold,
+        }
+        values = {name: value for name, value in values.items() if value is not None}
+        action = "apply" if args.apply else "revert" if args.revert else "show"
+        if args.bench:
+            action = "bench"
+            print(f"[{args.section}] reading in parallel with each setting, twice...")
+        params = {
+            "item": args.section,
+            "action": action,
+            "values": values or None,
+            "threads": args.threads,
+            "wait": True,
+        }
+        outcome = self.run_cancellable(args.section, "fusetune", params)
+        if not outcome["result"]:
+            print(f"[{args.section}] failed: {outcome['error']}", file=sys.stderr)
+            return 1
+        report = outcome["data"]
+        if action == "bench":
+            for line in mod_fuse.describe_benchmark(report):
+                print(line)
+            return 0
+        print(f"[{args.section}] {mod_fuse.describe(report)}")
+        for name, reason in report["errors"].items():
+            print(f"[{args.section}] {name} not set: {reason}", file=sys.stderr)
+        return 1 if report["errors"] else 0
+
+    def history(self, args) -> int:
+        """Print the history of the mount points."""
+        report = self.client.call("history", {"item": args.section, "days": args.days})
+        for line in mod_history.format_report(report, self.labels()):
+            print(line)
+        return 0
+
+    def reconcile(self, args) -> int:
+        """Clean the mount folder and print what was done."""
+        report = self.client.call("reconcile", {"dry_run": args.dry_run}, timeout=None)
+        for key in ("detached", "removed", "kept"):
+            for path in report[key]:
+                print(f"{key}: {path}")
+        print(
+            f"{len(report['removed'])} removed, {len(report['detached'])} detached, "
+            f"{len(report['kept'])} kept"
+        )
+        return 0
+
+    def transfer(self, args) -> int:
+        """Copy files out of a mount point and show the progress, Ctrl-C stops it resumable."""
+        section = str(args.section)
+
+        def show(event, data):
+            if event == "transfer" and data["item"] == section:
+                done = mod_capacity.human_size(data["done"])
+                total = mod_capacity.human_size(data["total"])
+                rate = mod_capacity.human_size(data["rate"])
+                print(f"\r[{section}] {done} of {total}, {rate}/s   ", end="", file=sys.stderr)
+
+        self.client.subscribe(show)
+        params = {
+            "item": section,
+            "sources": args.sources,
+            "target": os.path.abspath(args.to),
+            "streams": args.streams,
+            "wait": True,
+        }
+        outcome = self.run_cancellable(section, "transfer", params)
+        print(file=sys.stderr)
+        if not outcome["result"]:
+            print(f"[{section}] failed: {outcome['error']}", file=sys.stderr)
+            return 1
+        print(f"[{section}] {mod_transfer.describe(outcome['data'])}")
+        return 0
+
+    def offload(self, args) -> int:
+        """Run an operation on the server and print its output while it runs."""
+        section = str(args.section)
+        if args.op in ("cp", "mv") and not args.to:
+            print(f"{args.op} needs --to", file=sys.stderr)
+            return 2
+        if args.op == "rm" and not args.yes:
+            answer = input(f"[{section}] Delete {', '.join(args.paths)} on the server? [y/N] ")
+            if answer.strip().lower() not in ("y", "yes"):
+                return 1
+
+        printed = [0]
+
+        def show(event, data):
+            if event == "offload" and data["item"] == section:
+                for line in data["lines"]:
+                    print(line)
+                printed[0] += len(data["lines"])
+
+        self.client.subscribe(show)
+        params = {
+            "item": section,
+            "op": args.op,
+            "paths": args.paths,
+            "target": args.to,
+            "algorithm": args.algorithm,
+            "wait": True,
+        }
+        outcome = self.run_cancellable(section, "offload", params)
+        if not outcome["result"]:
+            print(f"[{section}] failed: {outcome['error']}", file=sys.stderr)
+            return 1
+        report = outcome["data"]
+        deadline = time.monotonic() + 2.0
+        while printed[0] < report["lines"] and time.monotonic() < deadline:
+            time.sleep(0.05)  # the last lines may still be on their way
+        print(f"[{section}] {args.op} done in {report['seconds']:.1f}s", file=sys.stderr)
+        return 0
+
+    def index(self, args) -> int:
+        """Build or refresh the search index of a mount point."""
+        params = {"item": args.section, "full": args.full, "wait": True}
+        outcome = self.run_cancellable(args.section, "index", params)
+        if not outcome["result"]:
+            print(f"[{args.section}] failed: {outcome['error']}", file=sys.stderr)
+            return 1
+        report = outcome["data"]
+        print(
+            f"[{args.section}] {report['entries']} entries, {report['changed']} changed "
+            f"in {report['seconds']:.1f}s"
+        )
+        return 0
+
+    def search(self, args) -> int:
+        """Print the paths in the mount points that contain the text."""
+        params = {"text": args.text, "item": args.section, "limit": args.limit}
+        for entry in self.client.call("search", params):
+            size = "" if entry["kind"] == "d" else f"  {mod_capacity.human_size(entry['size'])}"
+            print(f"{entry['local']}{size}")
+        return 0
+
+    def flush(self, args) -> int:
+        """Flush the write-back spool of a mount point and print what is left."""
+        report = self.client.call("flush", {"item": args.section, "wait": True}, timeout=None)
+        print(f"[{args.section}] sent {report['files']} files, {report['bytes']} bytes")
+        for rel in report["conflicts"]:
+            print(f"[{args.section}] conflict, newer on the server: {rel}")
+        print(f"[{args.section}] {mod_writeback.describe(report)}")
+        if report["paused"]:
+            print(f"[{args.section}] paused: {report['paused']}", file=sys.stderr)
+            return 1
+        return 0
+
+    def refresh(self, args) -> int:
+        """Refresh the mirror of a 'sync' mount point."""
+        params = {"item": args.section, "wait": True}
+        outcome = self.run_cancellable(args.section, "refresh", params)
+        if not outcome["result"]:
+            print(f"[{args.section}] failed: {outcome['error']}", file=sys.stderr)
+            return 1
+        print(f"[{args.section}] refreshed")
+        return 0
+
+    def mount(self, args) -> int:
+        """Mount the selected mount points, more than one after an ssh warm-up."""
+        sections = args.sections or list(self.labels())
+        # one pre-flight round for all the hosts, instead of one per mount
+        unreachable = self.client.call("probe", {"items": sections}, timeout=None)["unreachable"]
+        for i, reason in unreachable.items():
+            print(f"[{i}] skipped: {reason}", file=sys.stderr)
+        sections = args.sections = [i for i in sections if i not in unreachable]
+        if not sections:
+            return 1
+        if len(sections) > 1 and self.conf.get_ssh_warmup():
+            report = self.ssh_warmup(sections, args.accept_new)
+            if report is None:
+                return 1
+            args.sections = [i for i in sections if i not in report["blocked"]]
+            if not args.sections:
+                return 1
+        return self.mount_action(args) or (1 if unreachable else 0)
+
+    def warmup(self, args) -> int:
+        """Check the host keys and the ssh logins, print the report."""
+        report = self.ssh_warmup(args.sections or None, args.accept_new)
+        if report is None:
+            return 1
+        print(f"{report['targets']} logins checked in {report['seconds']:.1f}s")
+        return 1 if report["failed"] else 0
+
+    def ssh_warmup(self, sections, accept_new) -> dict:
+        """Offer the unknown host keys, then log in to all hosts, None when refused."""
+        params = {"items": sections}
+        hostkeys = self.client.call("hostkeys", params, timeout=None)
+        for entry in hostkeys:
+            if entry["error"] or not entry["lines"]:
+                print(f"{entry['host']}: no host key, {entry['error']}", file=sys.stderr)
+                continue
+            print(f"{entry['host']} is not a known host, its keys are:")
+            for fingerprint in entry["fingerprints"]:
+                print(f"  {fingerprint}")
+        hostkeys = [entry for entry in hostkeys if entry["lines"]]
+        if hostkeys and not accept_new:
+            if not sys.stdin.isatty():
+                print("Unknown host keys, run again with --accept-new", file=sys.stderr)
+                return None
+            answer = input("Add these host keys to known_hosts? [y/N] ")
+            if answer.strip().lower() not in ("y", "yes"):
+                return None
+        if hostkeys:
+            self.client.call("accept_hostkeys", {"hostkeys": hostkeys})
+
+        report = self.client.call("warmup", params, timeout=None)
+        for target, reason in report["failed"].items():
+            print(f"{target}: {reason}", file=sys.stderr)
+        for i, reason in report["blocked"].items():
+            print(f"[{i}] skipped, no server accepts the login", file=sys.stderr)
+        return report
+
+    def umount(self, args) -> int:
+        """Unmount the selected mount points, all at once without sections."""
+        if args.sections:
+            return self.mount_action(args)
+
+        params = {"wait": True, "timeout": args.timeout, "lazy": True if args.lazy else None}
+        report = self.client.call("umount_all", params, timeout=None)
+        labels = self.labels()
+        failed = 0
+        for i, outcome in report.items():
+            held = f", held by: {', '.join(outcome['holders'])}" if outcome["holders"] else ""
+            text = "done" if outcome["unmounted"] else "failed"
+            print(f"[{i}] {labels.get(i, '')}: {text}{held}")
+            failed += not outcome["unmounted"]
+        return 1 if failed else 0
+
+    def mount_action(self, args) -> int:
+        """(Un)mount the selected mount points."""
+        sections = args.sections or list(self.labels())
+        failed = 0
+        for i in sections:
+            params = {"item": i, "wait": True, "timeout": args.timeout}
+            if args.command == "umount" and args.lazy:
+                params["lazy"] = True
+
+            print(f"[{i}] {args.command}...")
+            try:
+                outcome = self.run_cancellable(i, args.command, params)
+            except mod_daemon.DaemonCallError as err:
+                print(f"[{i}] failed: {err}", file=sys.stderr)
+                failed += 1
+                continue
+            if outcome["result"]:
+                print(f"[{i}] done")
+            else:
+                print(f"[{i}] failed: {outcome['error']}", file=sys.stderr)
+                failed += 1
+        return 1 if failed else 0
+
+    def run_cancellable(self, item, method, params) -> dict:
+        """Wait for the daemon in a worker thread, Ctrl-C cancels the operation."""
+        answer = []
+
+        def work():
+            try:
+                answer.append(self.client.call(method, params, timeout=None))
+            except mod_daemon.ModDaemonExceptions as err:
+                answer.append(err)
+
+        worker = threading.Thread(target=work, daemon=True)
+        worker.start()
+        while worker.is_alive():
+            try:
+                worker.join(0.2)
+            except KeyboardInterrupt:
+                print("cancelling...", file=sys.stderr)
+                self.client.call("cancel", {"item": item})
+        if isinstance(answer[0], Exception):
+            raise answer[0]
+        return answer[0]
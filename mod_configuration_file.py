@@ -8,6 +8,9 @@ from datetime import datetime
 from typing import List, Dict
 
 import mod_mounter
+import mod_sync
+import mod_reachability
+import mod_tuning
 
 log = logging.getLogger(__name__)
 
@@ -23,12 +26,14 @@ class ConfigurationFile:
 
     def read(self) -> None:
         """Read the configuration file."""
+        config = configparser.ConfigParser()  # the current one stays when this one fails
         try:
-            self.config = configparser.ConfigParser()
-            self.config.read_file(open(self.config_file))
-            log.debug(f"config: {self.config.sections()}")
-        except configparser.Error as err:
+            with open(self.config_file) as config_ini:
+                config.read_file(config_ini)
+        except (OSError, configparser.Error) as err:
             raise NoConfigFileError(err) from err
+        self.config = config
+        log.debug(f"config: {self.config.sections()}")
 
     def write(self, new_config) -> None:
         """Save the config.ini file."""
@@ -56,9 +61,19 @@ class ConfigurationFile:
 class ConfigActions(ConfigurationFile):
     """A class that extends the parent class for working with the configuration file."""
 
-    def __init__(self, file) -> None:
-        """Initialize the class."""
+    def __init__(self, file, location_types=None) -> None:
+        """Initialize the class, 'location_types' adds mount point classes by 'type'."""
         super().__init__(file)
+        self.location_types = {"sync": mod_sync.SyncLocation}
+        self.location_types.update(location_types or {})
+        self.reachability = mod_reachability.Reachability(
+            self.get_preflight_timeout(),
+            self.get_rtt_cache_ttl(),
+            os.path.join(self.get_state_folder(), "latency.json"),
+        )
+        self.tuning = mod_tuning.TuningCache(
+            os.path.join(self.get_state_folder(), "tuning.json"), self.get_tune_ttl()
+        )
 
     def to_text_list(self) -> List:
         """Return the configuration file as plaintext in a list (for printing only)."""
@@ -104,7 +119,10 @@ class ConfigActions(ConfigurationFile):
                 i = match.group(0)
                 try:
                     log.debug(f"Config section {i}: {self.config[i]}")
-                    mount_points_dict[i] = mod_mounter.MountLocation(self, i)
+                    location = self.location_types.get(
+                        self.config[i].get("type"), mod_mounter.MountLocation
+                    )
+                    mount_points_dict[i] = location(self, i)
                 except mod_mounter.IncompleteMountPointError as err:
                     raise IncompleteMountTargetError(i) from err
 
@@ -120,6 +138,155 @@ class ConfigActions(ConfigurationFile):
         """Get the logfile name from the configuration."""
         return self.config["options"]["log_file"]
 
+    def get_state_folder(self) -> str:
+        """Get the folder for the state that is kept between runs, create it if needed."""
+        default = os.path.join(os.path.dirname(os.path.abspath(self.config_file)), "state")
+        folder = self.config["options"].get("state_folder", fallback=default)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        return folder
+
+    def get_socket_path(self) -> str:
+        """Get the path of the daemon's Unix domain socket."""
+        default = os.path.join(self.get_state_folder(), "automounter.sock")
+        return self.config["options"].get("socket_path", fallback=default)
+
+    def get_max_operations(self) -> int:
+        """Get the number of (un)mount operations the daemon runs at the same time."""
+        return self.config["options"].getint("max_operations", fallback=8)
+
+    def get_failover_interval(self) -> float:
+        """Get the seconds between the replica health checks of the mounts."""
+        return self.config["options"].getfloat("failover_interval", fallback=30.0)
+
+    def get_sync_timeout(self) -> float:
+        """Get the deadline in seconds for an rsync of a 'sync' mount point."""
+        return self.config["options"].getfloat("sync_timeout", fallback=3600.0)
+
+    def get_ssh_persist(self) -> float:
+        """Get the seconds an idle pooled ssh connection is kept open."""
+        return self.config["options"].getfloat("ssh_persist", fallback=60.0)
+
+    def get_tune_ttl(self) -> float:
+        """Get the seconds the auto-tuned sshfs options of a server are used."""
+        return self.config["options"].getfloat("tune_ttl", fallback=604800.0)
+
+    def get_preflight_timeout(self) -> float:
+        """Get the deadline in seconds for the reachability pre-flight."""
+        return self.config["options"].getfloat("preflight_timeout", fallback=2.0)
+
+    def get_rtt_cache_ttl(self) -> float:
+        """Get the time in seconds a measured RTT is reused."""
+        return self.config["options"].getfloat("rtt_cache_ttl", fallback=30.0)
+
+    def get_mount_timeout(self) -> float:
+        """Get the deadline in seconds for a mount command."""
+        return self.config["options"].getfloat("mount_timeout", fallback=30.0)
+
+    def get_umount_timeout(self) -> float:
+        """Get the deadline in seconds for an umount command."""
+        return self.config["options"].getfloat("umount_timeout", fallback=15.0)
+
+    def get_lazy_umount(self) -> bool:
+        """Get if a busy mount point is detached anyway (lazy unmount)."""
+        return self.config["options"].getboolean("lazy_umount", fallback=False)
+
+    def get_umount_on_quit(self) -> bool:
+        """Get if all the mount points are unmounted when the app quits."""
+        return self.config["options"].getboolean("umount_on_quit", fallback=False)
+
+    def get_reconcile_at_start(self) -> bool:
+        """Get if the daemon cleans the mount folder when it starts."""
+        return self.config["options"].getboolean("reconcile_at_start", fallback=True)
+
+    def get_history_retention(self) -> float:
+        """Get the days the hourly history is kept."""
+        return self.config["options"].getfloat("history_retention", fallback=365.0)
+
+    def get_history_raw_days(self) -> float:
+        """Get the days the single history events are kept, before they're rolled up."""
+        return self.config["options"].getfloat("history_raw_days", fallback=30.0)
+
+    def get_capacity_interval(self) -> float:
+        """Get the seconds the capacity of a mount point is cached."""
+        return self.config["options"].getfloat("capacity_interval", fallback=60.0)
+
+    def get_capacity_timeout(self) -> float:
+        """Get the deadline in seconds of a statvfs call."""
+        return self.config["options"].getfloat("capacity_timeout", fallback=2.0)
+
+    def get_capacity_warn(self) -> float:
+        """Get the percentage of used space that raises an alert."""
+        return self.config["options"].getfloat("capacity_warn", fallback=90.0)
+
+    def get_inode_warn(self) -> float:
+        """Get the percentage of used inodes that raises an alert."""
+        return self.config["options"].getfloat("inode_warn", fallback=90.0)
+
+    def get_stall_threshold(self) -> float:
+        """Get the milliseconds the GUI may not respond before a stall is recorded, 0 is off."""
+        return self.config["options"].getfloat("stall_threshold", fallback=100.0)
+
+    def get_diagnostics_log(self) -> str:
+        """Get the diagnostics log file, next to the log file."""
+        folder = os.path.join(
+            os.path.dirname(os.path.abspath(self.config_file)),
+            os.path.dirname(self.get_logfile()),
+        )
+        return os.path.join(folder, "diagnostics.log")
+
+    def get_log_window_lines(self) -> int:
+        """Get the number of lines the log window keeps."""
+        return self.config["options"].getint("log_window_lines", fallback=5000)
+
+    def get_transfer_streams(self) -> int:
+        """Get the number of parallel ssh streams of a transfer."""
+        return self.config["options"].getint("transfer_streams", fallback=4)
+
+    def get_transfer_chunk_mb(self) -> int:
+        """Get the size in MiB of the chunks large files are split into for a transfer."""
+        return self.config["options"].getint("transfer_chunk_mb", fallback=64)
+
+    def get_index_interval(self) -> float:
+        """Get the seconds between the refreshes of an existing search index, 0 is off."""
+        return self.config["options"].getfloat("index_interval", fallback=3600.0)
+
+    def get_index_timeout(self) -> float:
+        """Get the deadline in seconds for the remote listing of a search index."""
+        return self.config["options"].getfloat("index_timeout", fallback=600.0)
+
+    def get_process_interval(self) -> float:
+        """Get the seconds between the samples of the sshfs processes, 0 is off."""
+        return self.config["options"].getfloat("process_interval", fallback=10.0)
+
+    def get_writeback_interval(self) -> float:
+        """Get the seconds between the flushes of the write-back spools."""
+        return self.config["options"].getfloat("writeback_interval", fallback=5.0)
+
+    def get_writeback_settle(self) -> float:
+        """Get the seconds a spooled file must be unchanged before it is flushed."""
+        return self.config["options"].getfloat("writeback_settle", fallback=2.0)
+
+    def get_ssh_warmup(self) -> bool:
+        """Get if the ssh logins are checked before the mount points are mounted in bulk."""
+        return self.config["options"].getboolean("ssh_warmup", fallback=True)
+
+    def get_offload_per_host(self) -> int:
+        """Get the number of offloaded operations that run at the same time on a server."""
+        return max(1, self.config["options"].getint("offload_per_host", fallback=2))
+
+    def get_offload_timeout(self) -> float:
+        """Get the deadline in seconds for an offloaded operation."""
+        return self.config["options"].getfloat("offload_timeout", fallback=3600.0)
+
+    def get_checksum_algorithm(self) -> str:
+        """Get the checksum algorithm of the offloaded checksums: md5, sha1, sha256, ..."""
+        return self.config["options"].get("checksum_algorithm", fallback="sha256")
+
+    def get_command_timeout(self) -> float:
+        """Get the deadline in seconds for the other external commands."""
+        return self.config["options"].getfloat("command_timeout", fallback=10.0)
+
 
 class ModConfigurationFileExceptions(Exception):
     """The parent exception class for this module."""
@@ -0,0 +1,1020 @@
+"""This module provides the background daemon that owns the mount points, and its client.
+
+The daemon answers JSON-RPC 2.0 requests over a Unix domain socket, one JSON object per line.
+Clients that call 'subscribe' receive the events as 'event' notifications.
+"""
+
+import os
+import json
+import time
+import queue
+import struct
+import fcntl
+import signal
+import inspect
+import socket
+import logging
+import threading
+import subprocess
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+
+import mod_busy
+import mod_index
+import mod_general
+import mod_history
+import mod_ssh
+import mod_memory
+import mod_metrics
+import mod_capacity
+import mod_procacct
+import mod_reconcile
+import mod_writeback
+import mod_configuration_file
+
+
+log = logging.getLogger(__name__)
+
+EVENT_QUEUE = 1000  # the events queued for a subscriber before it is dropped
+SEND_TIMEOUT = 5  # seconds a write to a client may block before it is dropped
+
+
+class MountDaemon:
+    """This class owns all the mount points, the mount state and the operation queue."""
+
+    def __init__(self, conf) -> None:
+        """Initialize the class."""
+        self.conf = conf
+        self.socket_path = conf.get_socket_path()
+        self.lock = threading.RLock()
+        self.subscribers = set()  # the handlers of the subscribed clients
+        self.mountobjects = {}  # Dict with the objects for each mountpoint
+        self.state = {}  # Dict with the published state for each mountpoint
+        self.config_error = ""
+        self.pool = ThreadPoolExecutor(
+            max_workers=conf.get_max_operations(), thread_name_prefix="operation"
+        )
+        self.stopped = threading.Event()
+        self.server = None
+        self.history = mod_history.HistoryStore(
+            os.path.join(conf.get_state_folder(), "history.sqlite3"),
+            conf.get_history_retention(),
+            conf.get_history_raw_days(),
+        )
+        self.metrics = mod_metrics.Registry()
+        self.metrics.describe("automounter_operations_total", "counter", "Finished operations")
+        self.metrics.describe("automounter_capacity_size_bytes", "gauge", "Remote size")
+        self.metrics.describe("automounter_capacity_avail_bytes", "gauge", "Remote free space")
+        self.metrics.describe("automounter_capacity_used_ratio", "gauge", "Used share of space")
+        self.metrics.describe("automounter_inodes_used_ratio", "gauge", "Used share of inodes")
+        self.metrics.describe("automounter_capacity_alerts_total", "counter", "Threshold alerts")
+        self.metrics.describe("automounter_transfer_bytes_total", "counter", "Transferred bytes")
+        self.capacity = mod_capacity.CapacityMonitor(
+            conf.get_capacity_interval(),
+            conf.get_capacity_timeout(),
+            conf.get_capacity_warn(),
+            conf.get_inode_warn(),
+        )
+        self.memory = mod_memory.MemoryDiagnostics(conf.get_diagnostics_log())
+        self.metrics.describe("automounter_sshfs_cpu_ratio", "gauge", "CPU share of the sshfs tree")
+        self.metrics.describe("automounter_sshfs_rss_bytes", "gauge", "RSS of the sshfs tree")
+        self.metrics.describe("automounter_sshfs_threads", "gauge", "Threads of the sshfs tree")
+        self.metrics.describe("automounter_sshfs_read_bytes_total", "counter", "Bytes read")
+        self.metrics.describe("automounter_sshfs_write_bytes_total", "counter", "Bytes written")
+        self.metrics.describe("automounter_sshfs_restarts_total", "counter", "Restarts over limits")
+        self.processes = mod_procacct.ProcessAccountant()
+        self.metrics.describe("automounter_spool_pending_bytes", "gauge", "Bytes in the spool")
+        self.metrics.describe("automounter_spool_flushed_bytes_total", "counter", "Bytes flushed")
+        self.metrics.describe("automounter_spool_conflicts_total", "counter", "Spool conflicts")
+        self.spools = {}  # item: the write-back spool of the 'writeback' mount points
+        self.load_mount_points()
+
+    # ## state
+
+    def load_mount_points(self) -> None:
+        """Make the mountpoint objects that are provided in the config file."""
+        log.debug("--load_mount_points--")
+        try:
+            mountobjects = self.conf.get_mount_points()
+            self.config_error = ""
+        except mod_configuration_file.ModConfigurationFileExceptions as err:
+            log.error(f"Configuration error: {err}")
+            mountobjects = {}
+            self.config_error = str(err) or type(err).__name__
+
+        with self.lock:
+            self.mountobjects = mountobjects
+            self.state = {i: self.describe(i, m) for i, m in mountobjects.items()}
+
+    @staticmethod
+    def describe(i, mountpoint, mounted=False) -> dict:
+        """Return the state of a mount point, as it is sent to the clients."""
+        return {
+            "item": i,
+            "label": mountpoint.get_label(),
+            "type": mountpoint.type,
+            "server": mountpoint.server,
+            "servers": mountpoint.servers,
+            "destination": mountpoint.destination_full_path,
+            "mounted": mounted,
+            "operation": "",
+            "last_error": mountpoint.last_error,
+            "capacity": None,
+            "processes": None,
+            "spool": None,
+            "fuse": None,
+        }
+
+    def update_state(self, i, **changes) -> None:
+        """Update the state of a mount point and publish it."""
+        with self.lock:
+            if i not in self.state:
+                return
+            self.state[i].update(changes)
+            state = dict(self.state[i])
+        self.publish("state", state)
+
+    def refresh(self, items=None, record=False) -> None:
+        """Check the real mount state of the idle mount points, with record into the history.
+
+        A mount point that is found unmounted without an operation is recorded as a failure.
+        """
+        with self.lock:
+            items = [
+                i
+                for i in (items or self.mountobjects)
+                if i in self.state and not self.state[i]["operation"]
+            ]
+            mountobjects = {i: self.mountobjects[i] for i in items}
+        for i, mountpoint in mountobjects.items():
+            start = time.monotonic()
+            try:
+                mounted = bool(mountpoint.check_mount_location())
+            except Exception as err:  # a broken check must not stop the daemon
+                log.error(f"Checking [{i}] failed: {err}")
+                continue
+            if record:
+                duration = time.monotonic() - start
+                self.history.record(i, "check", mounted, duration, mountpoint.server)
+            with self.lock:
+                state = self.state.get(i)
+                if state is None:  # the section is gone after a reload
+                    continue
+                was_mounted, server = state["mounted"], state["server"]
+            if was_mounted and not mounted:
+                self.history.record(i, "failure", False, None, mountpoint.server, "mount lost")
+            if was_mounted != mounted or server != mountpoint.server:
+                self.update_state(i, mounted=mounted, server=mountpoint.server)
+
+    def publish(self, event, data) -> None:
+        """Queue an event for all subscribed clients, this never blocks."""
+        message = {"jsonrpc": "2.0", "method": "event", "params": {"event": event, "data": data}}
+        for handler in list(self.subscribers):
+            if not handler.notify(message):
+                log.warning("Dropping a subscriber that doesn't read its events")
+                handler.drop(self)
+
+    def log_event(self, message) -> None:
+        """Log a message and publish it to the clients."""
+        log.info(message)
+        self.publish("log", {"message": message})
+
+    # ## operations
+
+    def get_mountpoint(self, item):
+        """Return the mount point object or raise an RpcError."""
+        item = str(item)
+        if item not in self.mountobjects:
+            raise RpcError(f"Unknown mount point: {item}")
+        return self.mountobjects[item]
+
+    def submit(self, item, action, **kwargs):
+        """Queue an operation on a mount point, one at a time per mount point."""
+        mountpoint = self.get_mountpoint(item)
+        i = str(item)
+        with self.lock:
+            if self.state[i]["operation"]:
+                raise RpcError(f"[{i}] is busy: {self.state[i]['operation']}")
+            self.state[i]["operation"] = action
+        self.update_state(i, last_error="")
+        return self.pool.submit(self.operate, i, mountpoint, action, kwargs)
+
+    def operate(self, i, mountpoint, action, kwargs) -> dict:
+        """Run the operation in a worker thread and publish the outcome."""
+        self.log_event(f"Going to {action}: {mountpoint.get_label()}")
+        data = None
+        start = time.monotonic()
+        try:
+            value = getattr(mountpoint, action)(**kwargs)
+            result = bool(value)
+            if not isinstance(value, bool):
+                data = value  # an operation with a report, like autotune
+        except Exception as err:  # keep the daemon alive
+            log.exception(f"{action} of [{i}] raised")
+            mountpoint.last_error = str(err)
+            result = False
+
+        try:
+            mounted = bool(mountpoint.check_mount_location())
+        except Exception as err:
+            log.error(f"Checking [{i}] failed: {err}")
+            mounted = self.state.get(i, {}).get("mounted", False)
+
+        error = "" if result else mountpoint.last_error
+        if action in ("mount", "umount", "remount", "fusetune"):
+            self.update_state(i, fuse=mountpoint.fuse_values() if mounted else None)
+        self.metrics.inc("automounter_operations_total", action=action, result=str(result).lower())
+        if action in ("mount", "umount"):
+            duration = time.monotonic() - start
+            self.history.record(i, action, result, duration, mountpoint.server, error)
+        self.update_state(
+            i, operation="", mounted=mounted, server=mountpoint.server, last_error=error
+        )
+        outcome = {"item": i, "action": action, "result": result, "error": error, "data": data}
+        self.publish("operation", outcome)
+        if result:
+            self.log_event(f"{action} done: {mountpoint.get_label()}")
+        else:
+            self.log_event(f"Failed to {action}: {mountpoint.get_label()}: {error}")
+        return outcome
+
+    def housekeeping(self) -> None:
+        """Refresh the mount states and fail over replicated mounts, until stopped."""
+        interval = self.conf.get_failover_interval()
+        while not self.stopped.wait(interval):
+            try:
+                self.refresh(record=True)
+                self.history.maybe_compact()
+                with self.lock:
+                    replicated = {
+                        i: m
+                        for i, m in self.mountobjects.items()
+                        if len(m.servers) > 1 and self.state[i]["mounted"]
+                    }
+                for i, mountpoint in replicated.items():
+                    with self.lock:
+                        if i not in self.state or self.state[i]["operation"]:
+                            continue
+                        self.state[i]["operation"] = "failover"
+                    dead = mountpoint.server
+                    try:
+                        result = mountpoint.check_failover()
+                    finally:
+                        self.update_state(i, operation="")
+                    if result is None:
+                        continue
+                    if result:
+                        detail = f"from {dead}"
+                        self.history.record(i, "reconnect", True, None, mountpoint.server, detail)
+                        label = mountpoint.get_label()
+                        self.log_event(f"{label}: failed over from {dead} to {mountpoint.server}")
+                    else:
+                        self.history.record(i, "failure", False, None, dead, mountpoint.last_error)
+                        self.log_event(f"{mountpoint.get_label()}: {mountpoint.last_error}")
+                    self.refresh([i])
+            except Exception:  # keep the loop alive
+                log.exception("Housekeeping failed")
+
+    def scheduler(self) -> None:
+        """Refresh the mounted 'sync' mirrors and the search indexes when due, until stopped."""
+        while not self.stopped.wait(5.0):
+            try:
+                with self.lock:
+                    idle = {
+                        i: m
+                        for i, m in self.mountobjects.items()
+                        if self.state[i]["mounted"] and not self.state[i]["operation"]
+                    }
+                due = [(i, "refresh") for i, m in idle.items() if hasattr(m, "due") and m.due()]
+                due += [(i, "index") for i, m in idle.items() if m.index_due()]
+                for i, action in due:
+                    try:
+                        self.submit(i, action)
+                    except RpcError as err:
+                        log.debug(f"Scheduled {action} skipped: {err}")
+            except Exception:  # keep the loop alive
+                log.exception("Scheduling failed")
+
+    def capacity_loop(self) -> None:
+        """Measure the capacity of the mounted sshfs mount points and alert, until stopped."""
+        while not self.stopped.wait(5.0):
+            try:
+                with self.lock:
+                    mounted = {
+                        i: (m.destination_full_path, m.server)
+                        for i, m in self.mountobjects.items()
+                        if m.type != "sync" and self.state[i]["mounted"]
+                    }
+                    gone = [i for i in self.state if i not in mounted and self.state[i]["capacity"]]
+                for i in gone:
+                    self.update_state(i, capacity=None)
+                    for name in ("size_bytes", "avail_bytes", "used_ratio"):
+                        self.metrics.remove(f"automounter_capacity_{name}", item=i)
+                    self.metrics.remove("automounter_inodes_used_ratio", item=i)
+
+                for i, capacity in self.capacity.collect(mounted).items():
+                    if not capacity or capacity == self.state.get(i, {}).get("capacity"):
+                        continue
+                    self.update_state(i, capacity=dict(capacity))
+                    self.metrics.set("automounter_capacity_size_bytes", capacity["size"], item=i)
+                    self.metrics.set("automounter_capacity_avail_bytes", capacity["avail"], item=i)
+                    self.metrics.set(
+                        "automounter_capacity_used_ratio", capacity["used_pct"] / 100, item=i
+                    )
+                    self.metrics.set(
+                        "automounter_inodes_used_ratio", capacity["inodes_pct"] / 100, item=i
+                    )
+                    for message in self.capacity.alerts(i, capacity):
+                        label = self.mountobjects[i].get_label()
+                        self.metrics.inc("automounter_capacity_alerts_total", item=i)
+                        self.log_event(f"{label}: {message}")
+                        self.publish("alert", {"item": i, "message": f"{label}: {message}"})
+            except Exception:  # keep the loop alive
+                log.exception("Measuring the capacity failed")
+
+    def process_loop(self) -> None:
+        """Sample the sshfs processes, apply their limits and restart them over, until stopped."""
+        interval = self.conf.get_process_interval()
+        while interval and not self.stopped.wait(interval):
+            try:
+                with self.lock:
+                    mounted = {
+                        i: m.destination_full_path
+                        for i, m in self.mountobjects.items()
+                        if m.type == "sshfs" and self.state[i]["mounted"]
+                    }
+                    gone = [
+                        i for i in self.state if i not in mounted and self.state[i]["processes"]
+                    ]
+                for i in gone:
+                    self.update_state(i, processes=None)
+                    for name in (
+                        "cpu_ratio",
+                        "rss_bytes",
+                        "threads",
+                        "read_bytes_total",
+                        "write_bytes_total",
+                    ):
+                        self.metrics.remove(f"automounter_sshfs_{name}", item=i)
+                try:
+                    usage = self.processes.sample(mounted)
+                except OSError as err:
+                    log.warning(f"Sampling the sshfs processes failed: {err}")
+                    continue
+
+                for i, sample in usage.items():
+                    mountpoint = self.mountobjects.get(i)
+                    if mountpoint is None:
+                        continue
+                    sample["limited"] = self.processes.limit(
+                        i, sample["pids"], mountpoint.max_rss_mb, mountpoint.cpu_weight
+                    )
+                    self.update_state(i, processes=sample)
+                    self.metrics.set("automounter_sshfs_cpu_ratio", sample["cpu_pct"] / 100, item=i)
+                    self.metrics.set("automounter_sshfs_rss_bytes", sample["rss"], item=i)
+                    self.metrics.set("automounter_sshfs_threads", sample["threads"], item=i)
+                    self.metrics.set(
+                        "automounter_sshfs_read_bytes_total", sample["read_bytes"], item=i
+                    )
+                    self.metrics.set(
+                        "automounter_sshfs_write_bytes_total", sample["write_bytes"], item=i
+                    )
+                    if not self.processes.breached(i, sample, mountpoint.max_rss_mb):
+                        continue
+                    rss = mod_capacity.human_size(sample["rss"])
+                    message = (
+                        f"{mountpoint.get_label()}: sshfs uses {rss}"
+                        f", over max_rss_mb = {mountpoint.max_rss_mb}, restarting"
+                    )
+                    self.metrics.inc("automounter_sshfs_restarts_total", item=i)
+                    self.log_event(message)
+                    self.publish("alert", {"item": i, "message": message})
+                    try:
+                        self.submit(i, "remount")
+                    except RpcError as err:
+                        log.warning(f"Restart of [{i}] skipped: {err}")
+            except Exception:  # keep the loop alive
+                log.exception("Sampling the sshfs processes failed")
+
+    def get_spool(self, i, mountpoint) -> mod_writeback.Spool:
+        """Return the spool of a 'writeback' mount point, a new one after a reload."""
+        with self.lock:
+            spool = self.spools.get(i)
+            if spool is None or spool.mountpoint is not mountpoint:
+                spool = self.spools[i] = mod_writeback.Spool(
+                    mountpoint, self.conf.get_writeback_settle()
+                )
+            return spool
+
+    def flush_spool(self, i, mountpoint) -> dict:
+        """Flush the spool of a mount point, publish its state and the conflicts."""
+        spool = self.get_spool(i, mountpoint)
+        report = spool.flush()
+        status = spool.status()
+        if report["bytes"]:
+            self.metrics.inc("automounter_spool_flushed_bytes_total", report["bytes"], item=i)
+        self.metrics.set("automounter_spool_pending_bytes", status["bytes"], item=i)
+        for rel in report["conflicts"]:
+            message = (
+                f"{mountpoint.get_label()}: {rel} is newer on the server, "
+                f"kept in {mod_writeback.CONFLICTS} of the spool"
+            )
+            self.metrics.inc("automounter_spool_conflicts_total", item=i)
+            self.log_event(message)
+            self.publish("alert", {"item": i, "message": message})
+        if status != self.state.get(i, {}).get("spool"):
+            self.update_state(i, spool=status)
+        return dict(report, **status)
+
+    def writeback_loop(self) -> None:
+        """Flush the spools of the 'writeback' mount points, mounted or not, until stopped."""
+        while not self.stopped.wait(self.conf.get_writeback_interval()):
+            with self.lock:
+                sections = {i: m for i, m in self.mountobjects.items() if m.writeback}
+                for i in [i for i in self.spools if i not in sections]:
+                    del self.spools[i]
+                    self.metrics.remove("automounter_spool_pending_bytes", item=i)
+            for i, mountpoint in sections.items():
+                try:
+                    self.flush_spool(i, mountpoint)
+                except Exception as err:  # keep flushing the other spools
+                    log.exception(f"Flushing the spool of [{i}] failed: {err}")
+
+    # ## RPC methods, called as rpc_<method>(**params)
+
+    def rpc_ping(self):
+        """Answer a liveness check."""
+        return "pong"
+
+    def rpc_status(self):
+        """Return the state of all mount points, from memory."""
+        with self.lock:
+            items = [dict(self.state[i]) for i in self.state]
+        return {"items": items, "config_error": self.config_error, "pid": os.getpid()}
+
+    def rpc_mount(self, item, wait=False, timeout=None):
+        """Mount a mount point, with wait the outcome is returned."""
+        future = self.submit(item, "mount", timeout=timeout)
+        return future.result() if wait else {"queued": True}
+
+    def rpc_umount(self, item, lazy=None, wait=False, timeout=None):
+        """Unmount a mount point, with wait the outcome is returned."""
+        future = self.submit(item, "umount", lazy=lazy, timeout=timeout)
+        return future.result() if wait else {"queued": True}
+
+    def rpc_autotune(self, item, wait=False):
+        """Measure the candidate sshfs option sets for a mount point, the winner is stored."""
+        future = self.submit(item, "autotune")
+        return future.result() if wait else {"queued": True}
+
+    def rpc_refresh(self, item, wait=False):
+        """Refresh the mirror of a 'sync' mount point now."""
+        if not hasattr(self.get_mountpoint(item), "refresh"):
+            raise RpcError(f"[{item}] is not a sync mount point")
+        future = self.submit(item, "refresh")
+        return future.result() if wait else {"queued": True}
+
+    def rpc_transfer(self, item, sources, target, streams=None, wait=False):
+        """Copy files out of a mount point with parallel streams, the progress is published."""
+        i = str(item)
+
+        def progress(state):
+            self.publish("transfer", dict(state, item=i))
+
+        future = self.submit(
+            item, "transfer", sources=sources, target=target, streams=streams, progress=progress
+        )
+
+        def count(done):
+            outcome = done.result()
+            if outcome["result"]:
+                moved = outcome["data"]["bytes"] - outcome["data"]["resumed"]
+                self.metrics.inc("automounter_transfer_bytes_total", moved, item=i)
+
+        future.add_done_callback(count)
+        return future.result() if wait else {"queued": True}
+
+    def rpc_fusetune(self, item, action="show", values=None, threads=16, wait=False):
+        """Show, apply, revert or benchmark the FUSE connection settings of a mount point."""
+        if action not in ("show", "apply", "revert", "bench"):
+            raise RpcError(f"Unknown fusetune action: {action}")
+        future = self.submit(item, "fusetune", action=action, values=values, threads=threads)
+        return future.result() if wait else {"queued": True}
+
+    def rpc_index(self, item, full=False, wait=False):
+        """Build or refresh the search index of a mount point."""
+        future = self.submit(item, "index", full=full)
+        return future.result() if wait else {"queued": True}
+
+    def rpc_offload(self, item, op, paths, target=None, algorithm=None, wait=False):
+        """Run checksum, du, rm, cp or mv on the server, the output lines are published."""
+        i = str(item)
+
+        def output(lines):
+            self.publish("offload", {"item": i, "op": op, "lines": lines})
+
+        future = self.submit(
+            item, "offload", op=op, paths=paths, target=target, algorithm=algorithm, output=output
+        )
+        return future.result() if wait else {"queued": True}
+
+    def rpc_flush(self, item, wait=False):
+        """Flush the write-back spool of a mount point now, with wait the report is returned."""
+        mountpoint = self.get_mountpoint(item)
+        if not mountpoint.writeback:
+            raise RpcError(f"[{item}] has no write-back spool")
+        if wait:
+            return self.flush_spool(str(item), mountpoint)
+        threading.Thread(
+            target=self.flush_spool, args=(str(item), mountpoint), name="flush", daemon=True
+        ).start()
+        return {"queued": True}
+
+    def rpc_search(self, text, item=None, limit=200):
+        """Search the indexes, of one or all mount points."""
+        with self.lock:
+            if item is None:
+                mountobjects = dict(self.mountobjects)
+            else:
+                mountobjects = {str(item): self.get_mountpoint(item)}
+        return mod_index.search(mountobjects, text, limit)
+
+    def rpc_cancel(self, item):
+        """Cancel the running operation of a mount point."""
+        mountpoint = self.get_mountpoint(item)
+        self.log_event(f"Cancelling: {mountpoint.get_label()}")
+        mountpoint.cancel()
+        return True
+
+    def unreachable(self, mountobjects) -> dict:
+        """Probe all the servers at once, return the reason per mount point none of them answer."""
+        targets = [(s, m.port) for m in mountobjects.values() for s in m.servers]
+        results = self.conf.reachability.probe(targets)
+        skipped = {}
+        for i, mountpoint in mountobjects.items():
+            probed = [results[(s, int(mountpoint.port))] for s in mountpoint.servers]
+            if not any(result.reachable for result in probed):
+                skipped[i] = "; ".join(result.reason for result in probed)
+        return skipped
+
+    def rpc_probe(self, items=None):
+        """Check the servers of the mount points at once, the reachable ones stay cached.
+
+        The mounts that follow in the cache lifetime skip their own pre-flight round.
+        """
+        with self.lock:
+            items = [str(i) for i in items] if items else list(self.mountobjects)
+        mountobjects = {i: self.get_mountpoint(i) for i in items}
+        return {"unreachable": self.unreachable(mountobjects)}
+
+    def rpc_mount_all(self):
+        """Probe all hosts at once and mount the reachable mount points."""
+        with self.lock:
+            idle = {
+                i: m
+                for i, m in self.mountobjects.items()
+                if not self.state[i]["operation"] and not self.state[i]["mounted"]
+            }
+        queued, skipped = [], self.unreachable(idle)
+        for i, reason in skipped.items():
+            self.log_event(f"Skipping {idle[i].get_label()}: {reason}")
+        reachable = {i: m for i, m in idle.items() if i not in skipped}
+
+        report = None
+        if self.conf.get_ssh_warmup():
+            report = self.rpc_warmup(list(reachable))
+            for i, reason in report["blocked"].items():
+                skipped[i] = reason
+                self.log_event(f"Skipping {reachable[i].get_label()}: {reason}")
+        for i in reachable:
+            if i not in skipped:
+                self.submit(i, "mount")
+                queued.append(i)
+        return {"queued": queued, "skipped": skipped, "warmup": report}
+
+    def warmup_targets(self, items=None) -> dict:
+        """Return the mount points to warm up, the given ones or all."""
+        with self.lock:
+            if items is None:
+                return dict(self.mountobjects)
+            return {str(i): self.get_mountpoint(i) for i in items}
+
+    def rpc_hostkeys(self, items=None):
+        """Return the hosts without a known host key, with their scanned keys and fingerprints."""
+        return mod_ssh.Warmup(self.conf, self.warmup_targets(items)).scan()
+
+    def rpc_accept_hostkeys(self, hostkeys):
+        """Add the scanned host keys, as returned by hostkeys, to known_hosts."""
+        accepted = mod_ssh.Warmup.accept(hostkeys)
+        for host in accepted:
+            self.log_event(f"Accepted the host key of {host}")
+        return accepted
+
+    def rpc_warmup(self, items=None):
+        """Log in to every distinct user, server and port without a prompt, in parallel.
+
+        The report has the reason per failed login, and the mount points whose servers all
+        failed as blocked.
+        """
+        mountobjects = self.warmup_targets(items)
+        report = mod_ssh.Warmup(self.conf, mountobjects).run()
+        blocked = {}
+        for i, mountpoint in mountobjects.items():
+            targets = [
+                mod_ssh.target_name(mountpoint.user, server, mountpoint.port)
+                for server in mountpoint.servers
+            ]
+            if targets and all(target in report["failed"] for target in targets):
+                blocked[i] = "; ".join(f"{t}: {report['failed'][t]}" for t in targets)
+        report["blocked"] = blocked
+        if report["failed"]:
+            self.log_event(f"ssh warm-up: {len(report['failed'])} logins failed")
+        return report
+
+    def rpc_umount_all(self, lazy=None, wait=False, timeout=None):
+        """Unmount all idle mount points at once, report the holders of the busy ones."""
+        if lazy is None:
+            lazy = self.conf.get_lazy_umount()
+        with self.lock:
+            idle = {i: m for i, m in self.mountobjects.items() if not self.state[i]["operation"]}
+            for i in idle:
+                self.state[i]["operation"] = "umount"
+
+        def work():
+            start = time.monotonic()
+            report = mod_busy.umount_all(idle, lazy, timeout)
+            duration = time.monotonic() - start
+            answer = {}
+            for i, (unmounted, held_by) in report.items():
+                holders = [str(holder) for holder in held_by]
+                answer[i] = {"unmounted": unmounted, "holders": holders}
+                if holders:
+                    self.log_event(f"{idle[i].get_label()} is held by: {', '.join(holders)}")
+                error = "" if unmounted else idle[i].last_error
+                self.history.record(i, "umount", unmounted, duration, idle[i].server, error)
+                changes = {"mounted": False} if unmounted else {}
+                self.update_state(i, operation="", last_error=error, **changes)
+                outcome = {"item": i, "action": "umount", "result": unmounted, "error": error}
+                self.publish("operation", outcome)
+            self.refresh(list(idle))
+            return answer
+
+        future = self.pool.submit(work)
+        return future.result() if wait else {"queued": list(idle)}
+
+    def rpc_busy(self):
+        """Return the processes holding each mount point, found with one scan."""
+        with self.lock:
+            paths = {i: m.destination_full_path for i, m in self.mountobjects.items()}
+        holders = mod_busy.BusyMountAnalyzer().scan(list(paths.values()))
+        return {i: [str(holder) for holder in holders[path]] for i, path in paths.items()}
+
+    def rpc_reconcile(self, dry_run=False):
+        """Remove the orphaned folders and detach the dead mounts in the mount folder."""
+        with self.lock:
+            destinations = [m.destination_full_path for m in self.mountobjects.values()]
+
+        def busy(path):
+            with self.lock:
+                return any(
+                    m.destination_full_path == path
+                    and (self.state[i]["operation"] or self.state[i]["mounted"])
+                    for i, m in self.mountobjects.items()
+                )
+
+        reconciler = mod_reconcile.Reconciler(
+            self.conf.get_destination_folder(),
+            destinations,
+            busy,
+            self.conf.get_command_timeout(),
+        )
+        report = reconciler.run(dry_run)
+        if report["removed"] or report["detached"]:
+            self.log_event(
+                f"Cleaned the mount folder: removed {len(report['removed'])} folders, "
+                f"detached {len(report['detached'])} dead mounts"
+            )
+        self.refresh()
+        return report
+
+    def rpc_history(self, item=None, days=30.0, limit=100):
+        """Return the uptime, mount latencies and the failure timeline from the history."""
+        with self.lock:
+            items = [str(item)] if item is not None else list(self.mountobjects)
+        return {
+            "summary": [self.history.summary(i, days) for i in items],
+            "timeline": self.history.timeline(item, days, limit),
+        }
+
+    def rpc_metrics(self):
+        """Return all the metrics."""
+        return self.metrics.snapshot()
+
+    def rpc_memory(self, top=15):
+        """Return the memory report, the first call starts the tracing and takes the baseline."""
+        with self.lock:
+            extra = [
+                f"Mount points: {len(self.mountobjects)}, subscribers: {len(self.subscribers)}, "
+                f"threads: {threading.active_count()}"
+            ]
+        return self.memory.report(top, extra)
+
+    def rpc_reload(self):
+        """Read the configuration file again, only when no operation is running."""
+        with self.lock:
+            if any(state["operation"] for state in self.state.values()):
+                raise RpcError("Can't reload while an operation is running")
+            try:
+                self.conf.read()
+            except mod_configuration_file.ModConfigurationFileExceptions as err:
+                raise RpcError(str(err)) from err  # the running config stays
+            self.load_mount_points()
+        self.refresh()
+        self.publish("reload", self.rpc_status())
+        return True
+
+    def rpc_shutdown(self):
+        """Stop the daemon, the mounts stay as they are."""
+        log.info("Shutdown requested")
+        threading.Thread(target=self.stop, daemon=True).start()
+        return True
+
+    # ## serving
+
+    def serve(self) -> None:
+        """Run the daemon until it is stopped, only one daemon runs per socket."""
+        lock_file = open(f"{self.socket_path}.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as err:
+            raise DaemonRunningError(self.socket_path) from err
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # left over from a crashed daemon
+        self.server = RpcServer(self.socket_path, RpcHandler)
+        self.server.owner = self
+        os.chmod(self.socket_path, 0o600)
+
+        log.info(f"Daemon listening on {self.socket_path}, pid {os.getpid()}")
+        # 'kill -USR1 <pid>' writes a memory report to the diagnostics log
+        signal.signal(
+            signal.SIGUSR1,
+            lambda signum, frame: threading.Thread(target=self.rpc_memory, daemon=True).start(),
+        )
+        self.refresh()
+        if self.conf.get_reconcile_at_start():
+            threading.Thread(target=self.rpc_reconcile, name="reconcile", daemon=True).start()
+        threading.Thread(target=self.housekeeping, name="housekeeping", daemon=True).start()
+        threading.Thread(target=self.scheduler, name="scheduler", daemon=True).start()
+        threading.Thread(target=self.capacity_loop, name="capacity", daemon=True).start()
+        threading.Thread(target=self.process_loop, name="processes", daemon=True).start()
+        threading.Thread(target=self.writeback_loop, name="writeback", daemon=True).start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.pool.shutdown(wait=False)
+            lock_file.close()
+            log.info("Daemon stopped")
+
+    def stop(self) -> None:
+        """Stop serving."""
+        self.stopped.set()
+        if self.server:
+            self.server.shutdown()
+
+
+class RpcServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """This class serves each client connection in its own thread."""
+
+    daemon_threads = True
+
+
+class RpcHandler(socketserver.StreamRequestHandler):
+    """This class handles the JSON-RPC requests of one client connection."""
+
+    def setup(self):
+        """Set up the connection."""
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.events = queue.Queue(EVENT_QUEUE)
+        # a client that doesn't read can't block a write for longer
+        self.connection.setsockopt(
+            socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack("ll", SEND_TIMEOUT, 0)
+        )
+
+    def handle(self):
+        """Answer the requests, one JSON object per line."""
+        owner = self.server.owner
+        try:
+            for line in self.rfile:
+                self.answer(owner, line)
+        except OSError:
+            pass  # dropped
+        finally:
+            owner.subscribers.discard(self)
+            try:
+                self.events.put_nowait(None)  # stops the event writer
+            except queue.Full:
+                pass
+
+    def subscribe(self, owner) -> None:
+        """Send the events from the queue in a writer thread of this client."""
+        threading.Thread(
+            target=self.write_events, args=(owner,), name="daemon_events", daemon=True
+        ).start()
+        owner.subscribers.add(self)
+
+    def notify(self, message) -> bool:
+        """Queue an event for the client, return False when it doesn't keep up."""
+        try:
+            self.events.put_nowait(message)
+            return True
+        except queue.Full:
+            return False
+
+    def write_events(self, owner) -> None:
+        """Write the queued events to the client until it is gone or too slow."""
+        while True:
+            message = self.events.get()
+            if message is None:
+                return
+            if not self.send(message):
+                self.drop(owner)
+                return
+
+    def drop(self, owner) -> None:
+        """Unsubscribe the client and close its connection, it reconnects when it is alive."""
+        owner.subscribers.discard(self)
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def answer(self, owner, line):
+        """Dispatch one request to the daemon."""
+        try:
+            request = json.loads(line)
+            rid = request.get("id")
+            method = request.get("method", "")
+            params = request.get("params") or {}
+        except (ValueError, AttributeError):
+            error = {"code": -32700, "message": "Parse error"}
+            self.send({"jsonrpc": "2.0", "id": None, "error": error})
+            return
+
+        if method == "subscribe":
+            self.send({"jsonrpc": "2.0", "id": rid, "result": True})
+            self.subscribe(owner)
+            return
+
+        func = getattr(owner, f"rpc_{method}", None)
+        if func is None:
+            error = {"code": -32601, "message": f"Method not found: {method}"}
+            self.send({"jsonrpc": "2.0", "id": rid, "error": error})
+            return
+        try:
+            inspect.signature(func).bind(**params)
+        except TypeError as err:
+            self.send({"jsonrpc": "2.0", "id": rid, "error": {"code": -32602, "message": str(err)}})
+            return
+        try:
+            result = func(**params)
+        except RpcError as err:
+            self.send({"jsonrpc": "2.0", "id": rid, "error": {"code": -32000, "message": str(err)}})
+            return
+        except Exception as err:  # the client gets an answer whatever went wrong
+            log.exception(f"{method} failed")
+            error = {"code": -32603, "message": f"Internal error: {err}"}
+            self.send({"jsonrpc": "2.0", "id": rid, "error": error})
+            return
+        self.send({"jsonrpc": "2.0", "id": rid, "result": result})
+
+    def send(self, message) -> bool:
+        """Write a message to the client, return False when the client is gone."""
+        try:
+            with self.write_lock:
+                self.wfile.write((json.dumps(message) + "\n").encode())
+                self.wfile.flush()
+            return True
+        except OSError:
+            return False
+
+
+class DaemonClient:
+    """This class talks to the daemon, every call uses its own short connection."""
+
+    def __init__(self, socket_path) -> None:
+        """Initialize the class."""
+        self.socket_path = socket_path
+        self.ids = 0
+
+    def call(self, method, params=None, timeout=10.0):
+        """Call a daemon method and return its result, timeout None waits forever."""
+        self.ids += 1
+        request = {"jsonrpc": "2.0", "id": self.ids, "method": method, "params": params or {}}
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(timeout)
+                sock.connect(self.socket_path)
+                sock.sendall((json.dumps(request) + "\n").encode())
+                line = sock.makefile("rb").readline()
+        except OSError as err:
+            raise DaemonUnavailableError(err) from err
+        if not line:
+            raise DaemonUnavailableError("connection closed")
+
+        answer = json.loads(line)
+        if "error" in answer:
+            raise DaemonCallError(answer["error"]["message"])
+        return answer["result"]
+
+    def subscribe(self, callback) -> threading.Thread:
+        """Call callback(event, data) for each daemon event, in a reader thread.
+
+        When the connection drops the callback gets a 'disconnected' event.
+        """
+
+        def reader():
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(self.socket_path)
+                    request = {"jsonrpc": "2.0", "id": 0, "method": "subscribe"}
+                    sock.sendall((json.dumps(request) + "\n").encode())
+                    for line in sock.makefile("rb"):
+                        message = json.loads(line)
+                        if message.get("method") == "event":
+                            callback(message["params"]["event"], message["params"]["data"])
+            except OSError as err:
+                log.warning(f"Event connection lost: {err}")
+            callback("disconnected", {})
+
+        thread = threading.Thread(target=reader, name="daemon_events", daemon=True)
+        thread.start()
+        return thread
+
+    def ensure_daemon(self, wait=5.0) -> None:
+        """Start the daemon in the background when it isn't running."""
+        try:
+            self.call("ping", timeout=1.0)
+            return
+        except DaemonUnavailableError:
+            pass
+
+        log.info("Starting the daemon")
+        subprocess.Popen(
+            mod_general.program_command() + ["daemon"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            try:
+                self.call("ping", timeout=1.0)
+                return
+            except DaemonUnavailableError:
+                pass
+        raise DaemonUnavailableError(f"the daemon did not start within {wait:g}s")
+
+
+class ModDaemonExceptions(Exception):
+    """The parent exception class for this module."""
+
+    pass
+
+
+class RpcError(ModDaemonExceptions):
+    """Exception raised by an RPC method, the message is sent to the client."""
+
+    pass
+
+
+class DaemonRunningError(ModDaemonExceptions):
+    """Exception raised when a daemon is already serving the socket."""
+
+    def __init__(self, message):
+        """Initialize the class."""
+        msg = f"A daemon is already running for: {message}"
+        self.message = msg
+        super().__init__(self.message)
+
+
+class DaemonUnavailableError(ModDaemonExceptions):
+    """Exception raised when the daemon can't be reached."""
+
+    def __init__(self, message):
+        """Initialize the class."""
+        msg = f"The daemon is not available: {message}"
+        self.message = msg
+        super().__init__(self.message)
+
+
+class DaemonCallError(ModDaemonExceptions):
+    """Exception raised when the daemon answered with an error."""
+
+    pass
@@ -0,0 +1,263 @@
+"""This module tunes the kernel FUSE connection of a mount point, without remounting."""
+
+import os
+import re
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+
+log = logging.getLogger(__name__)
+
+CONNECTIONS = "/sys/fs/fuse/connections"
+SETTINGS = ("max_background", "congestion_threshold")
+DEFAULTS = {"max_background": 12, "congestion_threshold": 9}  # the kernel's defaults
+MIB = 1048576
+
+
+def unescape(path) -> str:
+    """Return a mountinfo path without its octal escapes, like '\\040' for a space."""
+    return re.sub(r"\\([0-7]{3})", lambda match: chr(int(match.group(1), 8)), path)
+
+
+def connection_id(path, mountinfo="/proc/self/mountinfo") -> Optional[int]:
+    """Return the FUSE connection of the mount on the path, from its device in mountinfo.
+
+    The path is resolved up to the mount point's parent folder, the mount itself is not
+    touched, a hung mount can't block this.
+    """
+    parent, name = os.path.split(os.path.abspath(path))
+    target = os.path.join(os.path.realpath(parent), name)
+    found = None
+    with open(mountinfo) as info:
+        for line in info:
+            fields, _, rest = line.partition(" - ")
+            fields = fields.split()
+            if rest.startswith("fuse") and unescape(fields[4]) == target:
+                major, minor = fields[2].split(":")
+                # the kernel's s_dev, not the userspace encoding of os.makedev
+                found = (int(major) << 20) | int(minor)  # the last one is on top
+    return found
+
+
+class FuseConnection:
+    """This class reads and writes the settings of one kernel FUSE connection."""
+
+    def __init__(self, cid, root=CONNECTIONS) -> None:
+        """Initialize the class."""
+        self.id = cid
+        self.folder = os.path.join(root, str(cid))
+
+    def read(self) -> Dict[str, Optional[int]]:
+        """Return the current settings, None for the ones that can't be read."""
+        values = {}
+        for name in SETTINGS:
+            try:
+                with open(os.path.join(self.folder, name)) as setting:
+                    values[name] = int(setting.read())
+            except (OSError, ValueError):
+                values[name] = None
+        return values
+
+    def write(self, values) -> Dict[str, str]:
+        """Write the settings, return the reason for each one that was refused."""
+        errors = {}
+        for name in SETTINGS:  # max_background first, the threshold follows it
+            if values.get(name) is None:
+                continue
+            try:
+                with open(os.path.join(self.folder, name), "w") as setting:
+                    setting.write(str(values[name]))
+            except PermissionError:
+                errors[name] = "permission denied, writing it needs root"
+            except OSError as err:
+                errors[name] = err.strerror or str(err)
+        return errors
+
+
+class FuseTuner:
+    """This class applies the 'fuse_*' keys of a mount point to its FUSE connection.
+
+    The values before the first change are kept in the state folder per connection, so a
+    revert restores them, also after a restart of the app.
+    """
+
+    def __init__(self, mountpoint, root=CONNECTIONS) -> None:
+        """Initialize the class."""
+        self.mountpoint = mountpoint
+        self.root = root
+        self.originals_file = os.path.join(
+            mountpoint.conf.get_state_folder(), "fuse", f"{mountpoint.item}.json"
+        )
+
+    def connection(self) -> FuseConnection:
+        """Return the FUSE connection of the mount point, raise NoConnectionError."""
+        try:
+            cid = connection_id(self.mountpoint.destination_full_path)
+        except OSError as err:
+            raise NoConnectionError(f"{self.mountpoint.destination_full_path}: {err}") from err
+        if cid is None or not os.path.isdir(os.path.join(self.root, str(cid))):
+            raise NoConnectionError(self.mountpoint.destination_full_path)
+        return FuseConnection(cid, self.root)
+
+    def originals(self, connection) -> Dict[str, int]:
+        """Return the kept values of the connection before the first change."""
+        try:
+            with open(self.originals_file) as originals:
+                kept = json.load(originals)
+        except (OSError, ValueError):
+            kept = {}
+        return kept.get("values", {}) if kept.get("id") == connection.id else {}
+
+    def keep(self, connection) -> None:
+        """Keep the current values of a connection before its first change."""
+        if self.originals(connection):
+            return
+        os.makedirs(os.path.dirname(self.originals_file), exist_ok=True)
+        with open(self.originals_file, "w") as originals:
+            json.dump({"id": connection.id, "values": connection.read()}, originals)
+
+    def show(self, connection=None, errors=None) -> Dict:
+        """Return the effective settings of the connection."""
+        connection = connection or self.connection()
+        return dict(connection.read(), id=connection.id, errors=errors or {})
+
+    def apply(self, values=None) -> Dict:
+        """Write the values, default the section's keys, return the effective settings."""
+        values = values or self.mountpoint.fuse_settings
+        connection = self.connection()
+        if not values:
+            return self.show(connection)
+        self.keep(connection)
+        errors = connection.write(values)
+        for name, reason in errors.items():
+            log.warning(f"FUSE {name} of {self.mountpoint.get_label()} not set: {reason}")
+        return self.show(connection, errors)
+
+    def revert(self) -> Dict:
+        """Write the values back from before the first change, return the effective settings."""
+        connection = self.connection()
+        errors = connection.write(self.originals(connection) or DEFAULTS)
+        if not errors:
+            try:
+                os.remove(self.originals_file)
+            except FileNotFoundError:
+                pass
+        return self.show(connection, errors)
+
+    def sample_files(self, count) -> List[str]:
+        """Return up to 'count' non-empty files of the mount point, from 'tune_path' on."""
+        top = os.path.join(self.mountpoint.destination_full_path, self.mountpoint.tune_path)
+        files = []
+        for root, folders, names in os.walk(top):
+            folders.sort()
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                try:
+                    if os.path.isfile(path) and os.path.getsize(path):
+                        files.append(path)
+                except OSError:
+                    continue
+                if len(files) >= count:
+                    return files
+        return files
+
+    @staticmethod
+    def read_round(files, threads, per_file) -> Dict:
+        """Read the files in parallel, without the page cache, return the throughput."""
+
+        def read(path):
+            done = 0
+            with open(path, "rb", buffering=0) as data:
+                os.posix_fadvise(data.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+                while done < per_file:
+                    block = data.read(min(MIB, per_file - done))
+                    if not block:
+                        break
+                    done += len(block)
+            return done
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(threads, thread_name_prefix="fusebench") as pool:
+            total = sum(pool.map(read, files))
+        seconds = time.monotonic() - started
+        return {"bytes": total, "seconds": seconds, "rate": total / seconds if seconds else 0.0}
+
+    def benchmark(self, values=None, threads=16, count=64, per_file_mb=8, rounds=2) -> Dict:
+        """Time parallel reads with the settings before and after, alternating, best of rounds.
+
+        Before are the settings from before the first change, the connection is left with
+        the settings it has now.
+        """
+        values = values or self.mountpoint.fuse_settings
+        if not values:
+            raise ModFuseExceptions("No fuse_max_background or fuse_congestion_threshold to test")
+        connection = self.connection()
+        current = connection.read()
+        before = self.originals(connection) or current
+        files = self.sample_files(count)
+        if not files:
+            raise ModFuseExceptions("No files to read in the mount point")
+        per_file = per_file_mb * MIB
+        results = {"before": [], "after": []}
+        try:
+            for _ in range(rounds):
+                for name, setting in (("before", before), ("after", values)):
+                    errors = connection.write(setting)
+                    if errors:
+                        raise ModFuseExceptions(f"Could not set {', '.join(errors.values())}")
+                    results[name].append(self.read_round(files, threads, per_file))
+        finally:
+            connection.write(current)
+        best = {name: max(runs, key=lambda run: run["rate"]) for name, runs in results.items()}
+        gain = best["after"]["rate"] / best["before"]["rate"] - 1 if best["before"]["rate"] else 0
+        return {
+            "files": len(files),
+            "threads": threads,
+            "settings_before": before,
+            "settings_after": values,
+            "before": best["before"],
+            "after": best["after"],
+            "gain": gain,
+        }
+
+
+def describe(values) -> str:
+    """Return the short text of the effective settings."""
+    if not values:
+        return ""
+    return (
+        f"FUSE connection {values['id']}: max_background {values['max_background']}, "
+        f"congestion_threshold {values['congestion_threshold']}"
+    )
+
+
+def describe_benchmark(report) -> List[str]:
+    """Return the lines of a benchmark report."""
+    lines = [f"{report['files']} files read with {report['threads']} threads, best of each:"]
+    for name in ("before", "after"):
+        run = report[name]
+        settings = ", ".join(f"{k} {v}" for k, v in report[f"settings_{name}"].items())
+        lines.append(
+            f"  {name:6} {run['rate'] / MIB:8.1f} MiB/s  {run['seconds']:6.2f}s  ({settings})"
+        )
+    lines.append(f"  gain {report['gain'] * 100:+.0f}%")
+    return lines
+
+
+class ModFuseExceptions(Exception):
+    """The parent exception class for this module."""
+
+    pass
+
+
+class NoConnectionError(ModFuseExceptions):
+    """Exception raised when a mount point has no FUSE connection."""
+
+    def __init__(self, message):
+        """Initialize the class."""
+        msg = f"No FUSE connection is mounted on {message}"
+        self.message = msg
+        super().__init__(self.message)
@@ -40,6 +40,13 @@ def rmdir(folder):
         return True
 
 
+def program_command():
+    """Return the command that starts this program, for the script and the frozen app."""
+    if getattr(sys, "frozen", False):
+        return [sys.executable]
+    return [sys.executable, os.path.abspath(sys.argv[0])]
+
+
 def restart_program():
     """Restarts the current program.
 
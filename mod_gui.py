@@ -1,32 +1,48 @@
 """Class for the main GUI elements and event handling."""
 
 import sys
+import queue
+import signal
 import logging
+import threading
 from datetime import datetime
+from collections import Counter
 from PyQt5 import QtCore, QtWidgets
 
+import mod_daemon
 import mod_general
+import mod_memory
+import mod_capacity
+import mod_fuse
+import mod_procacct
+import mod_writeback
+import mod_transfer
+import mod_history
 import mod_gui_design
 import mod_git_info
-import mod_configuration_file
+import mod_watchdog
 
 
 log = logging.getLogger(__name__)
 
 
 class MainWindow(QtWidgets.QMainWindow, mod_gui_design.Ui_MainWindow):
-    """This class provides the main Qt window."""
+    """This class provides the main Qt window, a client of the daemon."""
 
-    logstack = []  # stack holding all logs
-    mountobjects = {}  # Dict with the objects for each mountpoint
-    statusmsg = []  # list holding the status message stack
-    statusloop = 0
     statsmsg = ["*", "**", "***", "****"]
 
     def __init__(self, conf, *args, **kwargs):
         """Start the class object."""
         log.debug("--init--")
         self.conf = conf
+        self.logstack = []  # stack holding all logs
+        self.mountitems = {}  # Dict with the daemon's state for each mountpoint
+        self.statusmsg = []  # list holding the status message stack
+        self.statusloop = 0
+        self.client = mod_daemon.DaemonClient(conf.get_socket_path())
+        self.events = queue.Queue()  # the events received from the daemon
+        self.memory = mod_memory.MemoryDiagnostics(conf.get_diagnostics_log())
+        self.memoryRequested = False  # set by SIGUSR1, handled in the GUI thread
         super(MainWindow, self).__init__(*args, **kwargs)
 
         # load the GUI
@@ -34,13 +50,13 @@ class MainWindow(QtWidgets.QMainWindow, mod_gui_design.Ui_MainWindow):
         # run the GUI 'setupUi' post updates
         self.guiPostUpdates()
 
-        # Make all the mountpoint objects that are
-        # provided in the config file and add them to the GUI
+        # Get all the mountpoints the daemon owns and add them to the GUI
         self.getConfMountItems()
         self.makeGuiMountItems()
 
         # Check all of the mountpoints
         self.checkMountItems()
+        self.client.subscribe(self.receiveEvent)
 
         self.logWindowUpdate()
         self.setTimers()
@@ -58,6 +74,15 @@ class MainWindow(QtWidgets.QMainWindow, mod_gui_design.Ui_MainWindow):
 
         # set the actions for the menus
         self.actionquit.triggered.connect(self.actionQuit)
+        self.actionmount_all.triggered.connect(self.actionMountAll)
+        self.actionumount_all.triggered.connect(self.actionUmountAll)
+        self.actionreconcile.triggered.connect(self.actionReconcile)
+        self.actionshow_stalls.triggered.connect(self.actionShowStalls)
+        self.actionmemory_report.triggered.connect(self.actionMemoryReport)
+        signal.signal(signal.SIGUSR1, self.requestMemoryReport)
+
+        # the log window drops its oldest lines, it runs for weeks
+        self.textBrowser.document().setMaximumBlockCount(self.conf.get_log_window_lines())
         self.actionshow_about.triggered.connect(self.actionShowAbout)
 
         # set the actions for the buttons
@@ -65,6 +90,10 @@ class MainWindow(QtWidgets.QMainWindow, mod_gui_design.Ui_MainWindow):
         self.pushButton_cleartext.clicked.connect(self.logWindowClear)
         self.pushButton_save.clicked.connect(self.actionSaveConfig)
         self.pushButton_cancel.clicked.connect(self.actionCancelConfig)
+        self.pushButton_history.clicked.connect(self.historyWindowUpdate)
+        self.pushButton_search.clicked.connect(self.actionSearch)
+        self.lineEdit_search.returnPressed.connect(self.actionSearch)
+        self.tabWidget.currentChanged.connect(self.tabChanged)
 
         # fill the config window with the contents of the config filename
         self.getConfigTextToFillConfigWindow()
@@ -73,25 +102,28 @@ class MainWindow(QtWidgets.QMainWindow, mod_gui_design.Ui_MainWindow):
         self.logWindowUpdate()
 
     def getConfMountItems(self):
-        """Get the mount items listed in the config file."""
+        """Get the mount items from the daemon, start the daemon if needed."""
         log.debug("--getConfMountItems--")
         try:
-            self.mountobjects = self.conf.get_mount_points()
-            log.debug(f"mountobjects: {self.mountobjects}")
-        except mod_configuration_file.NoMountPointError:
-            log.error("No matching config sections are found!")
-            self.logstack.append("No matching config sections are found!")
-            self.logstack.append("Add a section to the config.ini")
-        except mod_configuration_file.IncompleteMountTargetError:
-            log.error("Mounting target is incomplete in the config file.")
-            self.logstack.append("Mounting target is incomplete in the config file.")
-            self.logstack.append("Please correct to mountpoint")
+            self.client.ensure_daemon()
+            status = self.client.call("status")
+        except mod_daemon.ModDaemonExceptions as err:
+            log.error(f"No daemon: {err}")
+            self.logstack.append(f"The daemon is not available: {err}")
+            return
+
+        self.mountitems = {state["item"]: state for state in status["items"]}
+        log.debug(f"mountitems: {self.mountitems}")
+        if status["config_error"]:
+            log.error(f"Configuration error: {status['config_error']}")
+            self.logstack.append(f"Configuration error: {status['config_error']}")
+            self.logstack.append("Please correct the config.ini")
 
     def makeGuiMountItems(self):
         """Make GUI mount objects."""
         log.debug("--makeGuiMountItems--")
 
-        for i in self.mountobjects:
+        for i in self.mountitems:
             # make the label and button for each item
             self.makeMountItem(i)
             # after making the button and label, update the labeltext
@@ -100,26 +132,19 @@ class MainWindow(QtWidgets.QMainWindow, mod_gui_design.Ui_MainWindow):
             if not lineEdit:
                 log.warning("QLineEdit could not be found.")
             else:
-                lineEdit.setText(self.mountobjects[i].get_label())
+                lineEdit.setText(self.mountitems[i]["label"])
 
     def checkMountItems(self):
-        """Check each of the mount items state."""
+        """Show each of the mount items state."""
         log.debug("--checkMountItems--")
 
-        for i, mountpoint in self.mountobjects.items():
-            self.logstack.append("Checking the mount...")
-            self.logstack.append(f"location: {mountpoint.get_label()}")
-            if mountpoint.check_mount_location():
+        for i, state in self.mountitems.items():
+            self.logstack.append(f"location: {state['label']}")
+            if state["mounted"]:
                 self.logstack.append("location is already mounted!")
-                pushButton = self.findChild(QtWidgets.QPushButton, f"pushButton_{i}")
-                if pushButton:
-                    pushButton.setText("UnMount")
-                    checkbox = self.findChild(QtWidgets.QCheckBox, f"checkBox_{i}")
-                    checkbox.setChecked(True)
-                else:
-                    log.warning("pushbutton was not found")
             else:
                 self.logstack.append("location is not mounted!")
+            self.updateMountItem(i)
 
         self.logstack.append("")  # append a empty line for user reading clarity
 
@@ -136,6 +161,23 @@ class MainWindow(QtWidgets.QMainWindow, mod_gui_design.Ui_MainWindow):
         self.txtTimer.start(500)
         self.txtTimer.timeout.connect(self.logWindowUpdate)
 
+        # setup a timer to handle the events of the daemon
+        self.eventTimer = QtCore.QTimer(self)
+        self.eventTimer.start(200)
+        self.eventTimer.timeout.connect(self.handleEvents)
+
+        # setup the heartbeat of the stall watchdog, it beats while the event loop runs
+        self.watchdog = None
+        threshold = self.conf.get_stall_threshold()
+        if threshold > 0:
+            self.watchdog = mod_watchdog.StallWatchdog(
+                threshold / 1000, self.conf.get_diagnostics_log()
+            )
+            self.heartbeatTimer = QtCore.QTimer(self)
+            self.heartbeatTimer.start(max(10, int(threshold / 4)))
+            self.heartbeatTimer.timeout.connect(self.watchdog.beat)
+            self.watchdog.start()
+
     def statusBarUpdate(self):
         """Update the statusbar."""
         if self.statusmsg:
@@ -163,6 +205,20 @@ class MainWindow(QtWidgets.QMainWindow, mod_gui_design.Ui_MainWindow):
         log.info("Clearing the logWindow contents.")
         self.textBrowser.clear()
 
+    def tabChanged(self, index):
+        """Refresh the history when its tab is shown."""
+        if self.tabWidget.widget(index) is self.tab_3:
+            self.historyWindowUpdate()
+
+    def historyWindowUpdate(self):
+        """Fill the history window with the daemon's uptime, latencies and failures."""
+        log.debug("--historyWindowUpdate--")
+        report = self.callDaemon("history")
+        if report is None:
+            return
+        labels = {i: state["label"] for i, state in self.mountitems.items()}
+        self.textBrowser_history.setPlainText("\n".join(mod_history.format_report(report, labels)))
+
     def getConfigTextToFillConfigWindow(self):
         """Fill the config window with contents."""
         log.debug("--getConfigTextToFillConfigWindow--")
@@ -172,52 +228,370 @@ class MainWindow(QtWidgets.QMainWindow, mod_gui_design.Ui_MainWindow):
         for line in lines:
             self.textEdit.append(line)
 
+    def receiveEvent(self, event, data):
+        """Queue a daemon event, this runs in the event reader thread."""
+        self.events.put((event, data))
+
+    def handleEvents(self):
+        """Handle the queued daemon events in the GUI thread."""
+        if self.memoryRequested:
+            self.memoryRequested = False
+            self.actionMemoryReport()
+        while not self.events.empty():
+            event, data = self.events.get()
+            if event == "state" and data["item"] in self.mountitems:
+                self.mountitems[data["item"]] = data
+                self.updateMountItem(data["item"])
+            elif event == "log":
+                self.logstack.append(data["message"])
+            elif event == "alert":
+                self.statusmsg.append(data["message"])
+            elif event == "transfer":
+                self.updateTransfer(data)
+            elif event == "offload":
+                self.logstack.extend(data["lines"])
+            elif event == "hostkeys":
+                self.acceptHostKeys(data)
+            elif event == "operation":
+                action = data["action"]
+                if action == "autotune" and data["result"]:
+                    self.logstack.extend(data["data"]["text"].splitlines())
+                    self.statusmsg.append("Auto-tune done")
+                elif action == "transfer":
+                    self.finishTransfer(data)
+                elif action == "fusetune" and data["result"]:
+                    report = data["data"]
+                    if "gain" in report:
+                        self.logstack.extend(mod_fuse.describe_benchmark(report))
+                    else:
+                        self.logstack.append(mod_fuse.describe(report))
+                        for name, reason in report["errors"].items():
+                            self.logstack.append(f"{name} not set: {reason}")
+                elif action == "offload" and data["result"]:
+                    report = data["data"]
+                    self.statusmsg.append(f"{report['op']} done in {report['seconds']:.1f}s")
+                elif action == "index" and data["result"]:
+                    report = data["data"]
+                    self.statusmsg.append(
+                        f"Index of {self.mountitems[data['item']]['label']}: "
+                        f"{report['entries']} entries"
+                    )
+                elif data["result"]:
+                    self.statusmsg.append("Mounted" if action == "mount" else "UnMounted")
+                else:
+                    self.statusmsg.append(f"Failed to {action}")
+            elif event == "disconnected":
+                self.logstack.append("Lost the connection to the daemon, reconnecting...")
+                QtCore.QTimer.singleShot(2000, self.reconnectDaemon)
+
+    def reconnectDaemon(self):
+        """Restart the daemon when needed and subscribe to its events again."""
+        log.debug("--reconnectDaemon--")
+        try:
+            self.client.ensure_daemon()
+            status = self.client.call("status")
+        except mod_daemon.ModDaemonExceptions as err:
+            self.logstack.append(str(err))
+            QtCore.QTimer.singleShot(5000, self.reconnectDaemon)
+            return
+        for state in status["items"]:
+            self.events.put(("state", state))
+        self.client.subscribe(self.receiveEvent)
+
+    def callDaemon(self, method, params=None, timeout=10.0):
+        """Call a daemon method, errors are shown in the log window."""
+        try:
+            return self.client.call(method, params, timeout=timeout)
+        except mod_daemon.ModDaemonExceptions as err:
+            log.error(f"{method} failed: {err}")
+            self.logstack.append(f"{method} failed: {err}")
+            return None
+
+    def updateMountItem(self, i):
+        """Set the row button and checkbox to the mount state."""
+        pushButton = self.findChild(QtWidgets.QPushButton, f"pushButton_{i}")
+        checkbox = self.findChild(QtWidgets.QCheckBox, f"checkBox_{i}")
+        if not pushButton or not checkbox:
+            log.warning("Mount item widgets could not be found.")
+            return
+        state = self.mountitems[i]
+        if state["operation"]:
+            pushButton.setText("Cancel")
+        else:
+            pushButton.setText("UnMount" if state["mounted"] else "Mount")
+        checkbox.setChecked(state["mounted"])
+        fuse = mod_fuse.describe(state.get("fuse"))
+        pushButton.setToolTip(f"{state['server']}\n{fuse}\n{state['last_error']}".strip())
+
+        capacityLabel = self.findChild(QtWidgets.QLabel, f"label_capacity_{i}")
+        capacity = state.get("capacity")
+        if capacityLabel:
+            capacityLabel.setText(mod_capacity.describe(capacity))
+            if capacity:
+                capacityLabel.setToolTip(
+                    f"used {mod_capacity.human_size(capacity['used'])} of "
+                    f"{mod_capacity.human_size(capacity['size'])}\n"
+                    f"inodes {capacity['inodes_pct']:.0f}% used, {capacity['files_free']} free"
+                )
+
+        processesLabel = self.findChild(QtWidgets.QLabel, f"label_processes_{i}")
+        processes = state.get("processes")
+        if processesLabel:
+            processesLabel.setText(mod_procacct.describe(processes))
+            if processes:
+                processesLabel.setToolTip(
+                    f"sshfs pids {', '.join(map(str, processes['pids']))}, "
+                    f"{processes['threads']} threads\n"
+                    f"read {mod_capacity.human_size(processes['read_bytes'])}, "
+                    f"written {mod_capacity.human_size(processes['write_bytes'])}\n"
+                    f"limits: {processes['limited'] or 'none'}"
+                )
+
+        spoolLabel = self.findChild(QtWidgets.QLabel, f"label_spool_{i}")
+        spool = state.get("spool")
+        if spoolLabel:
+            spoolLabel.setText(mod_writeback.describe(spool))
+            if spool:
+                spoolLabel.setToolTip(
+                    f"{state['destination']}.spool\n"
+                    f"flushed {mod_capacity.human_size(spool['flushed'])}, "
+                    f"{spool['conflicts']} conflicts\n{spool['paused']}".strip()
+                )
+
     def actionButtonClick(self):
         """Action on a (un)mount button click."""
         log.debug("--actionButtonClick--")
 
         label = self.sender().objectName()
-        i = str(label[-1])
+        i = label.split("_")[-1]
         log.debug(f"Button: {label}, i: {i}")
         text = self.sender().text()
-        checkbox = self.findChild(QtWidgets.QCheckBox, f"checkBox_{i}")
-        if not checkbox:
-            log.warning("QCheckBox could not be found.")
 
         if text == "Mount":
-            log.info(f"Going to mount: {self.mountobjects.get(i).label}")
-            self.logstack.append("Going to mount: " f"{self.mountobjects.get(i).label}")
+            log.info(f"Going to mount: {self.mountitems[i]['label']}")
             self.statusmsg.append("mounting...")
-            if self.mountobjects[i].mount():
-                log.info("Mounted")
-                self.logstack.append("Mounted")
-                self.statusmsg.append("Mounted")
-                self.sender().setText("UnMount")
-                checkbox.setChecked(True)
-                # checkbox.toggle()
-            else:
-                log.error("Failed connecting to: " f"{self.mountobjects.get(i).label}")
-                self.logstack.append("Failed connecting to: " f"{self.mountobjects.get(i).label}")
-                self.statusmsg.append("Failed mounting")
+            self.callDaemon("mount", {"item": i})
         elif text == "UnMount":
-            log.info(f"Going to UnMount: {self.mountobjects.get(i).label}")
-            self.logstack.append("Going to UnMount: " f"{self.mountobjects.get(i).label}")
+            log.info(f"Going to UnMount: {self.mountitems[i]['label']}")
             self.statusmsg.append("UnMounting...")
-            if self.mountobjects[i].umount():
-                log.info("UnMounted")
-                self.statusmsg.append("UnMounted")
-                self.logstack.append("UnMounted")
-                self.sender().setText("Mount")
-                checkbox.setChecked(False)
-                # checkbox.toggle()
+            self.callDaemon("umount", {"item": i})
+        elif text == "Cancel":
+            log.info(f"Going to cancel: {self.mountitems[i]['label']}")
+            self.statusmsg.append("Cancelling...")
+            self.callDaemon("cancel", {"item": i})
+
+    def showMountItemMenu(self, i, pos):
+        """Show the context menu with the extra actions of a mount item."""
+        log.debug(f"--showMountItemMenu-- {i}")
+        lineEdit = self.findChild(QtWidgets.QLineEdit, f"lineEdit_{i}")
+        menu = QtWidgets.QMenu(self)
+        if self.mountitems[i]["type"] == "sync":
+            menu.addAction("Refresh now", lambda: self.callDaemon("refresh", {"item": i}))
+        else:
+            menu.addAction("Auto-tune sshfs options", lambda: self.actionAutotune(i))
+            fuse = menu.addMenu("FUSE connection")
+            fuse.addAction("Apply the section's settings", lambda: self.actionFuse(i, "apply"))
+            fuse.addAction("Revert", lambda: self.actionFuse(i, "revert"))
+            fuse.addAction("Benchmark before/after", lambda: self.actionFuse(i, "bench"))
+        menu.addAction("Copy out with parallel streams...", lambda: self.actionTransfer(i))
+        menu.addAction("Build search index", lambda: self.callDaemon("index", {"item": i}))
+        if self.mountitems[i].get("spool") is not None:
+            menu.addAction("Flush write-back spool now", lambda: self.actionFlush(i))
+        server = menu.addMenu("On the server")
+        server.addAction("Checksums...", lambda: self.actionOffload(i, "checksum"))
+        server.addAction("Disk usage...", lambda: self.actionOffload(i, "du"))
+        server.addAction("Delete...", lambda: self.actionOffload(i, "rm"))
+        server.addAction("Copy...", lambda: self.actionOffload(i, "cp"))
+        server.addAction("Move...", lambda: self.actionOffload(i, "mv"))
+        menu.exec_(lineEdit.mapToGlobal(pos))
+
+    def actionAutotune(self, i):
+        """Action on the context menu Auto-tune, the report is shown in the log window."""
+        log.debug(f"--actionAutotune-- {i}")
+        self.logstack.append(f"Auto-tuning {self.mountitems[i]['label']}, this takes a while...")
+        self.statusmsg.append("Auto-tuning...")
+        self.callDaemon("autotune", {"item": i})
+
+    def actionFuse(self, i, action):
+        """Action on the context menu FUSE connection, the outcome is shown in the log window."""
+        log.debug(f"--actionFuse-- {i} {action}")
+        if action == "bench":
+            self.logstack.append(
+                f"Benchmarking the FUSE settings of {self.mountitems[i]['label']}..."
+            )
+        self.callDaemon("fusetune", {"item": i, "action": action})
+
+    def actionTransfer(self, i):
+        """Action on the context menu Copy out, pick the folders and start the transfer."""
+        log.debug(f"--actionTransfer-- {i}")
+        state = self.mountitems[i]
+        source = QtWidgets.QFileDialog.getExistingDirectory(
+            self, "Folder to copy", state["destination"]
+        )
+        if not source:
+            return
+        target = QtWidgets.QFileDialog.getExistingDirectory(self, "Copy to")
+        if not target:
+            return
+        self.textBrowser_transfer.append(f"{state['label']}: {source} -> {target}")
+        self.label_transfer.setText(f"Listing {source}...")
+        self.progressBar_transfer.setValue(0)
+        self.tabWidget.setCurrentWidget(self.tab_4)
+        self.callDaemon("transfer", {"item": i, "sources": [source], "target": target})
+
+    def actionFlush(self, i):
+        """Action on the context menu Flush write-back spool, the row shows the progress."""
+        log.debug(f"--actionFlush-- {i}")
+        self.statusmsg.append(f"Flushing the spool of {self.mountitems[i]['label']}...")
+        self.callDaemon("flush", {"item": i})
+
+    def actionOffload(self, i, op):
+        """Action on the context menu On the server, the output is shown in the log window."""
+        log.debug(f"--actionOffload-- {i} {op}")
+        state = self.mountitems[i]
+        path = QtWidgets.QFileDialog.getExistingDirectory(
+            self, f"Folder for {op}", state["destination"]
+        )
+        if not path:
+            return
+        target = None
+        if op in ("cp", "mv"):
+            target = QtWidgets.QFileDialog.getExistingDirectory(
+                self, f"{op} to", state["destination"]
+            )
+            if not target:
+                return
+        if op == "rm":
+            answer = QtWidgets.QMessageBox.question(
+                self, "Delete on the server", f"Delete {path} with everything in it?"
+            )
+            if answer != QtWidgets.QMessageBox.Yes:
+                return
+        self.logstack.append(f"{state['label']}: {op} {path} on the server...")
+        self.callDaemon("offload", {"item": i, "op": op, "paths": [path], "target": target})
+
+    def updateTransfer(self, data):
+        """Show the progress of the running transfer."""
+        if data["total"]:
+            self.progressBar_transfer.setValue(int(100 * data["done"] / data["total"]))
+        self.label_transfer.setText(
+            f"{self.mountitems[data['item']]['label']}: "
+            f"{mod_capacity.human_size(data['done'])} of {mod_capacity.human_size(data['total'])}"
+            f", {mod_capacity.human_size(data['rate'])}/s"
+        )
+
+    def finishTransfer(self, data):
+        """Show the outcome of a transfer."""
+        if data["result"]:
+            text = mod_transfer.describe(data["data"])
+            self.progressBar_transfer.setValue(100)
+            self.statusmsg.append("Transfer done")
+        else:
+            text = f"failed, copy again to continue: {data['error']}"
+            self.statusmsg.append("Transfer failed")
+        self.label_transfer.setText("No transfer is running.")
+        self.textBrowser_transfer.append(f"{self.mountitems[data['item']]['label']}: {text}")
+
+    def actionSearch(self):
+        """Action on the Search button, search the indexes of all mount points."""
+        log.debug("--actionSearch--")
+        text = self.lineEdit_search.text().strip()
+        if not text:
+            return
+        found = self.callDaemon("search", {"text": text})
+        if found is None:
+            return
+        lines = [f"{len(found)} found, build the index from the context menu of a mount point."]
+        for entry in found:
+            if entry["kind"] == "d":
+                lines.append(f"{entry['local']}/")
+            else:
+                lines.append(f"{entry['local']}  {mod_capacity.human_size(entry['size'])}")
+        self.textBrowser_search.setPlainText("\n".join(lines))
+
+    def actionMountAll(self):
+        """Action on Menu>Mount all, the daemon probes all hosts at once."""
+        log.debug("--actionMountAll--")
+        self.statusmsg.append("Mounting all...")
+        threading.Thread(target=self.mountAll, daemon=True).start()
+
+    def mountAll(self, hostkeys=None):
+        """Mount all in a worker thread, unknown host keys are offered first."""
+        if hostkeys:
+            self.callDaemon("accept_hostkeys", {"hostkeys": hostkeys})
+        elif hostkeys is None and self.conf.get_ssh_warmup():
+            hostkeys = self.callDaemon("hostkeys", timeout=60.0)
+            if hostkeys:
+                self.events.put(("hostkeys", hostkeys))  # asked in the GUI thread
+                return
+        self.callDaemon("mount_all", timeout=None)  # the skipped ones come as log events
+
+    def acceptHostKeys(self, hostkeys):
+        """Ask to accept the unknown host keys, then mount all."""
+        lines = []
+        for entry in hostkeys:
+            if entry["lines"]:
+                lines.append(f"{entry['host']}:")
+                lines.extend(f"  {fingerprint}" for fingerprint in entry["fingerprints"])
             else:
-                log.error("Failed UnMounting from: " f"{self.mountobjects.get(i).label}")
-                self.logstack.append("Failed UnMounting from: " f"{self.mountobjects.get(i).label}")
-                self.statusmsg.append("Failed UnMounting")
+                self.logstack.append(f"{entry['host']}: no host key, {entry['error']}")
+        hostkeys = [entry for entry in hostkeys if entry["lines"]]
+        accepted = []
+        if hostkeys:
+            answer = QtWidgets.QMessageBox.question(
+                self,
+                "Unknown hosts",
+                "These hosts are not known yet, add their keys?\n\n" + "\n".join(lines),
+            )
+            if answer == QtWidgets.QMessageBox.Yes:
+                accepted = hostkeys
+        threading.Thread(target=self.mountAll, args=(accepted,), daemon=True).start()
+
+    def actionUmountAll(self):
+        """Action on Menu>UnMount all, the daemon reports the processes holding busy mounts."""
+        log.debug("--actionUmountAll--")
+        self.statusmsg.append("UnMounting all...")
+        self.callDaemon("umount_all")
+
+    def actionReconcile(self):
+        """Action on Menu>Clean up mount folder, the daemon reports what it did."""
+        log.debug("--actionReconcile--")
+        self.statusmsg.append("Cleaning up the mount folder...")
+        threading.Thread(
+            target=self.callDaemon, args=("reconcile",), kwargs={"timeout": None}, daemon=True
+        ).start()
+
+    def actionShowStalls(self):
+        """Action on Diagnostics>Show GUI stalls, the summary goes to the log window."""
+        log.debug("--actionShowStalls--")
+        if not self.watchdog:
+            self.logstack.append("The stall watchdog is off, set 'stall_threshold' to use it.")
+            return
+        self.logstack.extend(self.watchdog.summary())
+
+    def requestMemoryReport(self, signum, frame):
+        """Ask for a memory report on SIGUSR1, it is made by the event timer."""
+        self.memoryRequested = True
+
+    def actionMemoryReport(self):
+        """Action on Diagnostics>Memory report, the GUI's and the daemon's report."""
+        log.debug("--actionMemoryReport--")
+        widgets = Counter(type(widget).__name__ for widget in QtWidgets.QApplication.allWidgets())
+        extra = [f"Qt widgets: {sum(widgets.values())}"]
+        extra += [f"  {count} {name}" for name, count in widgets.most_common(10)]
+        self.logstack.append("GUI memory:")
+        self.logstack.extend(self.memory.report(extra=extra))
+        report = self.callDaemon("memory", timeout=60.0)
+        if report:
+            self.logstack.append("Daemon memory:")
+            self.logstack.extend(report)
 
     def actionQuit(self):
         """Action on Menu>Quit."""
         log.debug("--actionQuit--")
+        if self.conf.get_umount_on_quit():
+            report = self.callDaemon("umount_all", {"wait": True}, timeout=None)
+            log.info(f"UnMounted at quit: {report}")
         sys.exit(0)
 
     def actionShowAbout(self):
@@ -230,6 +604,7 @@ class MainWindow(QtWidgets.QMainWindow, mod_gui_design.Ui_MainWindow):
 
         txt = self.textEdit.toPlainText()
         self.conf.update_from_text(txt)
+        self.callDaemon("reload")
         mod_general.restart_program()
 
     def actionCancelConfig(self):
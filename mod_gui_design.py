@@ -87,6 +87,51 @@ class Ui_MainWindow(object):
         self.pushButton_cancel.setObjectName("pushButton_cancel")
         self.tabWidget.addTab(self.tab_2, "")
 
+        self.tab_3 = QtWidgets.QWidget()
+        self.tab_3.setObjectName("tab_3")
+
+        self.textBrowser_history = QtWidgets.QTextBrowser(self.tab_3)
+        self.textBrowser_history.setGeometry(QtCore.QRect(0, 0, 631, 401))
+        self.textBrowser_history.setObjectName("textBrowser_history")
+
+        self.pushButton_history = QtWidgets.QPushButton(self.tab_3)
+        self.pushButton_history.setGeometry(QtCore.QRect(500, 400, 113, 32))
+        self.pushButton_history.setObjectName("pushButton_history")
+        self.tabWidget.addTab(self.tab_3, "")
+
+        self.tab_4 = QtWidgets.QWidget()
+        self.tab_4.setObjectName("tab_4")
+
+        self.label_transfer = QtWidgets.QLabel(self.tab_4)
+        self.label_transfer.setGeometry(QtCore.QRect(10, 10, 611, 20))
+        self.label_transfer.setObjectName("label_transfer")
+
+        self.progressBar_transfer = QtWidgets.QProgressBar(self.tab_4)
+        self.progressBar_transfer.setGeometry(QtCore.QRect(10, 35, 611, 23))
+        self.progressBar_transfer.setValue(0)
+        self.progressBar_transfer.setObjectName("progressBar_transfer")
+
+        self.textBrowser_transfer = QtWidgets.QTextBrowser(self.tab_4)
+        self.textBrowser_transfer.setGeometry(QtCore.QRect(0, 65, 631, 336))
+        self.textBrowser_transfer.setObjectName("textBrowser_transfer")
+        self.tabWidget.addTab(self.tab_4, "")
+
+        self.tab_5 = QtWidgets.QWidget()
+        self.tab_5.setObjectName("tab_5")
+
+        self.lineEdit_search = QtWidgets.QLineEdit(self.tab_5)
+        self.lineEdit_search.setGeometry(QtCore.QRect(0, 5, 500, 24))
+        self.lineEdit_search.setObjectName("lineEdit_search")
+
+        self.pushButton_search = QtWidgets.QPushButton(self.tab_5)
+        self.pushButton_search.setGeometry(QtCore.QRect(510, 0, 113, 32))
+        self.pushButton_search.setObjectName("pushButton_search")
+
+        self.textBrowser_search = QtWidgets.QTextBrowser(self.tab_5)
+        self.textBrowser_search.setGeometry(QtCore.QRect(0, 35, 631, 366))
+        self.textBrowser_search.setObjectName("textBrowser_search")
+        self.tabWidget.addTab(self.tab_5, "")
+
         MainWindow.setCentralWidget(self.centralwidget)
 
         self.menubar = QtWidgets.QMenuBar(MainWindow)
@@ -94,6 +139,8 @@ class Ui_MainWindow(object):
         self.menubar.setObjectName("menubar")
         self.menufile = QtWidgets.QMenu(self.menubar)
         self.menufile.setObjectName("menufile")
+        self.menudiagnostics = QtWidgets.QMenu(self.menubar)
+        self.menudiagnostics.setObjectName("menudiagnostics")
         self.menuabout = QtWidgets.QMenu(self.menubar)
         self.menuabout.setObjectName("menuabout")
         MainWindow.setMenuBar(self.menubar)
@@ -104,11 +151,27 @@ class Ui_MainWindow(object):
 
         self.actionquit = QtWidgets.QAction(MainWindow)
         self.actionquit.setObjectName("actionquit")
+        self.actionmount_all = QtWidgets.QAction(MainWindow)
+        self.actionmount_all.setObjectName("actionmount_all")
+        self.actionumount_all = QtWidgets.QAction(MainWindow)
+        self.actionumount_all.setObjectName("actionumount_all")
+        self.actionreconcile = QtWidgets.QAction(MainWindow)
+        self.actionreconcile.setObjectName("actionreconcile")
+        self.actionshow_stalls = QtWidgets.QAction(MainWindow)
+        self.actionshow_stalls.setObjectName("actionshow_stalls")
+        self.actionmemory_report = QtWidgets.QAction(MainWindow)
+        self.actionmemory_report.setObjectName("actionmemory_report")
         self.actionshow_about = QtWidgets.QAction(MainWindow)
         self.actionshow_about.setObjectName("actionshow_about")
+        self.menufile.addAction(self.actionmount_all)
+        self.menufile.addAction(self.actionumount_all)
+        self.menufile.addAction(self.actionreconcile)
         self.menufile.addAction(self.actionquit)
+        self.menudiagnostics.addAction(self.actionshow_stalls)
+        self.menudiagnostics.addAction(self.actionmemory_report)
         self.menuabout.addAction(self.actionshow_about)
         self.menubar.addAction(self.menufile.menuAction())
+        self.menubar.addAction(self.menudiagnostics.menuAction())
         self.menubar.addAction(self.menuabout.menuAction())
 
         self.retranslateUi(MainWindow)
@@ -133,9 +196,28 @@ class Ui_MainWindow(object):
         self.pushButton_save.setText(_translate("MainWindow", "Save"))
         self.pushButton_cancel.setText(_translate("MainWindow", "Cancel"))
         self.tabWidget.setTabText(self.tabWidget.indexOf(self.tab_2), _translate("MainWindow", "Config"))
+        self.pushButton_history.setText(_translate("MainWindow", "Refresh"))
+        self.tabWidget.setTabText(
+            self.tabWidget.indexOf(self.tab_3), _translate("MainWindow", "History")
+        )
+        self.label_transfer.setText(_translate("MainWindow", "No transfer is running."))
+        self.tabWidget.setTabText(
+            self.tabWidget.indexOf(self.tab_4), _translate("MainWindow", "Transfers")
+        )
+        self.lineEdit_search.setPlaceholderText(_translate("MainWindow", "Part of a file name"))
+        self.pushButton_search.setText(_translate("MainWindow", "Search"))
+        self.tabWidget.setTabText(
+            self.tabWidget.indexOf(self.tab_5), _translate("MainWindow", "Search")
+        )
         self.menufile.setTitle(_translate("MainWindow", "File"))
+        self.menudiagnostics.setTitle(_translate("MainWindow", "Diagnostics"))
         self.menuabout.setTitle(_translate("MainWindow", "About"))
         self.actionquit.setText(_translate("MainWindow", "Quit"))
+        self.actionmount_all.setText(_translate("MainWindow", "Mount all"))
+        self.actionumount_all.setText(_translate("MainWindow", "UnMount all"))
+        self.actionreconcile.setText(_translate("MainWindow", "Clean up mount folder"))
+        self.actionshow_stalls.setText(_translate("MainWindow", "Show GUI stalls"))
+        self.actionmemory_report.setText(_translate("MainWindow", "Memory report"))
         self.actionshow_about.setText(_translate("MainWindow", "Show about"))
 
     def makeMountItem(self, n):
@@ -147,6 +229,10 @@ class Ui_MainWindow(object):
         self.lineEdit_1 = QtWidgets.QLineEdit(self.verticalLayoutWidget)
         self.lineEdit_1.setObjectName(f"lineEdit_{n}")
         self.lineEdit_1.setReadOnly(True)
+        self.lineEdit_1.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+        self.lineEdit_1.customContextMenuRequested.connect(
+            lambda pos, n=n: self.showMountItemMenu(n, pos)
+        )
         self.horizontalLayout_set_1.addWidget(self.lineEdit_1)
         self.pushButton_1 = QtWidgets.QPushButton(self.verticalLayoutWidget)
         self.pushButton_1.setObjectName(f"pushButton_{n}")
@@ -158,4 +244,15 @@ class Ui_MainWindow(object):
         self.checkBox_1.setObjectName(f"checkBox_{n}")
         self.checkBox_1.setEnabled(False)
         self.horizontalLayout_set_1.addWidget(self.checkBox_1)
+        self.label_capacity_1 = QtWidgets.QLabel(self.verticalLayoutWidget)
+        self.label_capacity_1.setObjectName(f"label_capacity_{n}")
+        self.label_capacity_1.setMinimumWidth(80)
+        self.horizontalLayout_set_1.addWidget(self.label_capacity_1)
+        self.label_processes_1 = QtWidgets.QLabel(self.verticalLayoutWidget)
+        self.label_processes_1.setObjectName(f"label_processes_{n}")
+        self.label_processes_1.setMinimumWidth(80)
+        self.horizontalLayout_set_1.addWidget(self.label_processes_1)
+        self.label_spool_1 = QtWidgets.QLabel(self.verticalLayoutWidget)
+        self.label_spool_1.setObjectName(f"label_spool_{n}")
+        self.horizontalLayout_set_1.addWidget(self.label_spool_1)
         self.verticalLayout_mountpoints.addLayout(self.horizontalLayout_set_1)
@@ -0,0 +1,252 @@
+"""This module records the mount events in an append-only SQLite store and answers queries."""
+
+import math
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Tuple
+
+
+log = logging.getLogger(__name__)
+
+KINDS = ("mount", "umount", "check", "failure", "reconnect")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    ts REAL NOT NULL,
+    item TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    duration REAL,
+    server TEXT NOT NULL DEFAULT '',
+    detail TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS events_item_kind_ts ON events (item, kind, ts);
+CREATE INDEX IF NOT EXISTS events_kind_ts ON events (kind, ts);
+CREATE TABLE IF NOT EXISTS hourly (
+    hour INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    ok INTEGER NOT NULL,
+    duration_sum REAL NOT NULL,
+    duration_max REAL NOT NULL,
+    PRIMARY KEY (item, kind, hour)
+);
+"""
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of the sorted values, None when empty."""
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+    return values[rank]
+
+
+class HistoryStore:
+    """This class keeps the structured history of the mount points.
+
+    Every event is one row in 'events'. Rows older than 'raw_days' are rolled up into
+    'hourly' (count, successes and durations per mount point, kind and hour) and removed;
+    roll-ups older than 'retention_days' are dropped. The file is in WAL mode, so the
+    queries never wait for a writer.
+    """
+
+    def __init__(self, file, retention_days=365.0, raw_days=30.0) -> None:
+        """Initialize the class."""
+        self.file = file
+        self.retention_days = retention_days
+        self.raw_days = raw_days
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(file, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.compacted = 0.0
+
+    def record(self, item, kind, ok=True, duration=None, server="", detail="") -> None:
+        """Append an event, a failing store only logs."""
+        try:
+            with self.lock:
+                self.db.execute(
+                    "INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (time.time(), str(item), kind, int(bool(ok)), duration, server, detail),
+                )
+        except sqlite3.Error as err:
+            log.warning(f"Could not record the {kind} event of [{item}]: {err}")
+
+    def compact(self) -> None:
+        """Roll up the old events per hour and drop what is past the retention."""
+        now = time.time()
+        raw_until = now - self.raw_days * 86400
+        keep_until = int((now - self.retention_days * 86400) // 3600)
+        try:
+            with self.lock:
+                self.db.execute("BEGIN")
+                self.db.execute(
+                    """INSERT INTO hourly
+                       SELECT CAST(ts / 3600 AS INTEGER) AS h, item, kind, COUNT(*), SUM(ok),
+                              COALESCE(SUM(duration), 0), COALESCE(MAX(duration), 0)
+                       FROM events WHERE ts < ? GROUP BY h, item, kind
+                       ON CONFLICT (item, kind, hour) DO UPDATE SET
+                           count = count + excluded.count,
+                           ok = ok + excluded.ok,
+                           duration_sum = duration_sum + excluded.duration_sum,
+                           duration_max = MAX(duration_max, excluded.duration_max)""",
+                    (raw_until,),
+                )
+                self.db.execute("DELETE FROM events WHERE ts < ?", (raw_until,))
+                self.db.execute("DELETE FROM hourly WHERE hour < ?", (keep_until,))
+                self.db.execute("COMMIT")
+                self.db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            self.compacted = now
+        except sqlite3.Error as err:
+            log.warning(f"Could not compact the history: {err}")
+            with self.lock:
+                if self.db.in_transaction:
+                    self.db.execute("ROLLBACK")
+
+    def maybe_compact(self, interval=3600.0) -> None:
+        """Compact at most once per interval."""
+        if time.time() - self.compacted >= interval:
+            self.compact()
+
+    def query(self, sql, params) -> List:
+        """Run a read query."""
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def summary(self, item, days=30.0) -> Dict:
+        """Return the uptime, mount latency percentiles and counts of a mount point.
+
+        The uptime leaves out the time the mount point was unmounted on purpose, as far as
+        the raw events go, the hourly roll-ups count all their checks.
+        """
+        since = time.time() - days * 86400
+        item = str(item)
+        checks, up = 0, 0
+        counts = {kind: [0, 0] for kind in KINDS}  # kind: [events, failed]
+        rows = self.query(
+            "SELECT kind, COUNT(*), SUM(ok) FROM events WHERE item = ? AND ts >= ? GROUP BY kind",
+            (item, since),
+        )
+        hourly = self.query(
+            "SELECT kind, SUM(count), SUM(ok) FROM hourly WHERE item = ? AND hour >= ? "
+            "GROUP BY kind",
+            (item, int(since // 3600)),
+        )
+        rows += hourly
+        for kind, count, ok in rows:
+            if kind not in counts:
+                continue
+            counts[kind][0] += count
+            counts[kind][1] += count - (ok or 0)
+        for kind, count, ok in hourly:
+            if kind == "check":
+                checks += count
+                up += ok or 0
+        raw_checks, raw_up = self.wanted_checks(item, since)
+        checks += raw_checks
+        up += raw_up
+
+        # the percentiles use the raw events, the roll-ups only keep the mean and max
+        durations = [
+            row[0]
+            for row in self.query(
+                "SELECT duration FROM events WHERE item = ? AND kind = 'mount' AND ts >= ? "
+                "AND ok = 1 AND duration IS NOT NULL ORDER BY duration",
+                (item, since),
+            )
+        ]
+        return {
+            "item": item,
+            "days": days,
+            "uptime": up / checks if checks else None,
+            "mount_p50": percentile(durations, 0.50),
+            "mount_p90": percentile(durations, 0.90),
+            "mount_p99": percentile(durations, 0.99),
+            "mounts": counts["mount"][0],
+            "mount_failures": counts["mount"][1],
+            "umounts": counts["umount"][0],
+            "failures": counts["failure"][0],
+            "reconnects": counts["reconnect"][0],
+        }
+
+    def wanted_checks(self, item, since) -> Tuple[int, int]:
+        """Return the checks and the successful ones while the mount point should be mounted.
+
+        After a successful unmount until the next successful mount the mount point is down
+        on purpose, the checks that find it unmounted don't count against the uptime.
+        """
+        last = self.query(
+            "SELECT kind FROM events WHERE item = ? AND ts < ? AND ok = 1 "
+            "AND kind IN ('mount', 'umount') ORDER BY ts DESC LIMIT 1",
+            (item, since),
+        )
+        wanted = not last or last[0][0] == "mount"
+        checks, up = 0, 0
+        for kind, ok in self.query(
+            "SELECT kind, ok FROM events WHERE item = ? AND ts >= ? "
+            "AND kind IN ('check', 'mount', 'umount') ORDER BY ts",
+            (item, since),
+        ):
+            if kind == "check":
+                if ok or wanted:
+                    checks += 1
+                    up += ok
+            elif ok:
+                wanted = kind == "mount"
+        return checks, up
+
+    def timeline(self, item=None, days=30.0, limit=100) -> List[Dict]:
+        """Return the newest failures, failed operations and reconnects, newest first."""
+        since = time.time() - days * 86400
+        sql = (
+            "SELECT ts, item, kind, ok, server, detail FROM events WHERE ts >= ? AND "
+            "(kind IN ('failure', 'reconnect') OR (kind IN ('mount', 'umount') AND ok = 0))"
+        )
+        params = (since,)
+        if item is not None:
+            sql += " AND item = ?"
+            params += (str(item),)
+        rows = self.query(sql + " ORDER BY ts DESC LIMIT ?", params + (limit,))
+        keys = ("time", "item", "kind", "ok", "server", "detail")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def close(self) -> None:
+        """Close the store."""
+        with self.lock:
+            self.db.close()
+
+
+def format_report(report, labels) -> List[str]:
+    """Return the lines that show a history report, 'labels' maps the items to their label."""
+
+    def seconds(value):
+        return "-" if value is None else f"{value:.1f}s"
+
+    lines = []
+    for summary in report["summary"]:
+        uptime = "-" if summary["uptime"] is None else f"{summary['uptime'] * 100:.2f}%"
+        lines.append(f"[{summary['item']}] {labels.get(summary['item'], '')}")
+        lines.append(
+            f"  uptime {uptime}, mount time p50 {seconds(summary['mount_p50'])} "
+            f"p90 {seconds(summary['mount_p90'])} p99 {seconds(summary['mount_p99'])}"
+        )
+        lines.append(
+            f"  {summary['mounts']} mounts ({summary['mount_failures']} failed), "
+            f"{summary['umounts']} unmounts, {summary['failures']} failures, "
+            f"{summary['reconnects']} reconnects"
+        )
+    lines.append("")
+    lines.append("Failures:" if report["timeline"] else "No failures.")
+    for event in report["timeline"]:
+        when = time.strftime("%d/%m/%Y %H:%M:%S", time.localtime(event["time"]))
+        what = event["kind"]
+        if what in ("mount", "umount"):
+            what += " failed"
+        detail = f": {event['detail']}" if event["detail"] else ""
+        lines.append(f"  {when} [{event['item']}] {what} on {event['server']}{detail}")
+    return lines
@@ -0,0 +1,317 @@
+"""This module keeps a local index of the remote file tree of a mount point, for searching.
+
+The index file is memory-mapped for searching. It holds a header, the fixed size columns
+and the paths, one per line:
+    header  magic, number of entries, build time (remote clock), size of the paths
+    offset  the start of each path in the paths, 8 byte unsigned
+    size    8 byte unsigned
+    mtime   8 byte float
+    kind    1 byte, 'f' file, 'd' folder, 'l' link or '?'
+    paths   the paths relative to the location, '\n' separated
+    folded  the paths in ASCII lower case, at the same offsets, for the search
+The numbers are in the native byte order, the index is a local cache.
+"""
+
+import os
+import mmap
+import time
+import shlex
+import bisect
+import struct
+import logging
+import subprocess
+from typing import Dict, List
+
+import mod_process
+import mod_ssh
+
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"AMIDX\x01\n\x00"
+HEADER = struct.Struct("=8sQdQ")
+FIELDS = "\t".join(["%T@", "%s", "%y", "%P"]) + "\\0"  # the find -printf format
+
+
+def index_file(mountpoint) -> str:
+    """Return the index file of a mount point."""
+    return os.path.join(mountpoint.conf.get_state_folder(), "index", f"{mountpoint.item}.idx")
+
+
+def write_index(file, entries, built) -> None:
+    """Write the entries {path: (size, mtime, kind)} to the index file, atomically."""
+    paths = sorted(entries)
+    count = len(paths)
+    offsets, position = [], 0
+    for path in paths:
+        offsets.append(position)
+        position += len(path.encode(errors="surrogateescape")) + 1
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    tmp = f"{file}.tmp"
+    with open(tmp, "wb") as out:
+        out.write(HEADER.pack(MAGIC, count, built, position))
+        out.write(struct.pack(f"={count}Q", *offsets))
+        out.write(struct.pack(f"={count}Q", *(entries[p][0] for p in paths)))
+        out.write(struct.pack(f"={count}d", *(entries[p][1] for p in paths)))
+        out.write(bytes(ord(entries[p][2][:1] or "?") for p in paths))
+        blob = b"".join(p.encode(errors="surrogateescape") + b"\n" for p in paths)
+        out.write(blob)
+        out.write(blob.lower())
+    os.replace(tmp, file)
+
+
+class IndexFile:
+    """This class searches a memory-mapped index file, without reading it into memory."""
+
+    def __init__(self, file) -> None:
+        """Map the index file."""
+        with open(file, "rb") as index:
+            self.map = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            self.map.close()
+            raise BadIndexError(f"{file} is truncated")
+        magic, self.count, self.built, size = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.map.close()
+            raise BadIndexError(file)
+        if len(self.map) != HEADER.size + 25 * self.count + 2 * size:  # a partly written one
+            self.map.close()
+            raise BadIndexError(f"{file} is truncated")
+        start = HEADER.size
+        view = memoryview(self.map)
+        self.offsets = view[start : start + 8 * self.count].cast("Q")
+        start += 8 * self.count
+        self.sizes = view[start : start + 8 * self.count].cast("Q")
+        start += 8 * self.count
+        self.mtimes = view[start : start + 8 * self.count].cast("d")
+        start += 8 * self.count
+        self.kinds = view[start : start + self.count]
+        self.paths_start = start + self.count
+        self.paths_end = self.paths_start + size
+        self.folded = self.paths_end  # the start of the folded paths
+
+    def entry(self, n) -> Dict:
+        """Return an entry by its number."""
+        start = self.paths_start + self.offsets[n]
+        end = self.map.find(b"\n", start, self.paths_end)
+        return {
+            "path": self.map[start:end].decode(errors="surrogateescape"),
+            "size": self.sizes[n],
+            "mtime": self.mtimes[n],
+            "kind": chr(self.kinds[n]),
+        }
+
+    def entries(self) -> Dict:
+        """Return all entries as {path: (size, mtime, kind)}."""
+        paths = self.map[self.paths_start : self.paths_end].decode(errors="surrogateescape")
+        return {
+            path: (self.sizes[n], self.mtimes[n], chr(self.kinds[n]))
+            for n, path in enumerate(paths.split("\n")[: self.count])
+        }
+
+    def search(self, text, limit=200) -> List[Dict]:
+        """Return the entries whose path contains the text, case insensitive for ASCII."""
+        needle = text.encode(errors="surrogateescape").lower()
+        found, last = [], -1
+        end = self.folded + self.paths_end - self.paths_start
+        position = self.map.find(needle, self.folded, end) if needle else -1
+        while position >= 0 and len(found) < limit:
+            n = bisect.bisect_right(self.offsets, position - self.folded) - 1
+            if n != last:  # one entry per path
+                found.append(self.entry(n))
+                last = n
+            position = self.map.find(needle, position + 1, end)
+        return found
+
+    def close(self) -> None:
+        """Unmap the index file."""
+        for view in (self.offsets, self.sizes, self.mtimes, self.kinds):
+            view.release()
+        self.map.close()
+
+
+class IndexBuilder:
+    """This class builds the index of a mount point's location with remote finds over ssh.
+
+    The first build lists the whole tree with one find. A refresh only lists what changed
+    since the last build: the files newer than it and the folders whose content changed
+    (their mtime moved), whose children replace the ones in the index. Folders that are
+    new to the index, like a moved in tree, are listed completely.
+    """
+
+    def __init__(self, mountpoint) -> None:
+        """Initialize the class."""
+        self.mountpoint = mountpoint
+        self.runner = mountpoint.runner
+        self.file = index_file(mountpoint)
+        self.location = mountpoint.location.rstrip("/") or "/"
+
+    def remote(self, script) -> str:
+        """Run a shell script in the location on the server, return its output."""
+        cmd = mod_ssh.ssh_command(
+            self.mountpoint, f"cd {shlex.quote(self.location)} && {{ {script}; }}"
+        )
+        output = self.runner.run(cmd, timeout=self.mountpoint.conf.get_index_timeout()).stdout
+        return output.decode(errors="surrogateescape")
+
+    @staticmethod
+    def parse(records) -> Dict:
+        """Parse the find records into {path: (size, mtime, kind)}."""
+        entries = {}
+        for record in records:
+            fields = record.split("\t", 3)
+            if len(fields) != 4 or "\n" in fields[3]:
+                continue
+            mtime, size, kind, path = fields
+            path = path[2:] if path.startswith("./") else path
+            if path and path != ".":
+                entries[path] = (int(size), float(mtime), kind)
+        return entries
+
+    def build(self, full=False) -> Dict:
+        """Build or refresh the index, return the report."""
+        started = time.monotonic()
+        entries, built = {}, 0.0
+        if not full and os.path.exists(self.file):
+            try:
+                index = IndexFile(self.file)
+                entries, built = index.entries(), index.built
+                index.close()
+            except (OSError, ValueError, ModIndexExceptions) as err:
+                log.warning(f"Rebuilding the unreadable index {self.file}: {err}")
+                entries = {}
+
+        if not entries:
+            built = 0.0
+            output = self.remote(f"date +%s; find . -mindepth 1 -printf '{FIELDS}'")
+            clock, _, listing = output.partition("\n")
+            entries = self.parse(listing.split("\0"))
+            changed = len(entries)
+        else:
+            clock, changed = self.refresh(entries, built)
+        write_index(self.file, entries, float(clock))
+
+        report = {
+            "entries": len(entries),
+            "changed": changed,
+            "full": not built,
+            "seconds": time.monotonic() - started,
+        }
+        log.info(f"Index of {self.mountpoint.source_full_patch}: {report}")
+        return report
+
+    def refresh(self, entries, built):
+        """Apply the changes since the build time to the entries.
+
+        Return the remote clock and the number of changed entries.
+        """
+        since = int(built) - 1  # one second overlap for the mtime resolution
+        newer = f"-newermt @{since}"
+        script = (
+            f"date +%s; "
+            f"find . -mindepth 1 -type f {newer} -printf 'F\t{FIELDS}'; "
+            f"find . -type d {newer} -printf 'D\t%p\\0'; "
+            f"find . -type d {newer} -print0 | xargs -0 -r -I{{}} "
+            f"find {{}} -mindepth 1 -maxdepth 1 -printf 'C\t%h\t{FIELDS}'"
+        )
+        clock, _, output = self.remote(script).partition("\n")
+
+        def relative(path):
+            return path[2:] if path.startswith("./") else ("" if path == "." else path)
+
+        files, listed = [], {}  # listed, folder: its children as they are now
+        for record in output.split("\0"):
+            kind, _, rest = record.partition("\t")
+            if kind == "F":
+                files.append(rest)
+            elif kind == "D":
+                listed.setdefault(relative(rest), [])
+            elif kind == "C":
+                folder, _, fields = rest.partition("\t")
+                listed.setdefault(relative(folder), []).append(fields)
+
+        changed = self.parse(files)
+        for folder, records in listed.items():
+            for path, entry in self.parse(records).items():
+                changed[os.path.join(folder, path) if folder else path] = entry
+
+        # the children of a changed folder that are not listed anymore are gone
+        gone = {
+            path
+            for path in entries
+            if os.path.dirname(path) in listed and path not in changed
+        }
+        if gone:
+            for path in list(entries):
+                parent = path
+                while parent:
+                    if parent in gone:
+                        del entries[path]
+                        break
+                    parent = os.path.dirname(parent)
+
+        new_folders = [p for p, e in changed.items() if e[2] == "d" and p not in entries]
+        entries.update(changed)
+        if new_folders:  # like a moved in tree, its content has old mtimes
+            roots = " ".join(shlex.quote(f"./{p}") for p in new_folders)
+            fields = FIELDS.replace("%P", "%p")
+            output = self.remote(f"find {roots} -mindepth 1 -printf '{fields}'")
+            found = self.parse(output.split("\0"))
+            entries.update(found)
+            changed.update(found)
+        return clock, len(changed) + len(gone)
+
+
+def build(mountpoint, full=False):
+    """Build the index of a mount point, return the report or False with its last_error."""
+    mountpoint.runner.reset()
+    try:
+        return IndexBuilder(mountpoint).build(full)
+    except (mod_process.CommandTimeoutError, mod_process.OperationCancelledError) as err:
+        mountpoint.last_error = err.message
+    except subprocess.CalledProcessError as err:
+        mountpoint.last_error = f"the remote find failed: {mod_ssh.gnu_reason(err, 'find')}"
+    except (OSError, ValueError) as err:
+        mountpoint.last_error = f"Could not build the index: {err}"
+    log.error(mountpoint.last_error)
+    return False
+
+
+def search(mountpoints, text, limit=200) -> List[Dict]:
+    """Search the indexes of the mount points, return the entries with their item."""
+    found = []
+    for i, mountpoint in mountpoints.items():
+        file = index_file(mountpoint)
+        if not os.path.exists(file):
+            continue
+        try:
+            index = IndexFile(file)
+        except (OSError, ValueError, ModIndexExceptions) as err:
+            log.warning(f"Skipping the index of [{i}]: {err}")
+            continue
+        try:
+            for entry in index.search(text, limit - len(found)):
+                entry["item"] = i
+                entry["local"] = os.path.join(mountpoint.destination_full_path, entry["path"])
+                found.append(entry)
+        finally:
+            index.close()
+        if len(found) >= limit:
+            break
+    return found
+
+
+class ModIndexExceptions(Exception):
+    """The parent exception class for this module."""
+
+    pass
+
+
+class BadIndexError(ModIndexExceptions):
+    """Exception raised for a file that is not an index."""
+
+    def __init__(self, message):
+        """Initialize the class."""
+        msg = f"Not an index file: {message}"
+        self.message = msg
+        super().__init__(self.message)
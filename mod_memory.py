@@ -0,0 +1,75 @@
+"""This module reports the memory use and its growth, for long running sessions."""
+
+import os
+import sys
+import logging
+import resource
+import tracemalloc
+from typing import List
+
+import mod_watchdog
+
+
+log = logging.getLogger(__name__)
+
+
+def rss_bytes() -> int:
+    """Return the resident memory of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # no /proc (macOS): the peak is the best there is, in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryDiagnostics:
+    """This class diffs tracemalloc snapshots against a baseline.
+
+    Tracing costs memory and time, so it only starts with the first report, which takes the
+    baseline. The next reports show the places that grew since then.
+    """
+
+    def __init__(self, file=None, frames=10) -> None:
+        """Initialize the class."""
+        self.frames = frames
+        self.logger = mod_watchdog.diagnostics_logger(file) if file else log
+        self.baseline = None
+
+    def take(self) -> tracemalloc.Snapshot:
+        """Take a snapshot without the allocations of the tracing itself."""
+        return tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ]
+        )
+
+    def rebaseline(self) -> None:
+        """Take a new baseline, starting the tracing when needed."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.baseline = self.take()
+
+    def report(self, top=15, extra=()) -> List[str]:
+        """Return the report lines, and write them to the diagnostics log."""
+        lines = [f"RSS: {rss_bytes() / 1048576:.1f} MB"]
+        if self.baseline is None or not tracemalloc.is_tracing():
+            self.rebaseline()
+            lines.append("Memory tracing started, ask again later to see the growth.")
+        else:
+            current, peak = tracemalloc.get_traced_memory()
+            lines.append(f"Traced: {current / 1048576:.1f} MB, peak {peak / 1048576:.1f} MB")
+            stats = self.take().compare_to(self.baseline, "lineno")
+            growth = [stat for stat in stats if stat.size_diff > 0][:top]
+            lines.append(f"Top {len(growth)} growth since the baseline:")
+            for stat in growth:
+                frame = stat.traceback[0]
+                lines.append(
+                    f"  {stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} blocks) "
+                    f"{frame.filename.rsplit('/', 1)[-1]}:{frame.lineno}"
+                )
+        lines.extend(extra)
+        self.logger.info("Memory report\n" + "\n".join(lines))
+        return lines
@@ -0,0 +1,72 @@
+"""This module keeps the daemon's metrics, the gauges and counters with their labels."""
+
+import threading
+from typing import Dict, List
+
+
+class Registry:
+    """This class holds the metric values, one per name and label set."""
+
+    def __init__(self) -> None:
+        """Initialize the class."""
+        self.lock = threading.Lock()
+        self.meta = {}  # name: (kind, help)
+        self.values = {}  # name: {labels tuple: value}
+
+    def describe(self, name, kind, text) -> None:
+        """Declare a 'gauge' or 'counter' metric with its help text."""
+        with self.lock:
+            self.meta[name] = (kind, text)
+            self.values.setdefault(name, {})
+
+    def set(self, name, value, **labels) -> None:
+        """Set a gauge."""
+        with self.lock:
+            self.values.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    def inc(self, name, amount=1, **labels) -> None:
+        """Increase a counter."""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def remove(self, name, **labels) -> None:
+        """Drop the series of a gauge, like for a mount point that is gone."""
+        with self.lock:
+            self.values.get(name, {}).pop(tuple(sorted(labels.items())), None)
+
+    def snapshot(self) -> List[Dict]:
+        """Return all the metrics, as they are sent to the clients."""
+        with self.lock:
+            return [
+                {
+                    "name": name,
+                    "kind": self.meta.get(name, ("gauge", ""))[0],
+                    "help": self.meta.get(name, ("gauge", ""))[1],
+                    "samples": [
+                        {"labels": dict(key), "value": value} for key, value in series.items()
+                    ],
+                }
+                for name, series in sorted(self.values.items())
+            ]
+
+
+def format_value(value) -> str:
+    """Return a sample value with all its digits, the integers without a fraction."""
+    if isinstance(value, int):
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_text(snapshot) -> List[str]:
+    """Return the lines of a snapshot in the Prometheus text format."""
+    lines = []
+    for metric in snapshot:
+        lines.append(f"# HELP {metric['name']} {metric['help']}")
+        lines.append(f"# TYPE {metric['name']} {metric['kind']}")
+        for sample in metric["samples"]:
+            labels = ",".join(f'{key}="{value}"' for key, value in sample["labels"].items())
+            name = f"{metric['name']}{{{labels}}}" if labels else metric["name"]
+            lines.append(f"{name} {format_value(sample['value'])}")
+    return lines
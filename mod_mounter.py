@@ -1,8 +1,18 @@
 import os
+import sys
+import time
 import logging
 import subprocess
 
+import mod_busy
+import mod_fuse
+import mod_index
+import mod_offload
 import mod_general
+import mod_process
+import mod_ssh
+import mod_tuning
+import mod_transfer
 
 
 log = logging.getLogger(__name__)
@@ -17,13 +27,25 @@ class MountLocation:
         self.config = self.conf.config
         log.debug(f"item: {self.config.options(item)}")
         tests = ["label", "user", "server", "location", "type", "port"]
-        if self.config.options(item) != tests:
-            raise IncompleteMountPointError(item.keys())
+        missing = [test for test in tests if test not in self.config.options(item)]
+        if missing:
+            raise IncompleteMountPointError(f"[{item}] misses {', '.join(missing)}")
 
         # remote
+        self.item = item  # config section
         self.label = self.config[item]["label"]  # label
         self.user = self.config[item]["user"]  # remote user
-        self.server = self.config[item]["server"]  # remote server
+        # one or more replica servers, in order of preference
+        self.servers = [s.strip() for s in self.config[item]["server"].split(",") if s.strip()]
+        self.weights = self.get_weights(item)
+        # the folder, relative to the location, used by the sshfs auto-tune
+        self.tune_path = self.config[item].get("tune_path", fallback="")
+        # the limits of the sshfs processes, 0 is no limit
+        self.max_rss_mb, self.cpu_weight = self.get_limits(item)
+        # writes go to the local spool '<destination>.spool' and are flushed in the background
+        self.writeback = self.config[item].getboolean("writeback", fallback=False)
+        # the kernel FUSE connection settings, applied after the mount
+        self.fuse_settings = self.get_fuse_settings(item)
         self.location = self.config[item]["location"]  # remote location
         self.type = self.config[item]["type"]  # type
         self.port = self.config[item]["port"]  # remote port
@@ -35,6 +57,66 @@ class MountLocation:
         # protocol type check
         self.check_protocol()
 
+        # the active replica, the first one until a mount chooses
+        self.set_server(self.servers[0])
+
+        # Setup the destination location, based on the first replica so it stays the same
+        # Format for local destination location: user_server_remote-location
+        path = f'{self.user}_{self.servers[0]}_{self.location.replace("/", "_")}'
+        self.path = path.replace("__", "_")
+        self.destination_full_path = os.path.join(self.mountfolder, self.path)
+
+        # the reason of the last failed action, for the user
+        self.last_error = ""
+
+        # every external command runs under a deadline and can be cancelled
+        self.runner = mod_process.ProcessRunner(self.conf.get_command_timeout())
+        self.mount_timeout = self.conf.get_mount_timeout()
+        self.umount_timeout = self.conf.get_umount_timeout()
+        self.lazy_umount = self.conf.get_lazy_umount()
+
+    def get_weights(self, item):
+        """Return the replica weights from the optional 'weights' key, default 1 each."""
+        weights = [1.0] * len(self.servers)
+        if "weights" in self.config[item]:
+            try:
+                values = [float(w) for w in self.config[item]["weights"].split(",")]
+            except ValueError as err:
+                raise IncompleteMountPointError(f"[{item}] weights are not numbers") from err
+            if len(values) != len(self.servers) or min(values) <= 0:
+                raise IncompleteMountPointError(f"[{item}] needs one positive weight per server")
+            weights = values
+        return weights
+
+    def get_limits(self, item):
+        """Return the optional 'max_rss_mb' and 'cpu_weight' (1 to 10000) keys, 0 when unset."""
+        try:
+            max_rss_mb = self.config[item].getint("max_rss_mb", fallback=0)
+            cpu_weight = self.config[item].getint("cpu_weight", fallback=0)
+        except ValueError as err:
+            raise IncompleteMountPointError(f"[{item}] limits are not numbers") from err
+        if max_rss_mb < 0 or not 0 <= cpu_weight <= 10000:
+            raise IncompleteMountPointError(f"[{item}] limits are out of range")
+        return max_rss_mb, cpu_weight
+
+    def get_fuse_settings(self, item):
+        """Return the optional 'fuse_max_background' and 'fuse_congestion_threshold' keys."""
+        settings = {}
+        for name in mod_fuse.SETTINGS:
+            try:
+                value = self.config[item].getint(f"fuse_{name}", fallback=None)
+            except ValueError as err:
+                raise IncompleteMountPointError(f"[{item}] fuse_{name} is not a number") from err
+            if value is not None:
+                if not 1 <= value <= 65535:
+                    raise IncompleteMountPointError(f"[{item}] fuse_{name} is out of range")
+                settings[name] = value
+        return settings
+
+    def set_server(self, server):
+        """Make the replica the active server."""
+        self.server = server  # remote server
+
         # Determine what the source location will be
         # Format for the source location: server:location
         self.sourcelocation = f"{self.server}:{self.location}"
@@ -43,13 +125,252 @@ class MountLocation:
         # Format for remote source location: user@server:/location/directory
         self.source_full_patch = f"{self.user}@{self.server}:{self.location}"
 
-        # Setup the destination location
-        # Format for local destination location: user_server_remote-location
-        path = f'{self.user}_{self.server}_{self.location.replace("/", "_")}'
-        self.path = path.replace("__", "_")
-        self.destination_full_path = os.path.join(self.mountfolder, self.path)
+    def choose_server(self, exclude=()):
+        """Choose the lowest latency healthy replica, return False when none is reachable."""
+        candidates = [s for s in self.servers if s not in exclude]
+        if not candidates:
+            self.last_error = "No replica server is left to try"
+            return False
+        reachability = self.conf.reachability
+
+        # a recent stored latency makes the choice instant, only the winner is probed
+        stored = {s: reachability.stored_rtt(s, self.port) for s in candidates}
+        if len(candidates) > 1 and all(rtt is not None for rtt in stored.values()):
+            best = min(candidates, key=lambda s: self.score(s, stored[s]))
+            log.debug(f"Stored latencies: {stored}, trying {best}")
+            self.set_server(best)
+            if self.preflight():
+                return True
+            candidates.remove(best)
+            if not candidates:
+                return False
+
+        results = reachability.probe([(s, self.port) for s in candidates])
+        healthy = [s for s in candidates if results[(s, int(self.port))].reachable]
+        if not healthy:
+            reasons = "; ".join(f"{s}: {results[(s, int(self.port))].reason}" for s in candidates)
+            self.last_error = f"No replica is reachable ({reasons})"
+            log.warning(self.last_error)
+            return False
+
+        best = min(healthy, key=lambda s: self.score(s, results[(s, int(self.port))].rtt))
+        log.info(f"Chose replica {best} for {self.label}")
+        self.set_server(best)
+        self.last_error = ""
+        return True
+
+    def score(self, server, rtt):
+        """Return the weighted latency of a replica, lower is better, order breaks ties."""
+        index = self.servers.index(server)
+        return (rtt / self.weights[index], index)
+
+    def check_failover(self):
+        """Move a mount to the next healthy replica when its active server went away.
+
+        Returns None when nothing had to be done, else if the failover succeeded.
+        """
+        if len(self.servers) < 2 or self.busy() or not self.check_mount_location():
+            return None
+
+        self.conf.reachability.invalidate(self.server, self.port)
+        if self.preflight():
+            return None
+
+        dead = self.server
+        log.warning(f"Replica {dead} of {self.label} went away, failing over")
+        if not self.umount() and not self.force_umount():
+            self.last_error = f"Could not release the mount on {dead}"
+            return False
+        if self.mount(exclude=[dead]):  # the dead replica is not chosen again
+            log.info(f"{self.label} failed over from {dead} to {self.server}")
+            return True
+        return False
+
+    def force_umount(self):
+        """Detach a busy mount point or one whose server is gone (lazy unmount)."""
+        self.runner.reset()
+        try:
+            cmd = self.lazy_umount_command(self.destination_full_path)
+            self.runner.run(cmd, timeout=self.umount_timeout)
+        except (OSError, subprocess.CalledProcessError, mod_process.ModProcessExceptions) as err:
+            log.error(f"Lazy umount failed: {err}")
+            return False
+        mod_general.rmdir(self.destination_full_path)
+        return True
+
+    @staticmethod
+    def lazy_umount_command(path):
+        """Return the command that detaches a mount point (lazy unmount)."""
+        if sys.platform == "darwin":
+            return ["/sbin/umount", "-f", path]  # no lazy umount on macOS
+        return ["fusermount", "-uz", path]
+
+    def mount_command(self, destination, options):
+        """Return the sshfs command that mounts the active server on the destination."""
+        cmd = ["/usr/local/bin/sshfs", "-p", self.port]
+        options = options + [f"volname={self.path}"]
+        if mod_ssh.verified(self.user, self.server, self.port):
+            # the warm-up logged in without a prompt, so a prompt now is a failure, right away;
+            # else a prompt may be answered, like a key's passphrase through SSH_ASKPASS
+            options.append("BatchMode=yes")
+        for option in options:
+            cmd += ["-o", option]
+        return cmd + [self.source_full_patch, destination]
+
+    def sshfs_options(self):
+        """Return the sshfs options, the auto-tuned ones when they are known for the server."""
+        tuned = self.conf.tuning.get(self.server, self.port)
+        if tuned:
+            log.debug(f"Using the tuned sshfs options: {tuned}")
+            return list(tuned)
+        return ["auto_cache"]
+
+    def autotune(self):
+        """Measure the candidate sshfs option sets and remember the fastest one."""
+        self.runner.reset()
+        if len(self.servers) > 1:
+            if not self.choose_server():
+                return False
+        elif not self.preflight():
+            return False
+        try:
+            return mod_tuning.Tuner(self).run()
+        except (mod_process.CommandTimeoutError, mod_process.OperationCancelledError) as err:
+            self.last_error = err.message
+            return False
+        except mod_tuning.ModTuningExceptions as err:
+            self.last_error = str(err)
+            return False
 
-    def mount(self):
+    def transfer(self, sources, target, streams=None, progress=None):
+        """Copy files out of the mount point with parallel ssh streams, return the report."""
+        return mod_transfer.run(
+            self,
+            sources,
+            target,
+            streams or self.conf.get_transfer_streams(),
+            self.conf.get_transfer_chunk_mb(),
+            progress,
+        )
+
+    def index(self, full=False):
+        """Build or refresh the search index of the location, return the report."""
+        return mod_index.build(self, full)
+
+    def index_due(self):
+        """Return True when the search index exists and is older than the 'index_interval'."""
+        interval = self.conf.get_index_interval()
+        try:
+            age = time.time() - os.path.getmtime(mod_index.index_file(self))
+        except OSError:
+            return False  # no index, it is built on request
+        return bool(interval) and age >= interval
+
+    def offload(self, op, paths, target=None, algorithm=None, output=None):
+        """Run checksum, du, rm, cp or mv on the server, return the report."""
+        return mod_offload.run(self, op, paths, target, algorithm, output)
+
+    def tune_fuse(self):
+        """Apply the FUSE connection settings, a refusal is logged and the mount stays."""
+        try:
+            mod_fuse.FuseTuner(self).apply()
+        except (OSError, mod_fuse.ModFuseExceptions) as err:
+            log.warning(f"FUSE tuning of {self.label} skipped: {err}")
+
+    def fusetune(self, action="show", values=None, threads=16):
+        """Show, apply, revert or benchmark the FUSE connection settings, return the report."""
+        tuner = mod_fuse.FuseTuner(self)
+        try:
+            if action == "apply":
+                return tuner.apply(values)
+            if action == "revert":
+                return tuner.revert()
+            if action == "bench":
+                return tuner.benchmark(values, threads)
+            return tuner.show()
+        except (OSError, mod_fuse.ModFuseExceptions) as err:
+            self.last_error = str(err)
+            return False
+
+    def fuse_values(self):
+        """Return the effective FUSE connection settings, None when not mounted."""
+        if self.type != "sshfs":
+            return None
+        try:
+            return mod_fuse.FuseTuner(self).show()
+        except (OSError, mod_fuse.ModFuseExceptions):
+            return None
+
+    def holders(self):
+        """Return the processes that keep the mount point busy."""
+        return mod_busy.BusyMountAnalyzer().scan([self.destination_full_path])[
+            self.destination_full_path
+        ]
+
+    def cancel(self):
+        """Cancel the running (un)mount, this terminates the child processes."""
+        log.info(f"Cancel requested for: {self.source_full_patch}")
+        self.runner.cancel()
+
+    def busy(self):
+        """Return True while an (un)mount command is running."""
+        return self.runner.busy()
+
+    def mount(self, timeout=None, exclude=()):
+        """Mount the object, a timeout or cancel leaves it unmounted without its folder.
+
+        The replicas in 'exclude' are not chosen, like the one a failover moves away from.
+        """
+        self.runner.reset()
+        try:
+            return self._mount(timeout or self.mount_timeout, exclude)
+        except (mod_process.CommandTimeoutError, mod_process.OperationCancelledError) as err:
+            log.warning(f"Mounting aborted: {err}")
+            self.last_error = err.message
+            self.cleanup()
+            return False
+
+    def umount(self, lazy=None, diagnose=True, timeout=None):
+        """Unmount the object, a timeout or cancel leaves it in its current state.
+
+        A busy mount point is detached anyway with lazy, default from the 'lazy_umount' option.
+        With diagnose the processes holding a busy mount point are looked up.
+        """
+        self.runner.reset()
+        if lazy is None:
+            lazy = self.lazy_umount
+        try:
+            return self._umount(lazy, diagnose, timeout or self.umount_timeout)
+        except (mod_process.CommandTimeoutError, mod_process.OperationCancelledError) as err:
+            log.warning(f"UnMounting aborted: {err}")
+            self.last_error = err.message
+            return False
+        except UnmountingFailedError as err:
+            self.last_error = str(err)
+            return False
+
+    def remount(self):
+        """Detach and mount again, like when the sshfs processes are over their limits."""
+        if not self.umount(lazy=True, diagnose=False):
+            return False
+        return self.mount()
+
+    def cleanup(self):
+        """Remove the destination folder when the location is not mounted."""
+        self.runner.reset()
+        try:
+            if self.check_mount_location():
+                return
+        except (mod_process.ModProcessExceptions, UnmountingFailedError) as err:
+            log.error(f"Could not check the mount state, folder is kept: {err}")
+            self.last_error = str(err)
+            return
+        if os.path.isdir(self.destination_full_path) and not os.listdir(
+            self.destination_full_path
+        ):
+            mod_general.rmdir(self.destination_full_path)
+
+    def _mount(self, timeout, exclude=()):
         """Mount the object."""
         # self.logstack.append(f'Mount point is: {self.source_full_patch}.')
         log.debug(f"Mount point is: {self.source_full_patch}.")
@@ -59,27 +380,25 @@ class MountLocation:
             # Already mounted
             return True
 
+        # Fail fast when no (replica) server can be reached
+        if len(self.servers) > 1:
+            if not self.choose_server(exclude):
+                return False
+        elif not self.preflight():
+            return False
+
         # Make (if needed) the directory(s)
         if not mod_general.mkdir(self.destination_full_path):
             # self.logstack.append('The destination location '
             #                      'could not be created!')
             log.error("The destination location could not be created!")
+            self.last_error = "The destination location could not be created!"
             return False
 
         # Now we are clear to mount
         try:
             # Run the mount command
-            cmd = [
-                "/usr/local/bin/sshfs",
-                "-p",
-                self.port,
-                "-o",
-                "auto_cache",
-                "-o",
-                f"volname={self.path}",
-                self.source_full_patch,
-                self.destination_full_path,
-            ]
+            cmd = self.mount_command(self.destination_full_path, self.sshfs_options())
             # Other available options:
             # -o auto_cache
             # -o cache=no
@@ -87,19 +406,23 @@ class MountLocation:
             # -o volname=name  'here the local folder name will be
             #                   renamed from: "OSXFUSE Volume 0 (sshfs)"
             #                   to "name"'
-            subprocess.check_call(cmd)
+            self.runner.run(cmd, timeout=timeout, capture=False)
 
             # Check if the source location is already mounted
             if self.check_mount_location():
                 # the mount was successful
                 log.info("Mount point is mounted!")
+                if self.fuse_settings:
+                    self.tune_fuse()
                 return True
             else:
                 # the mount was unsuccessful
                 log.warning("Mount point is not mounted!")
+                self.last_error = "sshfs returned but the location is not mounted"
                 return False
         except subprocess.CalledProcessError as err:
             log.error(f"Could not mount, stopping: {err}")
+            self.last_error = f"sshfs failed with return code {err.returncode}"
             log.error(
                 "Return Codes:\n",
                 "mount has the following return codes ",
@@ -116,7 +439,7 @@ class MountLocation:
             )
             return False
 
-    def umount(self):
+    def _umount(self, lazy, diagnose, timeout):
         """Unmount the object."""
         log.debug(f"UnMount point: {self.source_full_patch}.")
 
@@ -126,7 +449,7 @@ class MountLocation:
             try:
                 # Run the umount command
                 cmd = ["/sbin/umount", self.destination_full_path]
-                subprocess.check_call(cmd)
+                self.runner.run(cmd, timeout=timeout)
                 if self.check_mount_location():
                     # still mounted!
                     log.warning("Could not umount")
@@ -135,6 +458,15 @@ class MountLocation:
                     log.info("UnMount successful")
             except subprocess.CalledProcessError as err:
                 log.error(f"Could not umount, stopping: {err}")
+                held_by = self.holders() if diagnose else []
+                if held_by:
+                    self.last_error = f"Busy, held by: {', '.join(map(str, held_by))}"
+                else:
+                    self.last_error = f"umount failed with return code {err.returncode}"
+                log.warning(self.last_error)
+                if lazy and self.force_umount():
+                    log.info("Lazy unmounted the busy mount point")
+                    return True
                 return False
         else:
             log.debug("Mount point is not mounted.")
@@ -148,27 +480,43 @@ class MountLocation:
             return False
 
     def check_mount_location(self):
-        """Check if the mountpoint is already mounted."""
+        """Check if the mountpoint is already mounted, on any of its replicas."""
         try:
-            lijst = subprocess.check_output(
-                f'mount | grep -i "{self.sourcelocation}" | grep -i "{self.user}"', shell=True
-            )
-            if lijst:
-                log.debug("The mountpoint is mounted.")
-                return True
-            else:
-                return False
+            lijst = self.runner.run(["mount"]).stdout.decode(errors="replace").lower()
         except subprocess.CalledProcessError as err:
-            if err.returncode == 1:
-                log.info("An empty result was returned by grep. " "Thus not mounted jet!")
-                return False
-            elif err.returncode > 1:
-                raise UnmountingFailedError(err.returncode) from err
-            else:
-                log.error(f"ERROR code: {err}")
+            raise UnmountingFailedError(err.returncode) from err
+
+        # only the mounts on the destination, not the scratch mounts of the auto-tune
+        destinations = {
+            f" on {self.destination_full_path.lower()} ",
+            f" on {os.path.abspath(self.destination_full_path).lower()} ",  # no stat, it can hang
+        }
+        for line in lijst.splitlines():
+            if self.user.lower() not in line or not any(d in line for d in destinations):
+                continue
+            for server in self.servers:
+                if f"{server}:{self.location}".lower() in line:
+                    log.debug("The mountpoint is mounted.")
+                    if server != self.server:
+                        self.set_server(server)
+                    return True
+        log.info("The mountpoint is not mounted jet!")
+        return False
+
+    def preflight(self):
+        """Check if the server answers on its port before mounting."""
+        result = self.conf.reachability.probe([(self.server, self.port)])[
+            (self.server, int(self.port))
+        ]
+        if not result.reachable:
+            self.last_error = f"{self.server}:{self.port} is unreachable ({result.reason})"
+            log.warning(self.last_error)
+            return False
+        self.last_error = ""
+        return True
 
     def check_protocol(self):
-        """Check if the chosen protocol is available on the system."""
+        """Check if the chosen protocol is available on the system, 'sync' is in mod_sync."""
         if self.type == "sshfs":
             if not os.path.exists("/usr/local/bin/sshfs"):
                 log.fatal("SSHFS isn't available on this system, please install it.")
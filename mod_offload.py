@@ -0,0 +1,207 @@
+"""This module runs the bulk operations on the server instead of through the mount."""
+
+import os
+import time
+import shlex
+import logging
+import threading
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+import mod_process
+import mod_ssh
+
+
+log = logging.getLogger(__name__)
+
+ALGORITHMS = ("md5", "sha1", "sha256", "sha512", "b2")
+OPERATIONS = ("checksum", "du", "rm", "cp", "mv")
+
+# the running operations per (server, port), shared by all mount points
+SEMAPHORES = {}
+SEMAPHORES_LOCK = threading.Lock()
+
+
+def host_semaphore(server, port, limit) -> threading.BoundedSemaphore:
+    """Return the semaphore that limits the operations on a host."""
+    with SEMAPHORES_LOCK:
+        key = (server, int(port))
+        if key not in SEMAPHORES:
+            SEMAPHORES[key] = threading.BoundedSemaphore(limit)
+        return SEMAPHORES[key]
+
+
+class Offload:
+    """This class runs checksum, du, rm, cp and mv on the server over the pooled ssh.
+
+    Only the results travel, not the data. The paths are in the mount point or relative to
+    the location and must stay inside the location. The output lines are passed to
+    'output' in batches while the command runs.
+    """
+
+    def __init__(self, mountpoint, output=None, keep=1000) -> None:
+        """Initialize the class."""
+        self.mountpoint = mountpoint
+        self.runner = mountpoint.runner
+        self.output = output
+        self.keep = keep  # the last output lines kept for the report
+        self.location = os.path.normpath(mountpoint.location)
+
+    def remote_path(self, path, allow_root=False) -> str:
+        """Return the remote path, raise UnsafePathError when it leaves the location."""
+        destination = os.path.normpath(self.mountpoint.destination_full_path)
+        path = os.path.normpath(path)
+        if path == destination or path.startswith(destination + "/"):
+            path = path[len(destination) :].lstrip("/")
+        if not os.path.isabs(path):
+            path = os.path.normpath(os.path.join(self.location, path))
+        inside = path.startswith(self.location.rstrip("/") + "/")
+        if not inside and not (allow_root and path == self.location):
+            raise UnsafePathError(path)
+        return path
+
+    def resolve(self, paths, target=None) -> Tuple[List[str], Optional[str]]:
+        """Return the paths resolved on the server, raise UnsafePathError when one leaves.
+
+        A symlink inside the location can point anywhere. The folder of each path is
+        resolved and the last part is kept, rm, mv, cp -a, du and find don't follow it. The
+        target is resolved in full, cp and mv write into it.
+        """
+        quote = shlex.quote
+        parents = " ".join(quote(os.path.dirname(path)) for path in paths)
+        script = f"realpath -e -z -- {quote(self.location)} {parents}"
+        if target:
+            script += f" && realpath -m -z -- {quote(target)}"
+        try:
+            output = self.runner.run(mod_ssh.ssh_command(self.mountpoint, script)).stdout
+        except subprocess.CalledProcessError as err:
+            reason = mod_ssh.gnu_reason(err, "coreutils")
+            raise ModOffloadExceptions(f"Resolving the paths failed: {reason}") from err
+        resolved = output.decode(errors="surrogateescape").split("\0")
+        location = resolved[0].rstrip("/") or "/"
+
+        def inside(path, allow_root):
+            if not path.startswith(location.rstrip("/") + "/") and not (
+                allow_root and path == location
+            ):
+                raise UnsafePathError(f"{path} (resolved on the server)")
+            return path
+
+        sources = []
+        for path, parent in zip(paths, resolved[1:]):
+            if path == self.location:
+                sources.append(location)
+            else:
+                sources.append(inside(os.path.join(parent, os.path.basename(path)), False))
+        if target:
+            target = inside(resolved[len(paths) + 1], allow_root=True)
+        return sources, target
+
+    def command(self, op, paths, target=None, algorithm=None) -> str:
+        """Return the remote command of an operation, on the paths resolved on the server."""
+        if op not in OPERATIONS:
+            raise ModOffloadExceptions(f"Unknown operation: {op}")
+        if not paths:
+            raise ModOffloadExceptions("No paths given")
+        if op in ("cp", "mv") and not target:
+            raise ModOffloadExceptions(f"{op} needs a target")
+        if op == "checksum":
+            algorithm = algorithm or self.mountpoint.conf.get_checksum_algorithm()
+            if algorithm not in ALGORITHMS:
+                raise ModOffloadExceptions(f"Unknown algorithm: {algorithm}")
+        # rm and mv never take the location itself
+        paths = [self.remote_path(path, op not in ("rm", "mv")) for path in paths]
+        if op in ("cp", "mv"):
+            target = self.remote_path(target, allow_root=True)
+        paths, target = self.resolve(paths, target if op in ("cp", "mv") else None)
+        quoted = " ".join(shlex.quote(path) for path in paths)
+        if op == "checksum":
+            return f"find {quoted} -type f -print0 | xargs -0 -r {algorithm}sum --"
+        if op == "du":
+            return f"du -sk -- {quoted}"
+        if op == "rm":
+            return f"rm -rf -- {quoted}"
+        if op == "cp":
+            return f"cp -a -- {quoted} {shlex.quote(target)}"
+        return f"mv -- {quoted} {shlex.quote(target)}"
+
+    def run(self, op, paths, target=None, algorithm=None, timeout=None) -> Dict:
+        """Run the operation on the server, return the report."""
+        remote = self.command(op, paths, target, algorithm)
+        conf = self.mountpoint.conf
+        semaphore = host_semaphore(
+            self.mountpoint.server, self.mountpoint.port, conf.get_offload_per_host()
+        )
+        lines, pending, rest = [], [], [b""]
+        sent = [time.monotonic()]
+        count = [0]
+
+        def flush():
+            if pending and self.output:
+                self.output(list(pending))
+            pending.clear()
+            sent[0] = time.monotonic()
+
+        def sink(data):
+            *complete, rest[0] = (rest[0] + data).split(b"\n")
+            for line in complete:
+                text = line.decode(errors="replace")
+                count[0] += 1
+                pending.append(text)
+                lines.append(text)
+            del lines[: -self.keep]
+            if time.monotonic() - sent[0] >= 0.5:
+                flush()
+
+        log.info(f"Offload on {self.mountpoint.server}: {remote}")
+        started = time.monotonic()
+        while not semaphore.acquire(timeout=0.5):
+            if self.runner.cancelled.is_set():
+                raise mod_process.OperationCancelledError(remote)
+        try:
+            cmd = mod_ssh.ssh_command(self.mountpoint, remote)
+            self.runner.stream(cmd, sink, timeout=timeout or conf.get_offload_timeout())
+        finally:
+            semaphore.release()
+            if rest[0]:
+                sink(b"\n")
+            flush()
+        return {
+            "op": op,
+            "lines": count[0],
+            "output": lines,
+            "seconds": time.monotonic() - started,
+        }
+
+
+def run(mountpoint, op, paths, target=None, algorithm=None, output=None):
+    """Run an offloaded operation, return the report or False with its last_error."""
+    mountpoint.runner.reset()
+    try:
+        return Offload(mountpoint, output).run(op, paths, target, algorithm)
+    except (mod_process.CommandTimeoutError, mod_process.OperationCancelledError) as err:
+        mountpoint.last_error = err.message
+    except subprocess.CalledProcessError as err:
+        errors = (err.stderr or b"").decode(errors="replace").strip().splitlines()
+        reason = errors[-1] if errors else f"return code {err.returncode}"
+        mountpoint.last_error = f"{op} failed: {reason}"
+    except (OSError, ModOffloadExceptions) as err:
+        mountpoint.last_error = str(err)
+    log.error(mountpoint.last_error)
+    return False
+
+
+class ModOffloadExceptions(Exception):
+    """The parent exception class for this module."""
+
+    pass
+
+
+class UnsafePathError(ModOffloadExceptions):
+    """Exception raised for a path outside the location of the mount point."""
+
+    def __init__(self, message):
+        """Initialize the class."""
+        msg = f"The path is not inside the location: {message}"
+        self.message = msg
+        super().__init__(self.message)
@@ -0,0 +1,269 @@
+"""This module accounts the sshfs processes of the mount points and enforces their limits."""
+
+import os
+import math
+import time
+import logging
+from typing import Dict, List, Optional
+
+import mod_busy
+from mod_capacity import human_size
+
+
+log = logging.getLogger(__name__)
+
+MIB = 1048576
+TICKS = os.sysconf("SC_CLK_TCK")
+PAGE = os.sysconf("SC_PAGE_SIZE")
+# memory.high over max_rss_mb, so the throttling can't keep the RSS under the restart limit
+HIGH_HEADROOM = 1.5
+
+
+def read_stat(pid, proc_root="/proc") -> Optional[Dict]:
+    """Return the parent, CPU ticks, threads and RSS of a process, None when it is gone."""
+    try:
+        with open(os.path.join(proc_root, str(pid), "stat")) as stat:
+            text = stat.read()
+    except OSError:
+        return None
+    fields = text[text.rindex(")") + 2 :].split()  # the name can hold spaces and brackets
+    return {
+        "ppid": int(fields[1]),
+        "ticks": int(fields[11]) + int(fields[12]),
+        "threads": int(fields[17]),
+        "rss": int(fields[21]) * PAGE,
+    }
+
+
+def read_io(pid, proc_root="/proc") -> Dict:
+    """Return the bytes a process read and wrote, sockets and pipes included."""
+    numbers = {}
+    try:
+        with open(os.path.join(proc_root, str(pid), "io")) as io:
+            for line in io:
+                key, _, value = line.partition(":")
+                numbers[key] = int(value)
+    except (OSError, ValueError):
+        pass  # another user's process, or no task accounting in the kernel
+    return {"read": numbers.get("rchar", 0), "write": numbers.get("wchar", 0)}
+
+
+def nice_of_weight(weight) -> int:
+    """Return the nice value of a cgroup v2 CPU weight, 100 is nice 0 and a step is 1.25x.
+
+    Only a lower priority is possible without privileges.
+    """
+    return min(19, max(0, round(math.log(100 / weight, 1.25))))
+
+
+class Cgroup:
+    """This class is the cgroup v2 of the sshfs processes of a mount point.
+
+    It is created next to the daemon's own cgroup, which works when that part of the tree
+    is delegated to the user, like under systemd's user@.service.
+    """
+
+    def __init__(self, name, root="/sys/fs/cgroup") -> None:
+        """Initialize the class."""
+        self.root = root
+        self.parent = os.path.join(root, os.path.dirname(self.own_path()).lstrip("/"))
+        self.path = os.path.join(self.parent, f"automounter-{name}")
+
+    @staticmethod
+    def own_path() -> str:
+        """Return the cgroup v2 path of this process."""
+        try:
+            with open("/proc/self/cgroup") as cgroup:
+                for line in cgroup:
+                    if line.startswith("0::"):
+                        return line[3:].strip()
+        except OSError:
+            pass
+        return "/"
+
+    def available(self) -> bool:
+        """Return True when cgroup v2 is mounted and the cgroup can be made."""
+        return os.path.exists(os.path.join(self.root, "cgroup.controllers")) and os.access(
+            self.parent, os.W_OK
+        )
+
+    def write(self, name, value, path=None) -> bool:
+        """Write a cgroup file, return False when the kernel refuses."""
+        try:
+            with open(os.path.join(path or self.path, name), "w") as control:
+                control.write(str(value))
+            return True
+        except OSError as err:
+            log.debug(f"Writing {name} of {path or self.path} failed: {err}")
+            return False
+
+    def apply(self, pids, max_rss_mb=0, cpu_weight=0) -> bool:
+        """Set the limits and move the processes into the cgroup, False when any write fails."""
+        try:
+            os.makedirs(self.path, exist_ok=True)
+        except OSError as err:
+            log.warning(f"Could not make the cgroup {self.path}: {err}")
+            return False
+        self.write("cgroup.subtree_control", "+memory +cpu", self.parent)
+        limited = True
+        if max_rss_mb:
+            # throttle well over the limit, the restart at the limit happens in the daemon,
+            # an OOM kill would leave a dead mount behind
+            limited = self.write("memory.high", int(max_rss_mb * HIGH_HEADROOM * MIB))
+        if cpu_weight:
+            limited = self.write("cpu.weight", cpu_weight) and limited
+        return all([self.write("cgroup.procs", pid) for pid in pids]) and limited
+
+    def remove(self) -> None:
+        """Remove the cgroup when it is empty."""
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
+
+
+class ProcessAccountant:
+    """This class samples the sshfs process tree of each mounted destination from /proc.
+
+    All the processes are scanned once per sample, whatever the number of mount points. The
+    tree is the sshfs process that has the destination on its command line and all its
+    descendants, like the ssh child. The CPU share is over the time since the last sample.
+    """
+
+    def __init__(self, proc_root="/proc", cgroup_root="/sys/fs/cgroup") -> None:
+        """Initialize the class."""
+        self.proc_root = proc_root
+        self.cgroup_root = cgroup_root
+        self.last = {}  # item: (time, {pid: ticks})
+        self.limited = {}  # item: the pids the limits are applied to
+        self.how = {}  # item: how the limits are applied, "cgroup", "nice" or "watched"
+        self.over = {}  # item: the number of samples in a row over the memory limit
+
+    def processes(self) -> Dict[int, Dict]:
+        """Return the stat of all processes with their command line."""
+        found = {}
+        for name in os.listdir(self.proc_root):
+            if not name.isdigit():
+                continue
+            stat = read_stat(name, self.proc_root)
+            if stat is None:
+                continue
+            try:
+                with open(os.path.join(self.proc_root, name, "cmdline"), "rb") as cmdline:
+                    stat["cmdline"] = cmdline.read().decode(errors="replace").split("\0")
+            except OSError:
+                continue
+            found[int(name)] = stat
+        return found
+
+    def trees(self, destinations) -> Dict[str, List[int]]:
+        """Return the pids of the sshfs tree of each destination {item: path}."""
+        processes = self.processes()
+        children = {}
+        for pid, stat in processes.items():
+            children.setdefault(stat["ppid"], []).append(pid)
+        paths = {}
+        for i, path in destinations.items():
+            paths[path.rstrip("/")] = i
+            paths[mod_busy.resolve(path)] = i  # no stat of a mount that may be dead
+        found = {i: [] for i in destinations}
+        for pid, stat in processes.items():
+            cmdline = stat["cmdline"]
+            if not cmdline or "sshfs" not in os.path.basename(cmdline[0]):
+                continue
+            i = next((paths[a.rstrip("/")] for a in cmdline[1:] if a.rstrip("/") in paths), None)
+            if i is None:
+                continue
+            tree, todo = [], [pid]
+            while todo:
+                tree.append(todo.pop())
+                todo.extend(children.get(tree[-1], []))
+            found[i] = sorted(tree)
+        return found
+
+    def sample(self, destinations) -> Dict[str, Dict]:
+        """Return the usage of the sshfs tree of each destination {item: path}."""
+        now = time.monotonic()
+        usage = {}
+        for i, pids in self.trees(destinations).items():
+            stats = {pid: read_stat(pid, self.proc_root) for pid in pids}
+            stats = {pid: stat for pid, stat in stats.items() if stat}
+            io = [read_io(pid, self.proc_root) for pid in stats]
+            ticks = {pid: stat["ticks"] for pid, stat in stats.items()}
+            cpu = 0.0
+            if i in self.last:
+                then, before = self.last[i]
+                spent = sum(t - before[pid] for pid, t in ticks.items() if pid in before)
+                cpu = 100.0 * spent / TICKS / (now - then) if now > then else 0.0
+            self.last[i] = (now, ticks)
+            usage[i] = {
+                "pids": sorted(stats),
+                "cpu_pct": cpu,
+                "rss": sum(stat["rss"] for stat in stats.values()),
+                "threads": sum(stat["threads"] for stat in stats.values()),
+                "read_bytes": sum(n["read"] for n in io),
+                "write_bytes": sum(n["write"] for n in io),
+            }
+        for i in list(self.last):
+            if i not in destinations:
+                self.forget(i)
+        return usage
+
+    def limit(self, i, pids, max_rss_mb=0, cpu_weight=0) -> str:
+        """Apply the limits to the new processes of a mount point, return how.
+
+        A cgroup v2 gets the memory and the CPU weight. Without one, or when the kernel
+        refuses a limit, the CPU weight becomes a nice value and the memory is only watched by
+        the sampling.
+        """
+        if not (max_rss_mb or cpu_weight) or not pids:
+            return ""
+        new = [pid for pid in pids if pid not in self.limited.get(i, ())]
+        if not new:
+            return self.how.get(i, "")
+        how = ""
+        cgroup = Cgroup(i, self.cgroup_root)
+        if cgroup.available():
+            if cgroup.apply(new, max_rss_mb, cpu_weight):
+                how = "cgroup"
+            else:
+                log.warning(f"Could not limit the sshfs processes of [{i}] in {cgroup.path}")
+        if not how:
+            how = "nice" if cpu_weight else "watched"
+            for pid in new:
+                if not cpu_weight:
+                    break
+                try:
+                    os.setpriority(os.PRIO_PROCESS, pid, nice_of_weight(cpu_weight))
+                except OSError as err:
+                    log.warning(f"Could not renice {pid} of [{i}]: {err}")
+                    how = "watched"
+        self.limited[i] = set(pids)
+        self.how[i] = how
+        return how
+
+    def breached(self, i, usage, max_rss_mb, samples=2) -> bool:
+        """Return True when the RSS is over the limit for 'samples' samples in a row."""
+        if not max_rss_mb or usage["rss"] <= max_rss_mb * MIB:
+            self.over.pop(i, None)
+            return False
+        self.over[i] = self.over.get(i, 0) + 1
+        if self.over[i] < samples:
+            return False
+        self.over.pop(i)
+        return True
+
+    def forget(self, i) -> None:
+        """Drop the samples and the cgroup of a mount point that is not mounted anymore."""
+        self.last.pop(i, None)
+        self.over.pop(i, None)
+        self.how.pop(i, None)
+        if self.limited.pop(i, None) is not None:
+            Cgroup(i, self.cgroup_root).remove()
+
+
+def describe(usage) -> str:
+    """Return the short text of the usage, for the mount list."""
+    if not usage or not usage["pids"]:
+        return ""
+    return f"{usage['cpu_pct']:.0f}% CPU {human_size(usage['rss'])}"
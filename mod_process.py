@@ -0,0 +1,165 @@
+"""This module runs the external commands under a deadline with process group management."""
+
+import os
+import signal
+import logging
+import tempfile
+import threading
+import subprocess
+
+
+log = logging.getLogger(__name__)
+
+
+class ProcessRunner:
+    """This class runs commands in their own process group so they can be timed out or cancelled."""
+
+    def __init__(self, timeout=30.0) -> None:
+        """Initialize the class."""
+        self.timeout = timeout  # default deadline in seconds
+        self.procs = set()  # the running child processes
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+
+    def reset(self) -> None:
+        """Clear a previous cancel request, call this before starting a new operation."""
+        self.cancelled.clear()
+
+    def run(self, cmd, timeout=None, shell=False, capture=True) -> subprocess.CompletedProcess:
+        """Run a command, raise CalledProcessError on a non zero return code."""
+        if self.cancelled.is_set():
+            raise OperationCancelledError(cmd)
+
+        timeout = timeout or self.timeout
+        log.debug(f"run: {cmd}, timeout: {timeout}s")
+        proc = subprocess.Popen(
+            cmd,
+            shell=shell,
+            stdout=subprocess.PIPE if capture else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            start_new_session=True,  # own process group, for killpg()
+        )
+        with self.lock:
+            self.procs.add(proc)
+
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired as err:
+            self.kill(proc)
+            raise CommandTimeoutError(cmd, timeout) from err
+        finally:
+            with self.lock:
+                self.procs.discard(proc)
+
+        if self.cancelled.is_set():
+            raise OperationCancelledError(cmd)
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+        return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+    def stream(self, cmd, sink, timeout=None, block=1048576) -> int:
+        """Run a command and pass its output to sink(data) while it runs, return the bytes.
+
+        The deadline is for the whole command, raise CalledProcessError on a non zero return code.
+        """
+        if self.cancelled.is_set():
+            raise OperationCancelledError(cmd)
+
+        timeout = timeout or self.timeout
+        log.debug(f"stream: {cmd}, timeout: {timeout}s")
+        errors = tempfile.TemporaryFile()  # a pipe could fill up while stdout is read
+        proc = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=errors, start_new_session=True
+        )
+        with self.lock:
+            self.procs.add(proc)
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            self.kill(proc)
+
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+        total = 0
+        try:
+            while True:
+                data = proc.stdout.read1(block)
+                if not data:
+                    break
+                sink(data)
+                total += len(data)
+            proc.wait()
+        finally:
+            timer.cancel()
+            if proc.poll() is None:
+                self.kill(proc)  # the sink failed
+            proc.stdout.close()
+            with self.lock:
+                self.procs.discard(proc)
+
+        if expired.is_set():
+            raise CommandTimeoutError(cmd, timeout)
+        if self.cancelled.is_set():
+            raise OperationCancelledError(cmd)
+        if proc.returncode:
+            errors.seek(0)
+            raise subprocess.CalledProcessError(proc.returncode, cmd, None, errors.read())
+        errors.close()
+        return total
+
+    def cancel(self) -> None:
+        """Terminate all running child processes of this runner."""
+        log.info("--cancel--")
+        self.cancelled.set()
+        with self.lock:
+            procs = list(self.procs)
+        for proc in procs:
+            self.kill(proc)
+
+    def busy(self) -> bool:
+        """Return True while a command is running."""
+        with self.lock:
+            return bool(self.procs)
+
+    @staticmethod
+    def kill(proc, grace=2.0) -> None:
+        """Terminate the process group, escalate to SIGKILL after the grace period."""
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(proc.pid, sig)
+            except (ProcessLookupError, PermissionError):
+                return
+            try:
+                proc.wait(timeout=grace)
+                return
+            except subprocess.TimeoutExpired:
+                log.warning(f"Process group {proc.pid} ignored signal {sig}")
+
+
+class ModProcessExceptions(Exception):
+    """The parent exception class for this module."""
+
+    pass
+
+
+class CommandTimeoutError(ModProcessExceptions):
+    """Exception raised when a command did not finish before its deadline."""
+
+    def __init__(self, cmd, timeout):
+        """Initialize the class."""
+        msg = f"Command did not finish within {timeout:g}s: {cmd}"
+        self.timeout = timeout
+        self.message = msg
+        super().__init__(self.message)
+
+
+class OperationCancelledError(ModProcessExceptions):
+    """Exception raised when the running operation was cancelled."""
+
+    def __init__(self, cmd):
+        """Initialize the class."""
+        msg = f"Operation was cancelled: {cmd}"
+        self.message = msg
+        super().__init__(self.message)
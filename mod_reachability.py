@@ -0,0 +1,235 @@
+"""This module provides a fast reachability pre-flight for the mount targets."""
+
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Tuple
+
+
+log = logging.getLogger(__name__)
+
+
+class ProbeResult:
+    """This class holds the outcome of a single host probe."""
+
+    def __init__(self, server, port, reachable, rtt=None, reason="") -> None:
+        """Initialize the class."""
+        self.server = server
+        self.port = port
+        self.reachable = reachable
+        self.rtt = rtt  # connect round-trip time in seconds
+        self.reason = reason
+        self.timestamp = time.monotonic()
+
+    def __repr__(self) -> str:
+        """Return a readable representation."""
+        if self.reachable:
+            return f"<ProbeResult {self.server}:{self.port} rtt={self.rtt * 1000:.1f}ms>"
+        return f"<ProbeResult {self.server}:{self.port} unreachable: {self.reason}>"
+
+
+class Reachability:
+    """This class probes hosts concurrently and caches the measured RTTs."""
+
+    def __init__(self, timeout=2.0, ttl=30.0, store_file=None, store_max_age=86400.0) -> None:
+        """Initialize the class."""
+        self.timeout = timeout  # deadline for a whole probe round
+        self.ttl = ttl  # seconds a measured RTT stays valid
+        self.cache = {}  # (server, port) -> ProbeResult
+        self.lock = threading.Lock()
+
+        # the latencies are stored on disk, so a later run can choose a replica instantly
+        self.store_file = store_file
+        self.store_max_age = store_max_age
+        self.store = self.load_store()
+
+    def load_store(self) -> Dict:
+        """Read the stored latencies."""
+        if not self.store_file or not os.path.exists(self.store_file):
+            return {}
+        try:
+            with open(self.store_file) as store:
+                return json.load(store)
+        except (OSError, ValueError) as err:
+            log.warning(f"Ignoring the latency store {self.store_file}: {err}")
+            return {}
+
+    def save_store(self) -> None:
+        """Write the stored latencies, atomically."""
+        if not self.store_file:
+            return
+        tmp = f"{self.store_file}.tmp"
+        try:
+            with self.lock:
+                data = json.dumps(self.store, indent=1, sort_keys=True)
+            with open(tmp, "w") as store:
+                store.write(data)
+            os.replace(tmp, self.store_file)
+        except OSError as err:
+            log.warning(f"Could not write the latency store: {err}")
+
+    def stored_rtt(self, server, port):
+        """Return the recent stored RTT of a healthy host or None."""
+        result = self.cached(server, port)
+        if result:
+            return result.rtt
+        with self.lock:
+            entry = self.store.get(f"{server}:{int(port)}")
+        if entry and entry["rtt"] is not None:
+            if time.time() - entry["time"] < self.store_max_age:
+                return entry["rtt"]
+        return None
+
+    def cached(self, server, port):
+        """Return a still valid cached result for the host or None."""
+        with self.lock:
+            result = self.cache.get((server, int(port)))
+        if result and time.monotonic() - result.timestamp < self.ttl:
+            return result
+        return None
+
+    def probe(self, targets: List[Tuple[str, int]]) -> Dict:
+        """Probe all the (server, port) targets and return the results."""
+        log.debug(f"--probe-- targets: {targets}")
+
+        results = {}
+        missing = []
+        for server, port in set((server, int(port)) for server, port in targets):
+            result = self.cached(server, port)
+            if result:
+                log.debug(f"Cached: {result}")
+                results[(server, port)] = result
+            else:
+                missing.append((server, port))
+
+        if missing:
+            changed = False
+            for result in self.run_probes(missing):
+                log.info(f"Probed: {result}")
+                results[(result.server, result.port)] = result
+                with self.lock:
+                    if result.reachable:
+                        self.cache[(result.server, result.port)] = result
+                    key = f"{result.server}:{result.port}"
+                    if self.store_changed(self.store.get(key), result.rtt):
+                        self.store[key] = {"rtt": result.rtt, "time": time.time()}
+                        changed = True
+            if changed:
+                self.save_store()
+        return results
+
+    def store_changed(self, entry, rtt, jitter=0.25) -> bool:
+        """Return True when a probed RTT is worth storing over the stored entry.
+
+        That is a new host, a change of reachability, an RTT that moved more than 'jitter'
+        or an entry that gets old, the file is not written for every probe.
+        """
+        if entry is None or (entry["rtt"] is None) != (rtt is None):
+            return True
+        if time.time() - entry["time"] > self.store_max_age / 10:
+            return True
+        return rtt is not None and abs(rtt - entry["rtt"]) > jitter * entry["rtt"]
+
+    def invalidate(self, server, port) -> None:
+        """Forget the cached result for a host."""
+        with self.lock:
+            self.cache.pop((server, int(port)), None)
+
+    def run_probes(self, targets) -> List[ProbeResult]:
+        """Run the probes on a private event loop, that doesn't wait for a stuck DNS lookup.
+
+        asyncio.run() joins the default executor on exit, a hanging getaddrinfo() would hold
+        the caller past the deadline.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self._probe_all(targets))
+        finally:
+            loop.close()
+
+    async def _probe_all(self, targets):
+        """Run all the probes concurrently."""
+        return await asyncio.gather(*[self._probe(server, port) for server, port in targets])
+
+    def _resolve(self, server, port) -> asyncio.Future:
+        """Resolve the host in a daemon thread, a lookup past the deadline is abandoned."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def settle(infos, err):
+            if future.done():
+                return
+            if err is None:
+                future.set_result(infos)
+            else:
+                future.set_exception(err)
+
+        def lookup():
+            try:
+                infos, err = socket.getaddrinfo(server, port, type=socket.SOCK_STREAM), None
+            except OSError as exc:
+                infos, err = None, exc
+            try:
+                loop.call_soon_threadsafe(settle, infos, err)
+            except RuntimeError:  # the probe round is over
+                pass
+
+        threading.Thread(target=lookup, name="probe_dns", daemon=True).start()
+        return future
+
+    async def _probe(self, server, port) -> ProbeResult:
+        """Resolve the host and connect to any of its addresses within the deadline."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+
+        try:
+            infos = await asyncio.wait_for(self._resolve(server, port), self.timeout)
+        except asyncio.TimeoutError:
+            return ProbeResult(server, port, False, reason="DNS lookup timed out")
+        except OSError as err:
+            return ProbeResult(server, port, False, reason=f"DNS lookup failed: {err}")
+
+        # a dual-stack host is reachable when any address answers, the others are tried too
+        addresses = list(dict.fromkeys((family, address[0]) for family, _, _, _, address in infos))
+        attempts = [
+            asyncio.ensure_future(self._connect(family, address, port))
+            for family, address in addresses
+        ]
+        reasons = []
+        remaining = max(deadline - loop.time(), 0.01)
+        try:
+            for attempt in asyncio.as_completed(attempts, timeout=remaining):
+                rtt, reason = await attempt
+                if rtt is not None:
+                    return ProbeResult(server, port, True, rtt=rtt)
+                reasons.append(reason)
+        except asyncio.TimeoutError:
+            reasons.append(f"no answer within {self.timeout:g}s")
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+            await asyncio.gather(*attempts, return_exceptions=True)
+        # the same reason for all the addresses is reported once
+        return ProbeResult(server, port, False, reason=", ".join(dict.fromkeys(reasons)))
+
+    async def _connect(self, family, address, port) -> Tuple:
+        """Do a TCP connect to one address, return (rtt, None) or (None, reason)."""
+        start = time.monotonic()
+        try:
+            _, writer = await asyncio.open_connection(address, port, family=family)
+        except ConnectionRefusedError:
+            return None, "connection refused"
+        except OSError as err:
+            return None, f"connect failed: {err}"
+
+        rtt = time.monotonic() - start
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return rtt, None
@@ -0,0 +1,174 @@
+"""This module removes the orphaned folders and dead FUSE mounts from the mount folder."""
+
+import os
+import re
+import errno
+import logging
+import threading
+import subprocess
+from typing import Dict
+
+import mod_mounter
+import mod_process
+
+
+log = logging.getLogger(__name__)
+
+# the errors a stat of a FUSE mount point gives when its sshfs process is gone
+DEAD_ERRNOS = (errno.ENOTCONN, errno.EIO, errno.ENXIO, errno.ECONNABORTED)
+# the destination folders MountLocation makes, 'user_server_location'
+FOLDER_PATTERN = re.compile(r"^[^_\s]+_[^_\s]+_")
+
+
+def read_mount_table(runner) -> Dict[str, str]:
+    """Return the mounted paths with their mount line, from one 'mount' run."""
+    table = {}
+    output = runner.run(["mount"]).stdout.decode(errors="replace")
+    for line in output.splitlines():
+        if " on " not in line:
+            continue
+        path = line.split(" on ", 1)[1]
+        # Linux: '/path type fuse.sshfs (...)', macOS: '/path (macfuse, ...)'
+        for end in (" type ", " ("):
+            if end in path:
+                path = path.split(end, 1)[0]
+                break
+        table[path] = line
+    return table
+
+
+class Reconciler:
+    """This class cross-checks the mount folder against the config and the mount table.
+
+    The mount folder is scanned once. Only the folders named like a destination of this
+    app that no configured section uses are touched: empty ones that are not mounted are
+    removed (left by crashes, failed mounts and renamed sections), sshfs mounts whose
+    process died are detached first. Live or hanging mounts, folders with files and the
+    configured destinations are never touched.
+    """
+
+    def __init__(self, mount_folder, destinations, busy=None, timeout=10.0, stat_timeout=2.0):
+        """Initialize the class."""
+        self.mount_folder = mount_folder
+        self.destinations = set(destinations)  # the configured destination folders
+        # returns True for a path with a running operation, asked again before each change
+        self.busy = busy or (lambda path: False)
+        self.runner = mod_process.ProcessRunner(timeout)
+        self.stat_timeout = stat_timeout
+
+    def is_orphan(self, path) -> bool:
+        """Return True for a folder of this app that no configured section uses."""
+        if path in self.destinations:
+            return False
+        if path.endswith(".spool") and path[: -len(".spool")] in self.destinations:
+            return False  # the write-back spool of a mount point
+        return bool(FOLDER_PATTERN.match(os.path.basename(path)))
+
+    def mounted(self, path, table=None) -> bool:
+        """Return True when the path is in the mount table, read again when not given."""
+        if table is None:
+            table = read_mount_table(self.runner)
+        return path in table or os.path.abspath(path) in table
+
+    def run(self, dry_run=False) -> Dict:
+        """Clean the mount folder and return what was done."""
+        log.debug("--reconcile--")
+        report = {"removed": [], "detached": [], "kept": []}
+        try:
+            table = read_mount_table(self.runner)
+        except (OSError, subprocess.CalledProcessError, mod_process.ModProcessExceptions) as err:
+            log.error(f"Could not read the mount table, nothing is cleaned: {err}")
+            return report
+
+        try:
+            entries = [e.path for e in os.scandir(self.mount_folder) if e.is_dir()]
+        except OSError as err:
+            log.error(f"Could not scan {self.mount_folder}: {err}")
+            return report
+
+        for path in entries:
+            if not self.is_orphan(path) or self.busy(path):
+                continue
+            line = table.get(path) or table.get(os.path.abspath(path))
+            try:
+                if line and not self.clean_mount(path, line, dry_run, report):
+                    continue
+                self.remove(path, dry_run, report)
+            except (
+                OSError,
+                subprocess.CalledProcessError,
+                mod_process.ModProcessExceptions,
+            ) as err:
+                log.error(f"Could not reconcile {path}: {err}")
+                report["kept"].append(path)
+
+        log.info(
+            f"Reconciled {self.mount_folder}: removed {len(report['removed'])}, "
+            f"detached {len(report['detached'])}, kept {len(report['kept'])}"
+        )
+        return report
+
+    def clean_mount(self, path, line, dry_run, report) -> bool:
+        """Detach a dead sshfs mount, return True when the folder can be removed next."""
+        if "sshfs" not in line or not self.is_dead(path):
+            report["kept"].append(path)  # a live or hanging mount, or not one of ours
+            return False
+        if dry_run:
+            report["detached"].append(path)
+            return False
+        if self.busy(path) or not self.mounted(path):
+            report["kept"].append(path)  # a mount started or it was detached meanwhile
+            return False
+        if not self.detach(path):
+            report["kept"].append(path)
+            return False
+        report["detached"].append(path)
+        return True
+
+    def remove(self, path, dry_run, report) -> None:
+        """Remove an empty folder that is not mounted."""
+        if dry_run:
+            if not os.listdir(path):
+                report["removed"].append(path)
+            return
+        if self.busy(path) or self.mounted(path):
+            report["kept"].append(path)  # a mount started meanwhile
+            return
+        try:
+            os.rmdir(path)  # only succeeds on an empty folder
+            report["removed"].append(path)
+        except OSError as err:
+            if err.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                log.warning(f"Could not remove {path}: {err}")
+
+    def is_dead(self, path) -> bool:
+        """Return True when the FUSE mount reports its process is gone.
+
+        A stat that hangs is a slow server or a stalled link, not a dead mount.
+        """
+        outcome = []
+
+        def probe():
+            try:
+                os.stat(path)
+                outcome.append(None)
+            except OSError as err:
+                outcome.append(err.errno)
+
+        worker = threading.Thread(target=probe, daemon=True)
+        worker.start()
+        worker.join(self.stat_timeout)
+        if not outcome:
+            log.warning(f"stat of {path} hangs, it is left alone")
+            return False
+        return outcome[0] in DEAD_ERRNOS
+
+    def detach(self, path) -> bool:
+        """Lazily unmount a dead FUSE mount."""
+        try:
+            self.runner.run(mod_mounter.MountLocation.lazy_umount_command(path))
+            log.info(f"Detached the dead mount {path}")
+            return True
+        except (OSError, subprocess.CalledProcessError, mod_process.ModProcessExceptions) as err:
+            log.error(f"Could not detach {path}: {err}")
+            return False
@@ -0,0 +1,139 @@
+"""This module soak tests the daemon against a fake mount backend and checks the memory."""
+
+import os
+import gc
+import time
+import logging
+import tempfile
+import threading
+import subprocess
+from typing import Dict
+
+import mod_daemon
+import mod_memory
+import mod_mounter
+import mod_process
+import mod_configuration_file
+
+
+log = logging.getLogger(__name__)
+
+# the fake mount table, shared by all fake mount points: destination: mount line
+TABLE = {}
+TABLE_LOCK = threading.Lock()
+
+
+class FakeRunner(mod_process.ProcessRunner):
+    """This class answers the sshfs, mount and umount commands from the fake mount table."""
+
+    def run(self, cmd, timeout=None, shell=False, capture=True) -> subprocess.CompletedProcess:
+        """Run a command against the fake mount table."""
+        if self.cancelled.is_set():
+            raise mod_process.OperationCancelledError(cmd)
+        stdout = b""
+        with TABLE_LOCK:
+            if cmd[0].endswith("sshfs"):
+                TABLE[cmd[-1]] = f"{cmd[-2]} on {cmd[-1]} (fake, nodev, nosuid)"
+            elif cmd == ["mount"]:
+                stdout = "\n".join(TABLE.values()).encode()
+            elif cmd[0].endswith("umount") or cmd[0] == "fusermount":
+                TABLE.pop(cmd[-1], None)
+        return subprocess.CompletedProcess(cmd, 0, stdout, b"")
+
+
+class FakeLocation(mod_mounter.MountLocation):
+    """This class is a mount point of the 'fake' type, it only exists in the fake table."""
+
+    def __init__(self, config, item):
+        """Start the class object."""
+        super().__init__(config, item)
+        self.runner = FakeRunner(self.conf.get_command_timeout())
+
+    def check_protocol(self):
+        """The fake backend needs no programs."""
+        pass
+
+    def preflight(self):
+        """The fake servers are always reachable."""
+        return True
+
+
+def make_config(folder, mounts) -> str:
+    """Write a config file with the fake mount points, return its name."""
+    lines = [
+        "[options]",
+        f"mount_folder = {os.path.join(folder, 'mounts')}",
+        f"state_folder = {os.path.join(folder, 'state')}",
+        "log_file = logs/automounter.log",
+        f"max_mount_points = {mounts + 1}",
+        "reconcile_at_start = no",
+    ]
+    for n in range(1, mounts + 1):
+        lines += [
+            f"[{n}]",
+            f"label = fake {n}",
+            "user = soak",
+            f"server = fake{n}.invalid",
+            f"location = /data/{n}",
+            "type = fake",
+            "port = 22",
+        ]
+    file = os.path.join(folder, "config.ini")
+    with open(file, "w") as config:
+        config.write("\n".join(lines) + "\n")
+    return file
+
+
+def soak(cycles=1000, mounts=4, tolerance_mb=5.0, reload_every=10) -> Dict:
+    """Cycle mount, umount and reload on the fake backend, return the report.
+
+    The RSS is measured after a warm-up of a tenth of the cycles and at the end.
+    """
+    with tempfile.TemporaryDirectory(prefix="automounter-soak-") as folder:
+        conf = mod_configuration_file.ConfigActions(
+            make_config(folder, mounts), {"fake": FakeLocation}
+        )
+        daemon = mod_daemon.MountDaemon(conf)
+        warmup = max(1, cycles // 10)
+        start_rss = None
+        started = time.monotonic()
+        for cycle in range(1, cycles + 1):
+            for action in ("mount", "umount"):
+                futures = [daemon.submit(i, action) for i in list(daemon.mountobjects)]
+                for future in futures:
+                    if not future.result()["result"]:
+                        raise SoakFailedError(f"{action} failed in cycle {cycle}")
+            if cycle % reload_every == 0:
+                daemon.rpc_reload()
+            if cycle == warmup:
+                gc.collect()
+                start_rss = mod_memory.rss_bytes()
+            if cycle % max(1, cycles // 10) == 0:
+                log.info(f"Soak cycle {cycle}: RSS {mod_memory.rss_bytes() / 1048576:.1f} MB")
+        gc.collect()
+        end_rss = mod_memory.rss_bytes()
+        daemon.pool.shutdown()
+        daemon.history.close()
+
+    growth = (end_rss - start_rss) / 1048576
+    return {
+        "cycles": cycles,
+        "mounts": mounts,
+        "seconds": time.monotonic() - started,
+        "start_rss": start_rss,
+        "end_rss": end_rss,
+        "growth_mb": growth,
+        "flat": growth <= tolerance_mb,  # the RSS grew at most 'tolerance_mb'
+    }
+
+
+class ModSoakExceptions(Exception):
+    """The parent exception class for this module."""
+
+    pass
+
+
+class SoakFailedError(ModSoakExceptions):
+    """Exception raised when an operation fails during the soak test."""
+
+    pass
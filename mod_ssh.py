@@ -0,0 +1,278 @@
+"""This module builds the ssh commands, sharing one connection per host."""
+
+import os
+import time
+import shlex
+import logging
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import mod_process
+
+
+log = logging.getLogger(__name__)
+
+# the "user@server:port" logins the last warm-up found working without a prompt
+VERIFIED = set()
+
+
+def ssh_options(mountpoint) -> List[str]:
+    """Return the ssh options for the mount point's active server.
+
+    The connections are multiplexed (ControlMaster), so the commands after the first one
+    reuse the pooled connection instead of doing a new handshake.
+    """
+    control_path = os.path.join(mountpoint.conf.get_state_folder(), "ssh-%C")
+    return [
+        "-p",
+        str(mountpoint.port),
+        "-o",
+        "BatchMode=yes",
+        "-o",
+        "ControlMaster=auto",
+        "-o",
+        f"ControlPath={control_path}",
+        "-o",
+        f"ControlPersist={int(mountpoint.conf.get_ssh_persist())}",
+    ]
+
+
+def ssh_command(mountpoint, remote_command=None) -> List[str]:
+    """Return the ssh command that runs the remote command on the active server."""
+    cmd = ["ssh"] + ssh_options(mountpoint) + [f"{mountpoint.user}@{mountpoint.server}"]
+    if remote_command:
+        cmd.append(remote_command)
+    return cmd
+
+
+def rsync_shell(mountpoint) -> str:
+    """Return the ssh command for the 'rsync -e' option."""
+    return shlex.join(["ssh"] + ssh_options(mountpoint))
+
+
+def target_name(user, server, port) -> str:
+    """Return the name of a login in the warm-up reports."""
+    return f"{user}@{server}:{int(port)}"
+
+
+def verified(user, server, port) -> bool:
+    """Return True when the warm-up logged in to the server without a prompt."""
+    return target_name(user, server, port) in VERIFIED
+
+
+def probe_command(conf, user, server, port) -> List[str]:
+    """Return the non-interactive ssh command that only tests the authentication.
+
+    The connect timeout is a third of the command's deadline, a host that doesn't answer
+    gets its own reason instead of the deadline's.
+    """
+    timeout = max(1, int(conf.get_command_timeout() / 3))
+    return [
+        "ssh",
+        "-p",
+        str(port),
+        "-o",
+        "BatchMode=yes",
+        "-o",
+        f"ConnectTimeout={timeout}",
+        f"{user}@{server}",
+        "true",
+    ]
+
+
+def auth_reason(stderr) -> str:
+    """Return the reason of a failed ssh from its error output, for the user."""
+    text = stderr.decode(errors="replace")
+    reasons = (
+        ("Host key verification failed", "the host key is unknown or changed"),
+        ("REMOTE HOST IDENTIFICATION HAS CHANGED", "the host key changed, check known_hosts"),
+        ("Permission denied", "the server refused all keys, is the key in the agent?"),
+        ("Could not resolve hostname", "the host name does not resolve"),
+        ("Connection refused", "the connection was refused"),
+        ("timed out", "the connection timed out"),
+        ("No route to host", "there is no route to the host"),
+    )
+    for needle, reason in reasons:
+        if needle in text:
+            return reason
+    lines = [line for line in text.strip().splitlines() if line]
+    return lines[-1] if lines else "ssh failed"
+
+
+def gnu_reason(err, tool) -> str:
+    """Return the reason of a failed remote command, that the server lacks the GNU tool."""
+    lines = (err.stderr or b"").decode(errors="replace").strip().splitlines()
+    needles = ("unknown primary", "unknown predicate", "illegal option", "invalid option")
+    for line in lines:  # a usage text can follow the line that names the option
+        if any(needle in line.lower() for needle in needles):
+            return f"{line} (the server needs GNU {tool})"
+    return lines[-1] if lines else f"return code {err.returncode}"
+
+
+class Warmup:
+    """This class prepares the ssh authentication of many mount points before they mount.
+
+    A first mount to a host can wait on a host key prompt without a terminal, or fail late
+    on a missing key. The distinct (user, server, port) tuples are checked up front, in
+    parallel: the host keys against known_hosts (with 'ssh -G' for aliases and their files)
+    and a BatchMode login per tuple. Only that login decides, keys in the agent prove nothing
+    about the server. Missing host keys can be fetched with ssh-keyscan, shown with their
+    fingerprints and accepted before any mount starts.
+    """
+
+    def __init__(self, conf, mountpoints, workers=16) -> None:
+        """Initialize the class."""
+        self.conf = conf
+        self.workers = workers
+        self.runner = mod_process.ProcessRunner(conf.get_command_timeout())
+        self.targets = sorted(
+            {
+                (m.user, server, int(m.port))
+                for m in mountpoints.values()
+                if m.type in ("sshfs", "sync")
+                for server in m.servers
+            }
+        )
+        self.hosts = sorted({(server, port) for _, server, port in self.targets})
+
+    def parallel(self, function, items) -> List:
+        """Run the function for each item in threads, return the results in order."""
+        if not items:
+            return []
+        with ThreadPoolExecutor(min(self.workers, len(items)), thread_name_prefix="warmup") as pool:
+            return list(pool.map(function, items))
+
+    def host_config(self, host) -> Dict:
+        """Return the name known_hosts uses for a host and the files it is looked up in."""
+        server, port = host
+        config = {"name": server, "port": port, "files": ["~/.ssh/known_hosts"]}
+        try:
+            output = self.runner.run(["ssh", "-G", "-p", str(port), server]).stdout
+        except (subprocess.CalledProcessError, mod_process.ModProcessExceptions, OSError):
+            return config
+        values = {}
+        for line in output.decode(errors="replace").splitlines():
+            key, _, value = line.partition(" ")
+            values[key] = value
+        config["name"] = values.get("hostkeyalias") or values.get("hostname") or server
+        config["port"] = int(values.get("port", port))
+        files = values.get("userknownhostsfile", "").split()
+        files += values.get("globalknownhostsfile", "").split()
+        config["files"] = [f for f in files if f != "none"] or config["files"]
+        return config
+
+    @staticmethod
+    def known_name(config) -> str:
+        """Return the host as it is written in known_hosts."""
+        if config["port"] == 22:
+            return config["name"]
+        return f"[{config['name']}]:{config['port']}"
+
+    def is_known(self, config) -> bool:
+        """Return True when one of the known_hosts files has a key of the host."""
+        for file in config["files"]:
+            file = os.path.expanduser(file)
+            if not os.path.exists(file):
+                continue
+            try:
+                self.runner.run(["ssh-keygen", "-F", self.known_name(config), "-f", file])
+                return True
+            except subprocess.CalledProcessError:
+                continue  # not in this file
+            except (mod_process.ModProcessExceptions, OSError) as err:
+                log.warning(f"Looking up {self.known_name(config)} failed: {err}")
+        return False
+
+    def unknown_hosts(self) -> Dict:
+        """Return the config of the hosts without a known host key."""
+        configs = self.parallel(self.host_config, self.hosts)
+        known = self.parallel(self.is_known, configs)
+        return {
+            host: config
+            for host, config, is_known in zip(self.hosts, configs, known)
+            if not is_known
+        }
+
+    def keyscan(self, config) -> Dict:
+        """Fetch the host keys of a host, return the known_hosts lines and fingerprints."""
+        cmd = ["ssh-keyscan", "-T", "5", "-p", str(config["port"]), config["name"]]
+        try:
+            output = self.runner.run(cmd, timeout=15).stdout.decode(errors="replace")
+        except subprocess.CalledProcessError:
+            output = ""
+        except (mod_process.ModProcessExceptions, OSError) as err:
+            return {"lines": [], "fingerprints": [], "error": str(err)}
+        lines = []
+        for line in output.splitlines():
+            if line and not line.startswith("#"):
+                _, _, key = line.partition(" ")
+                lines.append(f"{self.known_name(config)} {key}")
+        error = "" if lines else "the host did not send a key"
+        return {"lines": lines, "fingerprints": self.fingerprints(lines), "error": error}
+
+    def fingerprints(self, lines) -> List[str]:
+        """Return the fingerprints of known_hosts lines."""
+        if not lines:
+            return []
+        with tempfile.NamedTemporaryFile("w", prefix="hostkeys-", suffix=".pub") as keys:
+            keys.write("\n".join(lines) + "\n")
+            keys.flush()
+            try:
+                output = self.runner.run(["ssh-keygen", "-l", "-f", keys.name]).stdout
+            except (subprocess.CalledProcessError, mod_process.ModProcessExceptions, OSError):
+                return []
+        return output.decode(errors="replace").strip().splitlines()
+
+    def scan(self) -> List[Dict]:
+        """Return the unknown hosts with their scanned keys, to show before accepting them."""
+        unknown = self.unknown_hosts()
+        scanned = self.parallel(self.keyscan, list(unknown.values()))
+        return [
+            dict(keys, host=f"{server}:{port}", file=config["files"][0])
+            for ((server, port), config), keys in zip(unknown.items(), scanned)
+        ]
+
+    @staticmethod
+    def accept(hostkeys) -> List[str]:
+        """Add the scanned keys to the user's known_hosts, return the accepted hosts."""
+        accepted = []
+        for entry in hostkeys:
+            if not entry["lines"]:
+                continue
+            file = os.path.expanduser(entry["file"])
+            os.makedirs(os.path.dirname(file), mode=0o700, exist_ok=True)
+            with open(file, "a") as known_hosts:
+                known_hosts.write("\n".join(entry["lines"]) + "\n")
+            log.info(f"Accepted the host keys of {entry['host']} into {file}")
+            accepted.append(entry["host"])
+        return accepted
+
+    def login(self, target) -> str:
+        """Log in without a prompt, return '' or the reason it failed."""
+        try:
+            self.runner.run(probe_command(self.conf, *target))
+            return ""
+        except subprocess.CalledProcessError as err:
+            return auth_reason(err.stderr or b"")
+        except mod_process.CommandTimeoutError as err:
+            return f"the login did not finish within {err.timeout:g}s"
+        except (mod_process.ModProcessExceptions, OSError) as err:
+            return str(err)
+
+    def run(self) -> Dict:
+        """Log in to every target in parallel, return the report."""
+        started = time.monotonic()
+        names = [target_name(*target) for target in self.targets]
+        reasons = dict(zip(names, self.parallel(self.login, self.targets)))
+        failed = {name: reason for name, reason in reasons.items() if reason}
+        VERIFIED.difference_update(failed)
+        VERIFIED.update(name for name, reason in reasons.items() if not reason)
+        report = {
+            "targets": len(self.targets),
+            "failed": failed,
+            "seconds": time.monotonic() - started,
+        }
+        log.info(f"ssh warm-up: {report}")
+        return report
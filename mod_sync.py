@@ -0,0 +1,158 @@
+"""This module provides the 'sync' mount type, a local mirror kept fresh by rsync."""
+
+import os
+import time
+import shutil
+import logging
+import subprocess
+
+import mod_general
+import mod_mounter
+import mod_process
+import mod_ssh
+
+
+log = logging.getLogger(__name__)
+
+MARKER = ".automounter-sync"  # present in the destination while the mirror is 'mounted'
+
+
+class SyncLocation(mod_mounter.MountLocation):
+    """This class mirrors the remote location to the destination with incremental rsync.
+
+    Mounting pulls the location, unmounting pushes the local changes back (with 'sync_push')
+    and marks the mirror as unmounted. The mirrored files are kept, so the next mount only
+    transfers the differences.
+    """
+
+    def __init__(self, config, item):
+        """Start the class object."""
+        super().__init__(config, item)
+        self.sync_interval = self.config[item].getfloat("sync_interval", fallback=0.0)
+        self.sync_push = self.config[item].getboolean("sync_push", fallback=False)
+        self.sync_timeout = self.conf.get_sync_timeout()
+        self.marker = os.path.join(self.destination_full_path, MARKER)
+        self.last_sync = 0.0
+
+    def check_protocol(self):
+        """Check if rsync and ssh are available on the system."""
+        for program in ("rsync", "ssh"):
+            if not shutil.which(program):
+                log.fatal(f"{program} isn't available on this system, please install it.")
+                raise OSError(f"No {program}")
+
+    def check_mount_location(self):
+        """Check if the mirror is 'mounted', the marker holds the server it came from."""
+        try:
+            with open(self.marker) as marker:
+                server = marker.read().strip()
+        except OSError:
+            return False
+        if server in self.servers and server != self.server:
+            self.set_server(server)
+        return True
+
+    def due(self):
+        """Return True when the scheduled refresh of the mirror is due."""
+        return bool(self.sync_interval) and time.time() - self.last_sync >= self.sync_interval
+
+    def _mount(self, timeout, exclude=()):
+        """Pull the location into the destination."""
+        log.debug(f"Sync point is: {self.source_full_patch}.")
+        if self.check_mount_location():
+            return True
+
+        if len(self.servers) > 1:
+            if not self.choose_server(exclude):
+                return False
+        elif not self.preflight():
+            return False
+
+        if not mod_general.mkdir(self.destination_full_path):
+            self.last_error = "The destination location could not be created!"
+            return False
+        if not self.pull():
+            return False
+
+        try:
+            with open(self.marker, "w") as marker:
+                marker.write(self.server)
+        except OSError as err:
+            self.last_error = f"Could not write {self.marker}: {err}"
+            return False
+        log.info("Sync point is mirrored!")
+        return True
+
+    def _umount(self, lazy, diagnose, timeout):
+        """Push the local changes back when enabled and mark the mirror as unmounted."""
+        if not self.check_mount_location():
+            return True
+        if self.sync_push and not self.push():
+            if not lazy:
+                return False
+            log.warning("Local changes were not pushed, unmounting anyway")
+        return self.force_umount()
+
+    def force_umount(self):
+        """Mark the mirror as unmounted, the files are kept for the next incremental pull."""
+        try:
+            os.remove(self.marker)
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            self.last_error = f"Could not remove {self.marker}: {err}"
+            return False
+        return True
+
+    def cleanup(self):
+        """Keep the (partial) mirror after a cancel, the next pull continues from it."""
+        pass
+
+    def refresh(self):
+        """Push (when enabled) and pull the changes of a mounted mirror."""
+        self.runner.reset()
+        if not self.check_mount_location():
+            self.last_error = "The mirror is not mounted"
+            return False
+        try:
+            if self.sync_push and not self.push():
+                return False
+            return self.pull()
+        except (mod_process.CommandTimeoutError, mod_process.OperationCancelledError) as err:
+            self.last_error = err.message
+            return False
+
+    def rsync(self, source, destination, delete):
+        """Run rsync over the pooled ssh connection."""
+        cmd = ["rsync", "-az", "--partial", "--exclude", MARKER, "-e", mod_ssh.rsync_shell(self)]
+        cmd += ["--delete"] if delete else ["--update"]
+        cmd += [source, destination]
+        try:
+            self.runner.run(cmd, timeout=self.sync_timeout)
+            return True
+        except subprocess.CalledProcessError as err:
+            self.last_error = f"rsync failed with return code {err.returncode}"
+        except OSError as err:
+            self.last_error = f"rsync failed: {err}"
+        log.error(self.last_error)
+        return False
+
+    def pull(self):
+        """Mirror the remote location into the destination."""
+        log.info(f"Pulling {self.source_full_patch}")
+        source = f"{self.user}@{self.server}:{self.location.rstrip('/')}/"
+        if self.rsync(source, self.destination_full_path.rstrip("/") + "/", delete=True):
+            self.last_sync = time.time()
+            return True
+        return False
+
+    def push(self):
+        """Copy the local changes back to the remote location, newer remote files are kept."""
+        log.info(f"Pushing to {self.source_full_patch}")
+        destination = f"{self.user}@{self.server}:{self.location.rstrip('/')}/"
+        return self.rsync(self.destination_full_path.rstrip("/") + "/", destination, delete=False)
+
+    def autotune(self):
+        """The sshfs options don't apply to a mirror."""
+        self.last_error = "Auto-tune is only for sshfs mount points"
+        return False
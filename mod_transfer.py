@@ -0,0 +1,258 @@
+"""This module copies files out of a mount point with parallel ssh streams, resumable."""
+
+import os
+import json
+import time
+import shlex
+import hashlib
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import mod_process
+import mod_ssh
+
+
+log = logging.getLogger(__name__)
+
+MIB = 1048576
+
+
+class Transfer:
+    """This class copies remote files to a local folder with N streams over the pooled ssh.
+
+    sshfs moves all the data through one SFTP channel. Here every file, and every chunk of a
+    large file, is read by its own 'cat' or 'dd' over the multiplexed ssh connection, N at
+    a time. The finished chunks are kept in a journal in the state folder, so a cancelled or
+    failed transfer continues where it stopped. A file is written as '<name>.part' and gets
+    its name when all its chunks are in.
+    """
+
+    def __init__(self, mountpoint, sources, target, streams=4, chunk_mb=64, progress=None):
+        """Initialize the class."""
+        self.mountpoint = mountpoint
+        self.sources = [self.remote_path(source) for source in sources]
+        self.target = os.path.abspath(target)
+        self.streams = max(1, int(streams))
+        self.chunk_size = max(1, int(chunk_mb)) * MIB
+        self.progress = progress  # called with the progress dict, at most twice a second
+        self.runner = mountpoint.runner  # a cancel of the mount point stops all streams
+        self.lock = threading.Lock()
+        key = json.dumps([mountpoint.item, self.sources, self.target]).encode()
+        self.journal_file = os.path.join(
+            mountpoint.conf.get_state_folder(),
+            "transfers",
+            hashlib.sha1(key).hexdigest()[:16] + ".json",
+        )
+        self.journal = {}  # relative path: {"size": bytes, "mtime": text, "done": [chunk numbers]}
+        self.done_bytes = 0
+        self.total_bytes = 0
+        self.moved_bytes = 0  # transferred in this run, for the throughput
+        self.started = time.monotonic()
+        self.reported = 0.0
+        self.saved = 0.0  # when the journal was written last
+
+    def remote_path(self, source) -> str:
+        """Return the remote path of a source in the mount point or relative to its location."""
+        destination = self.mountpoint.destination_full_path.rstrip("/")
+        source = source.rstrip("/") or "/"
+        if source == destination or source.startswith(destination + "/"):
+            source = source[len(destination) :].lstrip("/")
+        if os.path.isabs(source):
+            return os.path.normpath(source)
+        return os.path.normpath(os.path.join(self.mountpoint.location, source))
+
+    def ssh(self, remote_command) -> List[str]:
+        """Return the ssh command over the pooled connection."""
+        return mod_ssh.ssh_command(self.mountpoint, remote_command)
+
+    def listing(self) -> Dict:
+        """List the files of the sources with one remote find, with their size and mtime."""
+        roots = " ".join(shlex.quote(source) for source in self.sources)
+        try:
+            output = self.runner.run(
+                self.ssh(f"find {roots} -type f -printf '%s\\t%T@\\t%p\\0'"), timeout=300
+            ).stdout.decode(errors="surrogateescape")
+        except subprocess.CalledProcessError as err:
+            reason = mod_ssh.gnu_reason(err, "find")
+            raise TransferFailedError(f"Listing the sources failed: {reason}") from err
+        files = {}
+        for entry in output.split("\0"):
+            if not entry:
+                continue
+            size, mtime, path = entry.split("\t", 2)
+            for root in self.sources:
+                if path == root or path.startswith(root.rstrip("/") + "/"):
+                    name = os.path.basename(root) or "root"
+                    rel = os.path.join(name, path[len(root) :].lstrip("/"))
+                    files[rel] = (path, int(size), mtime)
+                    break
+        return files
+
+    def load_journal(self) -> None:
+        """Read the journal of an earlier run of the same transfer."""
+        try:
+            with open(self.journal_file) as journal:
+                self.journal = json.load(journal)
+        except (OSError, ValueError):
+            self.journal = {}
+
+    def save_journal(self, every=0.0) -> None:
+        """Write the journal, atomically, at most once per 'every' seconds."""
+        with self.lock:
+            now = time.monotonic()
+            if now - self.saved < every:
+                return
+            self.saved = now
+            os.makedirs(os.path.dirname(self.journal_file), exist_ok=True)
+            tmp = f"{self.journal_file}.tmp"
+            with open(tmp, "w") as journal:
+                json.dump(self.journal, journal)
+            os.replace(tmp, self.journal_file)
+
+    def run(self) -> Dict:
+        """Copy all files, return the report."""
+        self.started = time.monotonic()
+        files = self.listing()
+        self.load_journal()
+        tasks = []
+        for rel, (path, size, mtime) in files.items():
+            local = os.path.join(self.target, rel)
+            entry = self.journal.get(rel)
+            # a file that changed on the server since the last run starts over
+            if entry is None or entry["size"] != size or entry.get("mtime") != mtime:
+                entry = self.journal[rel] = {"size": size, "mtime": mtime, "done": []}
+            count = max(1, -(-size // self.chunk_size))
+            if len(entry["done"]) == count and os.path.exists(local):
+                self.done_bytes += size
+                continue
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+            with open(f"{local}.part", "ab") as part:
+                part.truncate(size)
+            for n in range(count):
+                if n in entry["done"]:
+                    self.done_bytes += min(self.chunk_size, size - n * self.chunk_size)
+                else:
+                    tasks.append((rel, path, size, n))
+        self.total_bytes = sum(size for _, size, _ in files.values())
+        resumed = self.done_bytes
+        self.save_journal()
+        log.info(
+            f"Transfer of {len(files)} files, {self.total_bytes} bytes to {self.target}: "
+            f"{len(tasks)} chunks with {self.streams} streams, {resumed} bytes resumed"
+        )
+
+        with ThreadPoolExecutor(self.streams, thread_name_prefix="transfer") as pool:
+            futures = [pool.submit(self.fetch, *task) for task in tasks]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                self.runner.cancel()  # stop the other streams, the journal keeps the progress
+                raise
+            finally:
+                self.save_journal()
+
+        for rel in files:
+            local = os.path.join(self.target, rel)
+            if os.path.exists(f"{local}.part"):
+                os.replace(f"{local}.part", local)
+        os.remove(self.journal_file)
+
+        seconds = time.monotonic() - self.started
+        report = {
+            "files": len(files),
+            "bytes": self.total_bytes,
+            "resumed": resumed,
+            "seconds": seconds,
+            "rate": self.moved_bytes / seconds if seconds else 0.0,
+            "streams": self.streams,
+        }
+        self.report(force=True)
+        return report
+
+    def fetch(self, rel, path, size, n) -> None:
+        """Copy one chunk of a file into its place in the '.part' file."""
+        offset = n * self.chunk_size
+        length = min(self.chunk_size, size - offset)
+        if size <= self.chunk_size:
+            cmd = self.ssh(f"cat {shlex.quote(path)}")
+        else:
+            blocks = self.chunk_size // MIB
+            cmd = self.ssh(
+                f"dd if={shlex.quote(path)} bs={MIB} skip={n * blocks} count={blocks} 2>/dev/null"
+            )
+        fd = os.open(os.path.join(self.target, f"{rel}.part"), os.O_WRONLY)
+        position = [offset]
+
+        def sink(data):
+            os.pwrite(fd, data, position[0])
+            position[0] += len(data)
+            with self.lock:
+                self.done_bytes += len(data)
+                self.moved_bytes += len(data)
+            self.report()
+
+        try:
+            received = self.runner.stream(cmd, sink, timeout=max(300, length / MIB * 10))
+        except BaseException:
+            with self.lock:
+                self.done_bytes -= position[0] - offset
+            raise
+        finally:
+            os.close(fd)
+        if received != length:
+            raise TransferFailedError(f"{path} changed during the transfer")
+        with self.lock:
+            self.journal[rel]["done"].append(n)
+        self.save_journal(every=1.0)  # a crash loses at most a second of chunks
+
+    def report(self, force=False) -> None:
+        """Send the progress, at most twice a second."""
+        now = time.monotonic()
+        if not self.progress or (not force and now - self.reported < 0.5):
+            return
+        self.reported = now
+        with self.lock:
+            done, moved = self.done_bytes, self.moved_bytes
+        rate = moved / (now - self.started) if now > self.started else 0.0
+        self.progress({"done": done, "total": self.total_bytes, "rate": rate})
+
+
+def run(mountpoint, sources, target, streams=4, chunk_mb=64, progress=None):
+    """Run a transfer for a mount point, return the report or False with its last_error."""
+    mountpoint.runner.reset()
+    try:
+        return Transfer(mountpoint, sources, target, streams, chunk_mb, progress).run()
+    except (mod_process.CommandTimeoutError, mod_process.OperationCancelledError) as err:
+        mountpoint.last_error = err.message
+    except subprocess.CalledProcessError as err:
+        mountpoint.last_error = f"{err.cmd[-1]} failed with return code {err.returncode}"
+    except (OSError, TransferFailedError) as err:
+        mountpoint.last_error = str(err)
+    log.error(f"Transfer failed, it continues at the next run: {mountpoint.last_error}")
+    return False
+
+
+def describe(report) -> str:
+    """Return the one line summary of a transfer report."""
+    rate = report["rate"] / MIB
+    return (
+        f"{report['files']} files, {report['bytes'] / MIB:.1f} MiB in {report['seconds']:.1f}s "
+        f"({rate:.1f} MiB/s with {report['streams']} streams, {report['resumed'] / MIB:.1f} MiB "
+        f"resumed)"
+    )
+
+
+class ModTransferExceptions(Exception):
+    """The parent exception class for this module."""
+
+    pass
+
+
+class TransferFailedError(ModTransferExceptions):
+    """Exception raised when a file could not be copied."""
+
+    pass
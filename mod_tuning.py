@@ -0,0 +1,234 @@
+"""This module tunes the sshfs options per server and caches the results."""
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+import subprocess
+from typing import Dict
+
+import mod_general
+import mod_process
+
+
+log = logging.getLogger(__name__)
+
+# The candidate sshfs option sets, the first one is the baseline every mount used before.
+# The ssh options (Ciphers, Compression) are passed on to ssh by sshfs.
+CANDIDATES = [
+    ("default", ["auto_cache"]),
+    ("aes-gcm", ["auto_cache", "Ciphers=aes128-gcm@openssh.com", "Compression=no"]),
+    ("chacha20", ["auto_cache", "Ciphers=chacha20-poly1305@openssh.com", "Compression=no"]),
+    ("compressed", ["auto_cache", "Compression=yes"]),
+    ("big-reads", ["auto_cache", "Ciphers=aes128-gcm@openssh.com", "max_read=131072"]),
+    (
+        "long-cache",
+        [
+            "auto_cache",
+            "Ciphers=aes128-gcm@openssh.com",
+            "cache_timeout=120",
+            "attr_timeout=120",
+            "entry_timeout=120",
+        ],
+    ),
+]
+
+
+class TuningCache:
+    """This class stores the winning sshfs options per (server, port) with a TTL."""
+
+    def __init__(self, file, ttl=604800.0) -> None:
+        """Initialize the class."""
+        self.file = file
+        self.ttl = ttl  # seconds a winner is used before tuning is advised again
+        self.lock = threading.Lock()
+        self.entries = self.load()
+
+    def load(self) -> Dict:
+        """Read the stored winners."""
+        if not os.path.exists(self.file):
+            return {}
+        try:
+            with open(self.file) as cache:
+                return json.load(cache)
+        except (OSError, ValueError) as err:
+            log.warning(f"Ignoring the tuning cache {self.file}: {err}")
+            return {}
+
+    def save(self) -> None:
+        """Write the stored winners, atomically."""
+        tmp = f"{self.file}.tmp"
+        with self.lock:
+            data = json.dumps(self.entries, indent=1, sort_keys=True)
+        try:
+            with open(tmp, "w") as cache:
+                cache.write(data)
+            os.replace(tmp, self.file)
+        except OSError as err:
+            log.warning(f"Could not write the tuning cache: {err}")
+
+    def get(self, server, port):
+        """Return the winning options for the server or None when unknown or expired."""
+        with self.lock:
+            entry = self.entries.get(f"{server}:{int(port)}")
+        if entry and time.time() - entry["time"] < self.ttl:
+            return entry["options"]
+        return None
+
+    def put(self, server, port, report) -> None:
+        """Store the tuning report of a server."""
+        with self.lock:
+            self.entries[f"{server}:{int(port)}"] = dict(report, time=time.time())
+        self.save()
+
+
+class Tuner:
+    """This class mounts the section on a scratch folder per candidate and times a workload.
+
+    A first untimed run warms the server's caches. Then every candidate is measured once
+    per round, in a new random order each round, and its best time counts, so neither the
+    warm-up nor the order favours one of them.
+    """
+
+    def __init__(self, mountpoint, max_entries=300, max_read=4 << 20, rounds=3) -> None:
+        """Initialize the class."""
+        self.mountpoint = mountpoint
+        self.runner = mountpoint.runner
+        self.max_entries = max_entries  # the number of entries the workload stats
+        self.max_read = max_read  # the number of bytes the workload reads
+        self.rounds = rounds
+        self.scratch = os.path.join(mountpoint.conf.get_state_folder(), "tune", mountpoint.item)
+
+    def run(self) -> Dict:
+        """Measure all candidates, store and return the report."""
+        log.info(f"Auto-tuning {self.mountpoint.label} on {self.mountpoint.server}")
+        if not mod_general.mkdir(self.scratch):
+            raise TuningFailedError(f"Could not create {self.scratch}")
+
+        times = {name: [] for name, _ in CANDIDATES}
+        try:
+            self.measure(CANDIDATES[0][1])  # the warm-up, not counted
+            for _ in range(self.rounds):
+                order = list(CANDIDATES)
+                random.shuffle(order)
+                for name, options in order:
+                    seconds = self.measure(options)
+                    log.info(f"candidate {name}: {seconds}")
+                    if seconds is not None:
+                        times[name].append(seconds)
+        finally:
+            mod_general.rmdir(self.scratch)  # also when cancelled
+        results = {name: min(runs) for name, runs in times.items() if runs}
+
+        if not results:
+            raise TuningFailedError("No candidate option set could be mounted")
+
+        winner = min(results, key=results.get)
+        baseline = results.get(CANDIDATES[0][0])
+        gain = (1 - results[winner] / baseline) * 100 if baseline else None
+        report = {
+            "winner": winner,
+            "options": dict(CANDIDATES)[winner],
+            "results": results,
+            "rounds": self.rounds,
+            "gain": gain,
+            "text": self.format(winner, results, gain),
+        }
+        self.mountpoint.conf.tuning.put(self.mountpoint.server, self.mountpoint.port, report)
+        return report
+
+    def measure(self, options):
+        """Mount with the options, time the workload and unmount, None when it failed."""
+        cmd = self.mountpoint.mount_command(self.scratch, options)
+        try:
+            self.runner.run(cmd, timeout=self.mountpoint.mount_timeout, capture=False)
+        except subprocess.CalledProcessError as err:
+            log.warning(f"Mounting with {options} failed: {err}")
+            return None
+
+        try:
+            path = os.path.join(self.scratch, self.mountpoint.tune_path.lstrip("/"))
+            return self.timed_workload(path)
+        finally:
+            self.release()
+
+    def timed_workload(self, path):
+        """Run the workload in a thread, a hung mount costs at most the mount timeout."""
+        elapsed = []
+        worker = threading.Thread(target=lambda: elapsed.append(self.workload(path)), daemon=True)
+        worker.start()
+        worker.join(self.mountpoint.mount_timeout)
+        if worker.is_alive() or not elapsed:
+            log.warning(f"The workload on {path} did not finish")
+            return None
+        return elapsed[0]
+
+    def workload(self, path) -> float:
+        """Walk and stat the tree, read the files, return the seconds it took."""
+        start = time.perf_counter()
+        entries = 0
+        read = 0
+        todo = [path]
+        while todo and entries < self.max_entries:
+            try:
+                with os.scandir(todo.pop(0)) as scan:
+                    for entry in scan:
+                        entries += 1
+                        entry.stat(follow_symlinks=False)
+                        if entry.is_dir(follow_symlinks=False):
+                            todo.append(entry.path)
+                        elif read < self.max_read and entry.is_file(follow_symlinks=False):
+                            with open(entry.path, "rb") as data:
+                                read += len(data.read(self.max_read - read))
+                        if entries >= self.max_entries:
+                            break
+            except OSError as err:
+                log.debug(f"workload: {err}")
+        return time.perf_counter() - start
+
+    def release(self) -> None:
+        """Unmount the scratch folder, detach it when that fails, also after a cancel."""
+        cancelled = self.runner.cancelled.is_set()
+        self.runner.reset()
+        errors = (OSError, subprocess.CalledProcessError, mod_process.ModProcessExceptions)
+        commands = [
+            ["/sbin/umount", self.scratch],
+            self.mountpoint.lazy_umount_command(self.scratch),
+        ]
+        try:
+            for cmd in commands:
+                try:
+                    self.runner.run(cmd, timeout=self.mountpoint.umount_timeout)
+                    return
+                except errors as err:
+                    log.warning(f"Releasing the scratch mount failed: {err}")
+        finally:
+            if cancelled:
+                self.runner.cancelled.set()
+
+    @staticmethod
+    def format(winner, results, gain) -> str:
+        """Return the report as text."""
+        lines = [f"{name:12} {seconds * 1000:8.1f} ms (best)" for name, seconds in results.items()]
+        lines.append(f"winner: {winner}")
+        if gain is not None:
+            lines.append(f"gain over the default options: {gain:.0f}%")
+        return "\n".join(lines)
+
+
+class ModTuningExceptions(Exception):
+    """The parent exception class for this module."""
+
+    pass
+
+
+class TuningFailedError(ModTuningExceptions):
+    """Exception raised when the auto-tune could not measure anything."""
+
+    def __init__(self, message):
+        """Initialize the class."""
+        msg = f"Auto-tune failed: {message}"
+        self.message = msg
+        super().__init__(self.message)
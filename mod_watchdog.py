@@ -0,0 +1,119 @@
+"""This module finds the stalls of the GUI event loop and where the GUI thread was stuck."""
+
+import os
+import sys
+import time
+import logging
+import threading
+import traceback
+from collections import Counter
+from typing import List
+
+
+log = logging.getLogger(__name__)
+
+
+def diagnostics_logger(file) -> logging.Logger:
+    """Return the logger that writes only to the diagnostics log."""
+    logger = logging.getLogger("diagnostics")
+    logger.propagate = False  # keep the stacks out of the main log
+    if not logger.handlers:
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        handler = logging.FileHandler(file)
+        handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+    return logger
+
+
+class Stall:
+    """This class describes one stall of the event loop."""
+
+    def __init__(self, start, stack) -> None:
+        """Initialize the class."""
+        self.start = start
+        self.duration = 0.0
+        self.stack = stack  # the GUI thread's stack when the stall passed the threshold
+
+    def where(self) -> str:
+        """Return the innermost frame of the AutoMounter code, or else the innermost one."""
+        for frame in reversed(self.stack):
+            if "/mod_" in frame.filename or "automounter" in frame.filename:
+                return f"{frame.name} ({frame.filename.rsplit('/', 1)[-1]}:{frame.lineno})"
+        if self.stack:
+            frame = self.stack[-1]
+            return f"{frame.name} ({frame.filename.rsplit('/', 1)[-1]}:{frame.lineno})"
+        return "unknown"
+
+
+class StallWatchdog:
+    """This class watches the heartbeat of the GUI thread from a thread of its own.
+
+    The GUI beats from a QTimer. When no beat comes for 'threshold' seconds, the watchdog
+    takes the GUI thread's stack with sys._current_frames; the next beat ends the stall,
+    which is written with its duration and stack to the diagnostics log.
+    """
+
+    def __init__(self, threshold=0.1, file=None, keep=200) -> None:
+        """Initialize the class, call it from the GUI thread."""
+        self.threshold = threshold
+        self.keep = keep  # the number of stalls kept for the summary
+        self.gui_thread = threading.get_ident()
+        self.logger = diagnostics_logger(file) if file else log
+        self.lock = threading.Lock()
+        self.last_beat = time.monotonic()
+        self.current = None  # the running stall
+        self.stalls = []
+        self.stopped = threading.Event()
+
+    def start(self) -> None:
+        """Start the watchdog thread."""
+        threading.Thread(target=self.watch, name="watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop the watchdog thread."""
+        self.stopped.set()
+
+    def beat(self) -> None:
+        """Tell the watchdog the event loop runs, called from the GUI thread."""
+        now = time.monotonic()
+        with self.lock:
+            stall, self.current = self.current, None
+            self.last_beat = now
+        if stall:
+            stall.duration = now - stall.start
+            self.stalls = self.stalls[-self.keep + 1 :] + [stall]
+            self.logger.warning(
+                f"GUI stalled for {stall.duration * 1000:.0f} ms in {stall.where()}\n"
+                + "".join(traceback.format_list(stall.stack))
+            )
+
+    def watch(self) -> None:
+        """Check the heartbeat until stopped."""
+        while not self.stopped.wait(self.threshold / 4):
+            with self.lock:
+                if self.current or time.monotonic() - self.last_beat < self.threshold:
+                    continue
+                frame = sys._current_frames().get(self.gui_thread)
+                stack = traceback.extract_stack(frame) if frame else []
+                self.current = Stall(self.last_beat, stack)
+
+    def summary(self) -> List[str]:
+        """Return the lines of the stall summary, the worst places first."""
+        stalls = list(self.stalls)
+        if not stalls:
+            return [f"No stalls over {self.threshold * 1000:.0f} ms."]
+        places = Counter()
+        worst = {}
+        for stall in stalls:
+            place = stall.where()
+            places[place] += 1
+            worst[place] = max(worst.get(place, 0.0), stall.duration)
+        total = sum(stall.duration for stall in stalls)
+        lines = [
+            f"{len(stalls)} stalls over {self.threshold * 1000:.0f} ms, "
+            f"{total:.1f} s in total, the stacks are in the diagnostics log:"
+        ]
+        for place, count in sorted(places.items(), key=lambda item: -worst[item[0]]):
+            lines.append(f"  {count}x, up to {worst[place] * 1000:.0f} ms: {place}")
+        return lines
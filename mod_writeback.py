@@ -0,0 +1,272 @@
+"""This module spools the writes of a 'writeback' mount point locally and flushes them over ssh."""
+
+import os
+import json
+import stat
+import time
+import shlex
+import logging
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List
+
+import mod_process
+import mod_ssh
+from mod_capacity import human_size
+
+
+log = logging.getLogger(__name__)
+
+MIB = 1048576
+CONFLICTS = ".conflicts"  # in the spool, the files that were not sent because of a conflict
+
+# one flush at a time per spool folder, shared by the Spool objects of the folder
+LOCKS = {}
+LOCKS_LOCK = threading.Lock()
+
+
+def folder_lock(folder) -> threading.Lock:
+    """Return the lock of a spool folder, the same one after a reload."""
+    with LOCKS_LOCK:
+        return LOCKS.setdefault(os.path.abspath(folder), threading.Lock())
+
+
+class Spool:
+    """This class is the local outbox of a mount point, the folder '<destination>.spool'.
+
+    Applications write into the spool at local disk speed, whether the server is reachable
+    or not, so a dropped link never hangs them. The flusher sends the settled files (not
+    changed for 'settle' seconds) to the same path in the location, in the order they were
+    first seen, many files per tar stream over the pooled ssh connection. A file written
+    again before it is sent is sent once, with its last content. The journal in the state
+    folder keeps the order across restarts. While the server is unreachable the flusher
+    pauses. A remote file that is newer than the spooled one is not overwritten, the
+    spooled file moves to '.conflicts' in the spool.
+    """
+
+    def __init__(self, mountpoint, settle=2.0, batch_mb=64, batch_files=200) -> None:
+        """Initialize the class."""
+        self.mountpoint = mountpoint
+        self.folder = mountpoint.destination_full_path.rstrip("/") + ".spool"
+        self.settle = settle
+        self.batch_bytes = batch_mb * MIB
+        self.batch_files = batch_files
+        self.runner = mod_process.ProcessRunner(mountpoint.conf.get_command_timeout())
+        self.lock = folder_lock(self.folder)  # one flush at a time
+        self.journal_file = os.path.join(
+            mountpoint.conf.get_state_folder(), "spool", f"{mountpoint.item}.json"
+        )
+        self.journal = {"seq": 0, "files": {}, "conflicts": 0}
+        self.paused = ""  # the reason the flushing is paused
+        self.rate = 0.0  # bytes per second of the last flush
+        self.flushed = 0  # bytes sent since the start
+        self.load_journal()
+
+    def load_journal(self) -> None:
+        """Read the journal of the earlier runs."""
+        try:
+            with open(self.journal_file) as journal:
+                self.journal.update(json.load(journal))
+        except (OSError, ValueError):
+            pass
+
+    def save_journal(self) -> None:
+        """Write the journal, atomically."""
+        os.makedirs(os.path.dirname(self.journal_file), exist_ok=True)
+        tmp = f"{self.journal_file}.tmp"
+        with open(tmp, "w") as journal:
+            json.dump(self.journal, journal)
+        os.replace(tmp, self.journal_file)
+
+    def scan(self) -> None:
+        """Add the new files of the spool to the journal and forget the ones that are gone."""
+        os.makedirs(self.folder, exist_ok=True)
+        files = self.journal["files"]
+        seen = set()
+        for root, folders, names in os.walk(self.folder):
+            if root == self.folder and CONFLICTS in folders:
+                folders.remove(CONFLICTS)
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    info = os.lstat(path)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(info.st_mode):
+                    continue
+                rel = os.path.relpath(path, self.folder)
+                seen.add(rel)
+                if rel not in files:
+                    self.journal["seq"] += 1
+                    files[rel] = {"seq": self.journal["seq"]}
+                # a file written again keeps its place in the order
+                files[rel].update(size=info.st_size, mtime=info.st_mtime)
+        for rel in list(files):
+            if rel not in seen:
+                del files[rel]
+
+    def status(self) -> Dict:
+        """Return the pending files and bytes, the throughput and the pause reason."""
+        files = self.journal["files"]
+        return {
+            "files": len(files),
+            "bytes": sum(entry["size"] for entry in files.values()),
+            "rate": self.rate,
+            "flushed": self.flushed,
+            "paused": self.paused,
+            "conflicts": self.journal["conflicts"],
+        }
+
+    def batches(self, ready) -> List[List[str]]:
+        """Split the ready files, in order, into batches for one tar stream each."""
+        batches, batch, size = [], [], 0
+        for rel in ready:
+            entry = self.journal["files"][rel]
+            full = len(batch) >= self.batch_files or size + entry["size"] > self.batch_bytes
+            if batch and full:
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append(rel)
+            size += entry["size"]
+        return batches + [batch] if batch else batches
+
+    def flush(self) -> Dict:
+        """Send the settled files, return the report with the new conflicts."""
+        with self.lock:
+            self.load_journal()  # another Spool of the folder may have flushed, before a reload
+            self.scan()
+            files = self.journal["files"]
+            now = time.time()
+            ready = sorted(
+                (rel for rel, entry in files.items() if now - entry["mtime"] >= self.settle),
+                key=lambda rel: files[rel]["seq"],
+            )
+            report = {"files": 0, "bytes": 0, "conflicts": []}
+            if ready and self.reachable():
+                started = time.monotonic()
+                try:
+                    for batch in self.batches(ready):
+                        self.send(batch, report)  # a failed batch stops the later ones
+                except (mod_process.ModProcessExceptions, subprocess.CalledProcessError) as err:
+                    self.failed(err)
+                except OSError as err:
+                    self.paused = f"the spool is not readable: {err}"
+                    log.error(self.paused)
+                seconds = time.monotonic() - started
+                if report["bytes"]:
+                    self.rate = report["bytes"] / seconds if seconds else 0.0
+                self.prune(ready)
+            self.save_journal()
+        return report
+
+    def reachable(self) -> bool:
+        """Return True when the server can be reached, else pause."""
+        mountpoint = self.mountpoint
+        result = mountpoint.conf.reachability.probe([(mountpoint.server, mountpoint.port)])[
+            (mountpoint.server, int(mountpoint.port))
+        ]
+        if not result.reachable:
+            if not self.paused:
+                log.warning(f"Spool of {mountpoint.get_label()} paused: {result.reason}")
+            self.paused = f"{mountpoint.server} is unreachable ({result.reason})"
+            return False
+        if self.paused:
+            log.info(f"Spool of {mountpoint.get_label()} resumes")
+        self.paused = ""
+        return True
+
+    def failed(self, err) -> None:
+        """Pause on a lost connection, else log the error and try again next time."""
+        if isinstance(err, subprocess.CalledProcessError) and err.returncode == 255:
+            self.paused = f"the ssh connection to {self.mountpoint.server} failed"
+        else:
+            self.paused = f"flushing failed: {err}"
+        log.error(f"Spool of {self.mountpoint.get_label()}: {self.paused}")
+
+    def remote_mtimes(self, batch) -> Dict[str, float]:
+        """Return the mtime of the remote files of a batch that exist."""
+        location = self.mountpoint.location
+        paths = " ".join(shlex.quote(rel) for rel in batch)
+        script = f"cd {shlex.quote(location)} 2>/dev/null && stat -c '%Y\t%n' -- {paths}"
+        cmd = mod_ssh.ssh_command(self.mountpoint, f"{script} 2>/dev/null; true")
+        output = self.runner.run(cmd).stdout.decode(errors="surrogateescape")
+        mtimes = {}
+        for line in output.splitlines():
+            mtime, _, rel = line.partition("\t")
+            if rel in batch:
+                mtimes[rel] = float(mtime)
+        return mtimes
+
+    def send(self, batch, report) -> None:
+        """Send one batch with a tar stream, move the conflicts aside."""
+        files = self.journal["files"]
+        remote = self.remote_mtimes(batch)
+        send = []
+        for rel in batch:
+            if remote.get(rel, 0.0) > files[rel]["mtime"] + 1.0:  # changed on the server
+                self.conflict(rel)
+                report["conflicts"].append(rel)
+            else:
+                send.append(rel)
+        if not send:
+            return
+
+        location = shlex.quote(self.mountpoint.location)
+        extract = f"mkdir -p {location} && tar -x -f - -C {location} --no-same-owner"
+        ssh = shlex.join(mod_ssh.ssh_command(self.mountpoint, extract))
+        size = sum(files[rel]["size"] for rel in send)
+        with tempfile.NamedTemporaryFile("wb", prefix="spool-") as names:
+            names.write(b"".join(os.fsencode(rel) + b"\0" for rel in send))
+            names.flush()
+            pack = f"tar -c -f - -C {shlex.quote(self.folder)} --null -T {shlex.quote(names.name)}"
+            # pipefail, a file tar could not read must fail the batch before it is removed
+            cmd = ["bash", "-o", "pipefail", "-c", f"{pack} | {ssh}"]
+            self.runner.run(cmd, timeout=max(60, size / MIB * 10))
+
+        for rel in send:
+            entry = files[rel]
+            path = os.path.join(self.folder, rel)
+            try:
+                st = os.stat(path)
+                if st.st_size == entry["size"] and st.st_mtime == entry["mtime"]:
+                    os.remove(path)  # else written again meanwhile, it is sent again later
+                    del files[rel]
+            except FileNotFoundError:
+                del files[rel]
+        report["files"] += len(send)
+        report["bytes"] += size
+        self.flushed += size
+        log.info(f"Spool of {self.mountpoint.get_label()}: sent {len(send)} files, {size} bytes")
+
+    def conflict(self, rel) -> None:
+        """Move a spooled file that would overwrite a newer remote one to '.conflicts'."""
+        target = os.path.join(self.folder, CONFLICTS, rel)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(os.path.join(self.folder, rel), target)
+        del self.journal["files"][rel]
+        self.journal["conflicts"] += 1
+        log.warning(f"Spool of {self.mountpoint.get_label()}: {rel} is newer on the server")
+
+    def prune(self, sent) -> None:
+        """Remove the folders the sent files left empty in the spool."""
+        folders = {os.path.dirname(rel) for rel in sent}
+        for folder in sorted(folders, key=len, reverse=True):
+            while folder:
+                try:
+                    os.rmdir(os.path.join(self.folder, folder))  # only an empty folder
+                except OSError:
+                    break
+                folder = os.path.dirname(folder)
+
+
+def describe(status) -> str:
+    """Return the short text of a spool status, for the mount list."""
+    if not status:
+        return ""
+    text = f"spool {status['files']} files {human_size(status['bytes'])}"
+    if status["paused"]:
+        return f"{text} (paused)"
+    if status["rate"]:
+        text += f", {human_size(status['rate'])}/s"
+    return text